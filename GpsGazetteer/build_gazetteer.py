@@ -1,5 +1,6 @@
 from geoparsing import geoparser
 from geoparsing.gps_tools import find_gps_coordinates, cover_up_gps
+from geoparsing.results import GeoAddress
 from text_tools import text_mark
 
 from GpsGazetteer.common import GeoName, MapPoint
@@ -29,7 +30,7 @@ class MapPointBuilder(object):
     def _build(self, first_geo, gps_s, nowadays_main: bool):
         # Разбираем результат парсинга и если получаем достаточно полное указание на точку на карте,
         # генерируем точки на карте по количествую упомянутых gps координат
-        geo = GeoName.build_from_geoparser_dict(first_geo.parsed, nowadays_main=nowadays_main)
+        geo = GeoName.build_from_geoparser_result(first_geo.parsed, nowadays_main=nowadays_main)
         if not geo.is_complete_point():
             raise ValueError("NOT COMPLETE GEO")
 
@@ -108,7 +109,11 @@ class MapPointsBuilder:
             tmp_geo = get_geo(stub + line)
             if tmp_geo.start == 0 and tmp_geo.end == first_geo.end + len(stub):
                 # удаляем фиктивный тип и сохраняем
-                del tmp_geo.parsed["Town"]["Type"]
+                if isinstance(tmp_geo.parsed, GeoAddress):
+                    tmp_geo = tmp_geo._replace(parsed=tmp_geo.parsed._replace(
+                        town=tmp_geo.parsed.town._replace(type=None)))
+                else:
+                    del tmp_geo.parsed["Town"]["Type"]
                 first_geo = tmp_geo
         return first_geo
 
@@ -206,5 +211,7 @@ def convert_to_sqlite(file_pkl):
 
 
 if __name__ == "__main__":
+    # словари разбора здесь не нужны - GeoName строится прямо из объектов
+    geoparser.set_result_type("object")
     p = build_points_main()
     convert_to_sqlite(p)
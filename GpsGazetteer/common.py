@@ -1,5 +1,6 @@
 from collections import namedtuple
 
+from geoparsing.results import GeoAddress
 from text_tools.text_transform import camel_case_to_snake_case
 
 GeoNameItem = namedtuple("GeoNameItem", ['name', 'type', 'parsed'])
@@ -17,6 +18,30 @@ class GeoName(object):
         for field in self.__slots__:
             setattr(self, field, None)
 
+    @staticmethod
+    def build_from_geoparser_result(parsed, nowadays_main=False):
+        """
+        Строит гео-название на основе результата работы геопарсера - словаря или results.GeoAddress
+        (см. geoparsing.geoparser.set_result_type)
+        """
+        if not isinstance(parsed, GeoAddress):
+            return GeoName.build_from_geoparser_dict(parsed, nowadays_main)
+        geo = GeoName()
+        nowadays = []
+        for section, data in parsed.sections():
+            if data.nowadays is not None:
+                nowadays.append(data.nowadays)
+            geo.add(section, data.name, data.type, data)
+        # Ленинград, ныне С.Петербург - в словаре разбора этот ключ тоже последний
+        if parsed.nowadays is not None:
+            nowadays.append(parsed.nowadays)
+
+        for n in nowadays:
+            for section, data in n.sections():
+                geo.add(section, data.name, data.type, data, overwrite=nowadays_main)
+
+        return geo
+
     @staticmethod
     def build_from_geoparser_dict(parsed, nowadays_main=False):
         """
@@ -14,7 +14,7 @@ def build_geo_name(name: str) -> GeoName:
     except geoparser.GeoParserException as ex:
         raise GazetteerException(ex) from ex
     else:
-        return GeoName.build_from_geoparser_dict(parsed)
+        return GeoName.build_from_geoparser_result(parsed)
 
 
 class SimpleGpsGazetteer:
@@ -159,14 +159,14 @@ def demo():
             print("ERROR: ", ex)
         else:
             print("Parsed:", geo)
-            geo1 = GeoName.build_from_geoparser_dict(geo)
+            geo1 = GeoName.build_from_geoparser_result(geo)
             print("Search as:", geo1)
             found = False
             for p in Geocoder.find(geo1):
                 found = True
                 print(p)
             if not found:
-                geo2 = GeoName.build_from_geoparser_dict(geo, nowadays_main=True)
+                geo2 = GeoName.build_from_geoparser_result(geo, nowadays_main=True)
                 if geo2 != geo1:
                     print("Another search as:", geo2)
                     for p in Geocoder.find(geo2):
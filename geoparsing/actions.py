@@ -0,0 +1,121 @@
+"""
+Действия разбора (parse actions) грамматики: нормализация названия и типа и флаг isTypeBeforeTitle.
+
+Грамматика (grammar.py) навешивает их на элементы, а geoparser выбирает режим, в котором они выполняются
+(см. geoparser.set_actions_mode), и выполняет отложенные действия для окончательного разбора (as_dict).
+Откладываются действия только внутри deferring(), так что разбор самой грамматикой (Geo.parseString и т.п.)
+всегда выполняет их сразу.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from pyparsing import ParseResults
+
+# Режим действий разбора (см. geoparser.set_actions_mode)
+MODES = ("eager", "deferred")
+_mode = "deferred"
+# откладываются ли действия сейчас, в этом потоке (см. deferring)
+_local = threading.local()
+
+
+def set_mode(mode: str):
+    """
+    Устанавливает режим действий разбора, см. geoparser.set_actions_mode
+    """
+    global _mode
+    if mode not in MODES:
+        raise ValueError(f"Unknown actions mode {mode}, expected one of {', '.join(MODES)}")
+    _mode = mode
+
+
+def get_mode() -> str:
+    """
+    Возвращает текущий режим действий разбора
+    """
+    return _mode
+
+
+@contextmanager
+def deferring():
+    """
+    Внутри блока в режиме deferred действия разбора этого потока откладываются; разбор, полученный
+    в блоке, надо превратить в словарь через as_dict, иначе в нём останется _deferred
+    """
+    previous = getattr(_local, "active", False)
+    _local.active = _mode == "deferred"
+    try:
+        yield
+    finally:
+        _local.active = previous
+
+
+def deferrable(action):
+    """
+    Оборачивает действие разбора так, что внутри deferring() в режиме deferred оно не выполняется сразу,
+    а запоминается в результатах разбора под именем _deferred (см. run_deferred_actions)
+    """
+
+    # полная сигнатура (строка, позиция, лексемы): иначе pyparsing подбирает число аргументов пробными вызовами,
+    # а это при первых вызовах из нескольких потоков сразу ломает действие насовсем
+    def deferrable_action(s, loc, x):
+        if getattr(_local, "active", False):
+            x['_deferred'] = (x['_deferred'] if '_deferred' in x else ()) + (action,)
+        else:
+            action(x)
+
+    return deferrable_action
+
+
+def run_deferred_actions(tokens):
+    """
+    Выполняет отложенные действия во всех вложенных результатах разбора.
+    Именованные результаты обходятся тоже: FollowedBy убирает лексемы из списка, но оставляет имена.
+    """
+    if '_deferred' in tokens:
+        actions = tokens['_deferred']
+        del tokens['_deferred']
+        for action in actions:
+            action(tokens)
+    seen = set()
+    for x in list(tokens) + list(tokens.values()):
+        if isinstance(x, ParseResults) and id(x) not in seen:
+            seen.add(id(x))
+            run_deferred_actions(x)
+
+
+def as_dict(tokens):
+    """
+    Словарь окончательного разбора: отложенные действия выполняются здесь, один раз
+    """
+    run_deferred_actions(tokens)
+    return tokens.asDict()
+
+
+def is_type_before_title_setter(x):
+    """
+    Устанавливает флаг, что тип геообъекта написан до его названия
+    Например, погост Ивановский, а не Ивановский погост
+    """
+    if x.Type:
+        x['isTypeBeforeTitle'] = True
+
+
+def normalize_action(geotype):
+    """
+    На основе геотипа строит действие нормализации названия и типа
+    """
+
+    # на тестах к 39 секундам добавляет 20 секунд... Теперь по умолчанию выполняется
+    # только для окончательного разбора, см. geoparser.set_actions_mode
+    def normalizer(x):
+        # Почему-то x.Type не запоминает...
+        t, n = geotype.normalize(x.Type, x.Name, x.isTypeAfterName)
+        x['Name'] = n
+        if t:
+            x['Type'] = t
+
+    return deferrable(normalizer)
+
+
+type_before_title_setter = deferrable(is_type_before_title_setter)
@@ -0,0 +1,56 @@
+"""
+Тесты режимов действий разбора (geoparser.set_actions_mode).
+Запуск: python -m unittest geoparsing.actions_tests
+"""
+
+import unittest
+
+from geoparsing import geoparser
+
+LINE = "Тверская губерния, Кашинский уезд; родился в г. Бежецк Тверской губ."
+EXPECTED = {'Region': {'Name': 'Уфимская', 'Type': 'губерния'}}
+
+
+class ActionsModeTests(unittest.TestCase):
+    def setUp(self):
+        self._mode = geoparser.get_actions_mode()
+        self._engine = geoparser.get_engine()
+        self._prefilter = geoparser.get_prefilter()
+
+    def tearDown(self):
+        geoparser.set_actions_mode(self._mode)
+        geoparser.set_engine(self._engine)
+        geoparser.set_prefilter(self._prefilter)
+
+    def test_grammar_runs_actions(self):
+        for mode in ("eager", "deferred"):
+            with self.subTest(mode=mode):
+                geoparser.set_actions_mode(mode)
+                self.assertEqual(geoparser.Geo.parseString("Уфимской губ.").asDict(), EXPECTED)
+                self.assertEqual(geoparser.parse_string("Уфимской губ."), EXPECTED)
+                self.assertEqual(geoparser.Geo.parseString("Уфимской губ.").asDict(), EXPECTED)
+
+    def test_suspended_scan(self):
+        # пока итератор scan_string стоит, разбор грамматикой не откладывает действия
+        geoparser.set_actions_mode("deferred")
+        geoparser.set_engine("pyparsing")
+        geoparser.set_prefilter("off")
+        found = geoparser.scan_string(LINE)
+        first = next(found)
+        self.assertEqual(geoparser.Geo.parseString("Уфимской губ.").asDict(), EXPECTED)
+        rest = list(found)
+        self.assertEqual([first] + rest, list(geoparser.scan_string(LINE)))
+        self.assertEqual(rest[0].parsed['Town'], {'Name': 'Бежецк', 'Type': 'город', 'isTypeBeforeTitle': True})
+
+    def test_same_results(self):
+        for engine in ("pyparsing", "merged"):
+            with self.subTest(engine=engine):
+                geoparser.set_engine(engine)
+                geoparser.set_actions_mode("eager")
+                eager = list(geoparser.scan_string(LINE))
+                geoparser.set_actions_mode("deferred")
+                self.assertEqual(list(geoparser.scan_string(LINE)), eager)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
+import json
 import os
 import re
-from geoparsing.geoparser import scan_string
+import time
+from geoparsing import geoparser, geotypes, morphology
+from geoparsing.geoparser import scan_many
 from text_tools.rus_eng_letters_confusion import EngInRusWordsTextPreprocessor
 
 
@@ -12,26 +15,36 @@ class TestRunner:
         self._textprocessor = EngInRusWordsTextPreprocessor()
 
     def process(self, test_file):
+        start = time.perf_counter()
         with open(test_file) as f, \
                 _FileMgr(os.path.join(self._path, "success.txt")) as sf, \
                 _FileMgr(os.path.join(self._path, "partial.txt")) as pf, \
                 _FileMgr(os.path.join(self._path, "fail.txt")) as ff:
-            for l in f:
-                l = l.strip()
-                if not l: continue
-                l = self._textprocessor.process(l)
-                l = re.sub(r"\s", " ", l)
-                self._process_item(l, sf, pf, ff)
+            for l, found in scan_many(self._lines(f)):
+                self._process_item(l, found, sf, pf, ff)
+        elapsed = time.perf_counter() - start
 
         print("Success: {0}\n"
               "Partial: {1}\n"
               "Fail: {2}".format(*[x.write_count for x in (sf, pf, ff)]))
+        print("Time: {0:.1f} s".format(elapsed))
         # Эксперименты по параллельной обработке ничего не дали - работает медленнее
         # однопоточной версии - видимо из-за пересылки данных между процессами.
 
-    def _process_item(self, item, success_file, partial_file, fail_file):
-        try:
-            r, s, e = next(scan_string(item))
+    def _lines(self, f):
+        """
+        Пары (строка, строка) для scan_many: id результата - сама строка
+        """
+        for l in f:
+            l = l.strip()
+            if not l: continue
+            l = self._textprocessor.process(l)
+            l = re.sub(r"\s", " ", l)
+            yield l, l
+
+    def _process_item(self, item, found, success_file, partial_file, fail_file):
+        if found:
+            r, s, e = found[0]
 
             if s == 0 and e == len(item):
                 # Если строка целиком разобрана
@@ -43,7 +56,7 @@ class TestRunner:
                 self._save_result(item[:s] + "<" + item[s:e] + ">" + item[e:],
                                   r and None,  # не выводим данные разбора для удобства diff
                                   partial_file)
-        except StopIteration as ex:
+        else:
             self._save_fail(item, fail_file)
 
     def _save_result(self, item, result, file_obj):
@@ -76,5 +89,85 @@ class _FileMgr:
         self._file = None
 
 
-t = TestRunner("out")
-t.process("test_data.txt")
+def _save_slow_lines(file_path, lines):
+    """
+    Записывает медленные строки (см. geoparser.slow_lines): время в мс, строка и результаты разбора в JSON
+    через табуляцию, от самой медленной
+    """
+    with open(file_path, "w", encoding="utf8") as f:
+        for x in lines:
+            f.write("{0:.1f}\t{1}\t{2}\n".format(x.seconds * 1000, x.text,
+                                                 json.dumps(x.results, ensure_ascii=False)))
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Прогон геопарсера по большому набору тестовых данных")
+    parser.add_argument("--engine", default=geoparser.get_engine(),
+                        help="Движок разбора (см. geoparser.set_engine)")
+    parser.add_argument("--packrat", metavar="SIZE",
+                        help="Включить мемоизацию с кэшем на SIZE элементов (unbounded - без ограничения)")
+    parser.add_argument("--packrat-components", action="store_true",
+                        help="Мемоизировать только компоненты адреса и скобки (geoparser.PACKRAT_COMPONENTS)")
+    parser.add_argument("--prefilter", choices=("off", "on", "check"), default=geoparser.get_prefilter(),
+                        help="Режим предварительного фильтра (см. geoparser.set_prefilter)")
+    parser.add_argument("--fast-path", choices=("off", "on", "check"), default=geoparser.get_fast_path(),
+                        help="Режим быстрого разбора частых строк (см. geoparser.set_fast_path)")
+    parser.add_argument("--gazetteer", metavar="DB",
+                        help="Распознавать названия нас. пунктов из sqlite-газеттира (geoparser.load_gazetteer_towns)")
+    parser.add_argument("--result-cache", metavar="SIZE", type=int,
+                        help="Кэшировать результаты разбора SIZE строк (geoparser.enable_result_cache)")
+    parser.add_argument("--budget-steps", metavar="N", type=int,
+                        help="Не больше N шагов разбора на строку (geoparser.set_parse_budget, режим partial)")
+    parser.add_argument("--budget-seconds", metavar="S", type=float,
+                        help="Не больше S секунд разбора на строку (geoparser.set_parse_budget, режим partial)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Профилировать элементы грамматики (geoparser.enable_profiler), счётчики - в JSON-файл FILE")
+    parser.add_argument("--slow-lines", metavar="N", type=int,
+                        help="Замерять время разбора строк (geoparser.enable_line_timing): гистограмма на экран, "
+                             "N самых медленных строк с результатами - в out/slow_lines.txt")
+    args = parser.parse_args()
+
+    geoparser.set_engine(args.engine)
+    geoparser.set_prefilter(args.prefilter)
+    geoparser.set_fast_path(args.fast_path)
+    if args.packrat:
+        geoparser.enable_packrat(None if args.packrat == "unbounded" else int(args.packrat),
+                                 geoparser.PACKRAT_COMPONENTS if args.packrat_components else None)
+    if args.result_cache:
+        geoparser.enable_result_cache(args.result_cache)
+    budget = args.budget_steps is not None or args.budget_seconds is not None
+    if budget:
+        geoparser.set_parse_budget(args.budget_steps, args.budget_seconds, "partial")
+    if args.profile:
+        geoparser.enable_profiler()
+    if args.slow_lines:
+        geoparser.enable_line_timing(args.slow_lines)
+    if args.gazetteer:
+        start = time.time()
+        n = geoparser.load_gazetteer_towns(args.gazetteer)
+        print(f"Gazetteer: {n} names, {time.time() - start:.1f} s")
+    t = TestRunner("out")
+    t.process("test_data.txt")
+    if args.packrat:
+        print(geoparser.packrat_stats())
+    if args.prefilter != "off":
+        print(geoparser.prefilter_stats())
+    if args.fast_path != "off":
+        print(geoparser.fast_path_stats())
+    if args.result_cache:
+        print(geoparser.result_cache_stats())
+    if budget:
+        print(geoparser.parse_budget_stats())
+    if args.profile:
+        profile = geoparser.profiler_stats()
+        with open(args.profile, "w", encoding="utf8") as f:
+            json.dump([x._asdict() for x in profile], f, ensure_ascii=False, indent=1)
+        print(geoparser.format_profile(profile, 20))
+    if args.slow_lines:
+        _save_slow_lines(os.path.join("out", "slow_lines.txt"), geoparser.slow_lines())
+        print(geoparser.format_latency_histogram(geoparser.latency_histogram()))
+    print(geotypes.morph_memo_stats())
+    print(geotypes.normalize_memo_stats())
+    print(morphology.analyzer_stats())
@@ -0,0 +1,202 @@
+"""
+Тесты бюджета разбора (geoparser.set_parse_budget) и подмены ParserElement._parseNoCache.
+Запуск: python -m unittest geoparsing.budget_tests
+"""
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from pyparsing import ParserElement
+
+from geoparsing import geoparser, geotypes
+from geoparsing.geoparser import ParseBudgetExceeded
+
+LINE = "Тверская губерния, Кашинский уезд; родился в г. Бежецк Тверской губ.; " \
+       "жил в с. Карасий Исток Пермской губ."
+LINES = [LINE, "г. Бежецк Тверской губ.", "с. Карасий Исток Пермской губ. (ныне Свердловской обл.)",
+         "Уфимской губ., Белебеевского у., д. Ивановка", "Тверская губерния, Кашинский уезд"]
+
+_parse_no_cache = ParserElement._parseNoCache
+
+
+class _EngineTests:
+    """
+    Тесты бюджета для одного движка (engine)
+    """
+    engine = None
+
+    def setUp(self):
+        self._engine = geoparser.get_engine()
+        geoparser.set_engine(self.engine)
+        geoparser.reset_parse_budget_stats()
+
+    def tearDown(self):
+        geoparser.set_parse_budget()
+        geoparser.reset_parse_budget_stats()
+        geoparser.set_engine(self._engine)
+
+    def _full_steps(self, s):
+        """
+        Число шагов разбора строки s целиком и найденные гео-названия
+        """
+        geoparser.set_parse_budget(steps=10 ** 9)
+        geoparser.reset_parse_budget_stats()
+        found = list(geoparser.scan_string(s))
+        steps = geoparser.parse_budget_stats().max_steps
+        geoparser.reset_parse_budget_stats()
+        return steps, found
+
+    def _partial_steps(self, s):
+        """
+        Наименьший бюджет в шагах, при котором scan_string в режиме partial находит хоть одно гео-название
+        """
+        lo, hi = 1, self._full_steps(s)[0]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            geoparser.set_parse_budget(steps=mid, mode="partial")
+            if list(geoparser.scan_string(s)):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def test_parse_string_raises(self):
+        geoparser.set_parse_budget(steps=5)
+        with self.assertRaises(ParseBudgetExceeded) as cm:
+            geoparser.parse_string("Тверская губерния, Кашинский уезд")
+        self.assertGreater(cm.exception.steps, 5)
+        self.assertIsInstance(cm.exception, geoparser.GeoParserException)
+        self.assertEqual(geoparser.parse_budget_stats().exceeded, 1)
+
+    def test_steps_do_not_depend_on_history(self):
+        # нормализация запоминается, поэтому её шаги не считаются: с пустым мемо и после других строк - столько же
+        geotypes.clear_memo()
+        steps, found = self._full_steps(LINE)
+        for s in LINES[1:]:
+            list(geoparser.scan_string(s))
+        self.assertEqual(self._full_steps(LINE), (steps, found))
+
+    def test_threads(self):
+        # бюджета хватает на LINE впритык: и общий на потоки, и зависящий от мемо нормализации он бы превысил
+        steps, found = self._full_steps(LINE)
+        geoparser.set_parse_budget(steps=steps, mode="partial")
+        expected = [list(geoparser.scan_string(s)) for s in LINES]
+        self.assertEqual(expected[0], found)
+        geoparser.reset_parse_budget_stats()
+        geotypes.clear_memo()
+        with ThreadPoolExecutor(4) as executor:
+            fact = list(executor.map(lambda s: list(geoparser.scan_string(s)), LINES * 4))
+        self.assertEqual(fact, expected * 4)
+        st = geoparser.parse_budget_stats()
+        self.assertEqual((st.inputs, st.max_steps), (len(LINES) * 4, steps))
+
+    def test_within_budget(self):
+        steps, found = self._full_steps(LINE)
+        self.assertEqual(len(found), 3)
+        geoparser.set_parse_budget(steps=steps)
+        self.assertEqual(list(geoparser.scan_string(LINE)), found)
+        st = geoparser.parse_budget_stats()
+        self.assertEqual((st.inputs, st.exceeded, st.max_steps), (1, 0, steps))
+
+    def test_scan_string_partial_and_raise(self):
+        _, found = self._full_steps(LINE)
+        steps = self._partial_steps(LINE)
+
+        geoparser.set_parse_budget(steps=steps, mode="partial")
+        partial = list(geoparser.scan_string(LINE))
+        self.assertTrue(0 < len(partial) < len(found))
+        self.assertEqual(partial, found[:len(partial)])
+
+        geoparser.set_parse_budget(steps=steps, mode="raise")
+        with self.assertRaises(ParseBudgetExceeded) as cm:
+            list(geoparser.scan_string(LINE))
+        self.assertEqual(cm.exception.partial, partial)
+        self.assertEqual(cm.exception.steps, steps + 1)
+
+        geoparser.set_parse_budget(steps=steps - 1, mode="raise")
+        with self.assertRaises(ParseBudgetExceeded) as cm:
+            list(geoparser.scan_string(LINE))
+        self.assertEqual(cm.exception.partial, [])
+
+    def test_time_limit(self):
+        # время сверяется раз в _BUDGET_CLOCK_STEPS шагов - строка должна быть длиннее
+        s = " ".join([LINE] * 5)
+        steps, found = self._full_steps(s)
+        self.assertGreater(steps, geoparser._BUDGET_CLOCK_STEPS)
+        geoparser.set_parse_budget(seconds=0)
+        with self.assertRaises(ParseBudgetExceeded) as cm:
+            list(geoparser.scan_string(s))
+        self.assertEqual(cm.exception.steps, geoparser._BUDGET_CLOCK_STEPS)
+        geoparser.set_parse_budget(seconds=0, mode="partial")
+        partial = list(geoparser.scan_string(s))
+        self.assertLess(len(partial), len(found))
+        self.assertEqual(partial, found[:len(partial)])
+        self.assertEqual(geoparser.parse_budget_stats().exceeded, 2)
+
+
+class PyparsingBudgetTests(_EngineTests, unittest.TestCase):
+    engine = "pyparsing"
+
+
+class FastBudgetTests(_EngineTests, unittest.TestCase):
+    engine = "fast"
+
+
+class ParseHookTests(unittest.TestCase):
+    def tearDown(self):
+        geoparser.set_parse_budget()
+        geoparser.disable_profiler()
+        geoparser.disable_packrat()
+
+    def assertRestored(self, parse):
+        self.assertIs(ParserElement._parseNoCache, _parse_no_cache)
+        self.assertIs(ParserElement._parse, parse)
+
+    def test_budget_without_packrat(self):
+        geoparser.set_parse_budget(steps=100)
+        self.assertIs(ParserElement._parseNoCache, geoparser._budgeted_parse)
+        self.assertIs(ParserElement._parse, geoparser._budgeted_parse)
+        geoparser.set_parse_budget()
+        self.assertRestored(_parse_no_cache)
+
+    def test_budget_with_packrat(self):
+        geoparser.enable_packrat()
+        geoparser.set_parse_budget(steps=100)
+        self.assertIs(ParserElement._parseNoCache, geoparser._budgeted_parse)
+        # packrat вызывает _parseNoCache сам, его _parse не подменяется
+        self.assertIs(ParserElement._parse, ParserElement._parseCache)
+        geoparser.set_parse_budget()
+        self.assertRestored(ParserElement._parseCache)
+        geoparser.disable_packrat()
+        self.assertRestored(_parse_no_cache)
+
+    def test_packrat_toggled_under_budget(self):
+        geoparser.set_parse_budget(steps=100)
+        geoparser.enable_packrat()
+        geoparser.disable_packrat()
+        self.assertIs(ParserElement._parse, geoparser._budgeted_parse)
+        geoparser.set_parse_budget()
+        self.assertRestored(_parse_no_cache)
+
+    def test_profiler_and_budget(self):
+        for packrat in (False, True):
+            with self.subTest(packrat=packrat):
+                if packrat:
+                    geoparser.enable_packrat()
+                parse = ParserElement._parse
+                geoparser.set_parse_budget(steps=10 ** 9)
+                geoparser.enable_profiler()
+                self.assertIs(ParserElement._parseNoCache, geoparser._profiled_parse)
+                geoparser.disable_profiler()
+                self.assertIs(ParserElement._parseNoCache, geoparser._budgeted_parse)
+                geoparser.set_parse_budget()
+                self.assertRestored(parse)
+                geoparser.enable_profiler()
+                geoparser.disable_profiler()
+                self.assertRestored(parse)
+                geoparser.disable_packrat()
+                self.assertRestored(_parse_no_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
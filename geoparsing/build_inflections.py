@@ -0,0 +1,132 @@
+"""
+Построение словаря склонений (см. inflections.py) с помощью pymorphy2:
+python -m geoparsing.build_inflections OUT [--gazetteer DB] [--texts FILE ...]
+"""
+
+from geoparsing import geoparser, geotypes, parsing_ext, inflections
+from geoparsing.lexer import lex
+
+
+def build(file_path, names=(), texts=(), inflects=None):
+    """
+    Строит словарь склонений с помощью pymorphy2.
+    :param file_path: куда записать
+    :param names: названия в именительном падеже (словари resources, газеттир); в словарь попадают
+    их склонения для do_inflects и нормализация всех их форм - в падежах inflects и в родах
+    прилагательного (Уфимская, Уфимской, Уфимского ...)
+    :param texts: строки текстов; нормализация нужна и для всех названий из одного-двух слов в них
+    :param inflects: падежи, в которые склоняют словари грамматики (по умолчанию geoparser.inflects)
+    :return: число записей
+    """
+    if inflects is None:
+        inflects = geoparser.inflects
+    inflections.unload()
+    geotypes.clear_memo()
+
+    items = {}
+    genders = set()
+    for geotype in _geotype_names():
+        items[("gender", geotype, "NOUN")] = gender = geotypes.get_word_gender(geotype, "NOUN")
+        genders.add(gender)
+
+    forms = set()
+    for name in names:
+        forms.add(name)
+        for word in name.split():
+            for x, form in zip(inflects, parsing_ext.inflect_word(word, inflects)):
+                items[("inflect", word, ",".join(sorted(x)))] = form
+        forms.update(parsing_ext.do_inflects(name, inflects))
+        if " " not in name:
+            forms.update(_gender_forms(name, inflects))
+    for s in texts:
+        forms.update(_titles(s))
+
+    for form in forms:
+        items[("case", form, "nomn", "")] = geotypes.inflect_to_case(form, "nomn")
+        for gender in genders:
+            items[("case", form, "nomn", gender)] = geotypes.inflect_to_case_and_gender(form, "nomn", gender)
+
+    inflections.InflectionLexicon.write(file_path, items)
+    return len(items)
+
+
+def _titles(s):
+    """
+    Все названия из одного и двух Title в строке s - в таком виде их передаёт нормализации грамматика
+    """
+    result = set()
+    title = geoparser.Title
+    for x in lex(s):
+        end = title.match(s, x.start)
+        if end is None:
+            continue
+        result.add(s[x.start:end])
+        second = title.match(s, title._skip_whitespace(s, end))
+        if second is not None:
+            result.add(s[x.start:second])
+    return result
+
+
+def _geotype_names():
+    """
+    Канонические имена всех геотипов - normalize согласует название с их родом
+    """
+    result = set()
+    todo = [x for x in vars(geotypes).values() if isinstance(x, (geotypes.GeoType, geotypes.CompositeGeoType))]
+    while todo:
+        x = todo.pop()
+        if isinstance(x, geotypes.CompositeGeoType):
+            todo.extend(x._inner_geotypes)
+        else:
+            result.add(x.name)
+    return result
+
+
+def _gender_forms(word, inflects):
+    """
+    Формы прилагательного word во всех родах и падежах inflects (и именительном)
+    """
+    result = set()
+    for p in geotypes._parse(word):
+        if p.tag.POS != "ADJF":
+            continue
+        for case in [{'nomn'}] + list(inflects):
+            for gender in ("masc", "femn", "neut"):
+                r = p.inflect(case | {gender})
+                if r:
+                    result.add(r.word.title())
+    return result
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    import sqlite3
+    import time
+    from os import path
+
+    parser = ArgumentParser(description="Построение словаря склонений (см. geoparsing/inflections.py)")
+    parser.add_argument("out", help="файл словаря, например " + inflections.DEFAULT_PATH)
+    parser.add_argument("--gazetteer", metavar="DB", help="sqlite-база газеттира (столбец town таблицы Geo)")
+    parser.add_argument("--texts", metavar="FILE", nargs="*", default=[],
+                        help="тексты, названия из которых тоже нужно нормализовать")
+    args = parser.parse_args()
+
+    start = time.time()
+    names = set()
+    resources = path.join(path.dirname(__file__), 'resources')
+    for name in ("towns.txt", "regions.txt", "countries.txt"):
+        with open(path.join(resources, name), encoding="utf-8") as f:
+            names.update(l.strip() for l in f if l.strip())
+    if args.gazetteer:
+        conn = sqlite3.connect(args.gazetteer)
+        try:
+            names.update(row[0] for row in conn.execute("select distinct town from Geo where town is not null")
+                         if row[0] and row[0][:1].isupper())
+        finally:
+            conn.close()
+    texts = []
+    for file_name in args.texts:
+        with open(file_name, encoding="utf-8") as f:
+            texts.extend(f)
+    n = build(args.out, sorted(names), texts)
+    print(f"{n} entries, {time.time() - start:.1f} s")
@@ -0,0 +1,644 @@
+import re
+import threading
+from geoparsing import geotypes, results
+from geoparsing.parsing_ext import LeafMatcher
+
+# Пробелы, которые pyparsing пропускает перед каждым элементом грамматики
+_white = re.compile(r"[ \n\t\r]*")
+_word_start = re.compile(r"\b")
+_in = re.compile(r"\bв\b")
+_bracket_end = re.compile(r"\)|$")
+_comment = re.compile(r"[^)]+")
+_region_tune = re.compile(r"обл(\.)?")
+
+
+class _Component:
+    """
+    Компонента адреса до нормализации: поля в порядке, в котором их выставляет грамматика,
+    и геотип для нормализации (см. actions.normalize_action)
+    """
+    __slots__ = ("geotype", "fields")
+
+    def __init__(self, geotype, fields):
+        self.geotype = geotype
+        self.fields = fields
+
+
+class _OtherName:
+    """
+    Другое название в скобках: Ивановской (Петровской) обл.
+    """
+    __slots__ = ("head",)
+
+    def __init__(self, head):
+        self.head = head
+
+
+def _build(value):
+    """
+    Словарь разбора - тот же, что ParseResults.asDict() у грамматики на pyparsing
+    """
+    if isinstance(value, list):
+        # именованные результаты: при повторе имени остаётся последнее значение
+        return {k: _build(v) for k, v in value}
+    if isinstance(value, _Component):
+        result = {k: _build(v) for k, v in value.fields}
+        t, n = value.geotype.normalize(result.get("Type", ""), result.get("Name", ""), "")
+        result["Name"] = n
+        if t:
+            result["Type"] = t
+        return result
+    if isinstance(value, _OtherName):
+        return geotypes.inflect_to_case(value.head, 'nomn').title()
+    return value
+
+
+def _build_object(value):
+    """
+    Тот же разбор, что _build, но сразу results.GeoAddress (см. geoparser.set_result_type)
+    """
+    fields = {}
+    order = []
+    for k, v in value:
+        if k == "Nowadays":
+            fields["nowadays"] = _build_object(v)
+            continue
+        field = results.SECTIONS[k]
+        if field not in fields:
+            order.append(field)
+        fields[field] = _build_component(v)
+    return results.GeoAddress(order=tuple(order), **fields)
+
+
+def _build_component(value):
+    fields = {}
+    for k, v in value.fields:
+        if k == "Nowadays":
+            v = _build_object(v)
+        elif k == "NameBrackets":
+            # адрес (ныне ...) либо другое название или комментарий
+            if all(x in results.SECTIONS or x == "Nowadays" for x, _ in v):
+                v = _build_object(v)
+            else:
+                v = results.GeoComponent(**{results.COMPONENT_KEYS[x]: _build(y) for x, y in v})
+        fields[results.COMPONENT_KEYS[k]] = v
+    t, n = value.geotype.normalize(fields.get("type", ""), fields.get("name", ""), "")
+    fields["name"] = n
+    if t:
+        fields["type"] = t
+    return results.GeoComponent(**fields)
+
+
+class DescentParser:
+    """
+    Рукописный разбор гео-названий рекурсивным спуском - движок fast (см. geoparser.set_engine).
+    Повторяет грамматику из geoparser правило за правилом, вплоть до позиций совпадений и имён результатов,
+    поэтому результат разбора тот же, что у грамматики на pyparsing. Из грамматики берутся только
+    элементарные выражения: Title, типы и словари.
+
+    Каждое правило - метод, который по позиции возвращает пару (конец совпадения, узел) или None.
+    Узлы - это сырые поля компонент без нормализации (_Component), списки именованных результатов
+    [(имя, значение)...] и строки. Нормализация названий (самое дорогое) делается только для итогового
+    разбора, в _build. Компоненты адреса и скобки запоминаются по позициям в пределах одной строки:
+    при разборе прямой и обратной цепочек и при поиске в каждой позиции они не разбираются заново.
+    """
+
+    def __init__(self, title, place_type, town_type, town_type_after, sub_district_type, district_type,
+                 sub_region_type, region_type, country_type, republic, preposition,
+                 towns, gazetteer_towns, regions, countries):
+        """
+        :param title: LexedTitle
+        :param place_type: ... country_type: выражения для типов из грамматики (PlaceType, TownType ...)
+        :param republic: geotypes.RepublicExpr
+        :param preposition: предлоги после Place в префиксе
+        :param towns, gazetteer_towns, regions, countries: словари (Lexicon) для компонент без типа
+        """
+        self._title = title
+        self._place_type = LeafMatcher(place_type)
+        self._town_type = LeafMatcher(town_type)
+        self._town_type_after = LeafMatcher(town_type_after)
+        self._republic = LeafMatcher(republic)
+        self._preposition = LeafMatcher(preposition)
+        self._types = [LeafMatcher(x) for x in (sub_district_type, district_type, sub_region_type,
+                                                region_type, country_type)]
+        # NotTownTypes | TownType
+        self._all_types = self._types + [self._town_type]
+        self._dictionaries = {"towns": towns, "gazetteer_towns": gazetteer_towns,
+                              "regions": regions, "countries": countries}
+        self._geotypes = [geotypes.SubDistrict, geotypes.District, geotypes.SubRegion,
+                          geotypes.Region, geotypes.Country]
+        self._names = ["SubDistrict", "District", "SubRegion", "Region", "Country"]
+        # Компоненты в порядке прямой цепочки: Town, SubDistrict, District, SubRegion, Region, Country
+        self._components = [self._town, self._sub_district, self._district, self._sub_region,
+                            self._region, self._country]
+        # строка и запомненные для неё совпадения - свои в каждом потоке, так что разбор можно вызывать
+        # из нескольких потоков сразу
+        self._local = threading.local()
+        # вызывается перед разбором каждого правила в новой позиции; может прервать разбор исключением
+        # (см. geoparser.set_parse_budget)
+        self.step = None
+
+    def parse(self, s, loc, objects=False):
+        """
+        Разбор гео-названия (Geo) в позиции loc, пробелы перед которой уже пропущены.
+        Возвращает пару (конец, словарь разбора) или None; с objects - вместо словаря results.GeoAddress
+        """
+        local = self._local
+        if getattr(local, "text", None) is not s:
+            local.text = s
+            local.memo = {}
+        parsed = self._geo(s, loc)
+        if parsed is None:
+            return None
+        end, nodes = parsed
+        return end, _build_object(nodes) if objects else _build(nodes)
+
+    def reset(self):
+        """
+        Забыть запомненные для последней строки совпадения
+        """
+        self._local.text = None
+        self._local.memo = {}
+
+    # Элементарные выражения. Все принимают позицию до пробелов, как pyparsing
+
+    @staticmethod
+    def _skip(s, loc):
+        if loc < len(s) and s[loc] in " \n\t\r":
+            return _white.match(s, loc).end()
+        return loc
+
+    def _title_at(self, s, loc):
+        """
+        Пара (начало, конец) названия или None
+        """
+        loc = self._skip(s, loc)
+        end = self._title.match(s, loc)
+        return None if end is None else (loc, end)
+
+    def _titles2(self, s, loc):
+        """
+        Title * 2
+        """
+        first = self._title_at(s, loc)
+        return first is not None and self._title_at(s, first[1]) is not None
+
+    def _type_at(self, matcher, s, loc):
+        """
+        Тройка (конец, лексема, имена результатов) или None
+        """
+        return matcher.match(s, self._skip(s, loc))
+
+    def _any_type_at(self, matchers, s, loc):
+        loc = self._skip(s, loc)
+        return any(x.match(s, loc) is not None for x in matchers)
+
+    def _dictionary_at(self, name, s, loc):
+        """
+        Пара (начало, конец) слова из словаря или None
+        """
+        loc = self._skip(s, loc)
+        end = self._dictionaries[name].match(s, loc)
+        return None if end is None else (loc, end)
+
+    def _memoized(self, key, rule, s, loc):
+        key = (key, loc)
+        memo = self._local.memo
+        if key not in memo:
+            if self.step is not None:
+                self.step()
+            memo[key] = rule(s, loc)
+        return memo[key]
+
+    # Geo = Regex(r"\b") + MainGeo + Optional(NowadaysAfterComma) + Optional(".")
+
+    def _geo(self, s, loc):
+        loc = self._skip(s, loc)
+        if not _word_start.match(s, loc):
+            return None
+        main = self._main(s, loc)
+        if main is None:
+            return None
+        end, results = main
+
+        # NowadaysAfterComma = Group(Suppress(Literal(",") + "ныне") + MainGeo)("Nowadays")
+        end = self._skip(s, end)
+        if s.startswith(",", end):
+            loc = self._skip(s, end + 1)
+            if s.startswith("ныне", loc):
+                nowadays = self._main(s, loc + 4)
+                if nowadays is not None:
+                    end = self._skip(s, nowadays[0])
+                    results = results + [("Nowadays", nowadays[1])]
+
+        if s.startswith(".", end):
+            end += 1
+        return end, results
+
+    # MainGeo = Optional(Prefix) + <прямая цепочка> ^ <обратная цепочка>
+
+    def _main(self, s, loc):
+        return self._memoized("main", self._main_impl, s, self._skip(s, loc))
+
+    def _main_impl(self, s, loc):
+        prefix = self._prefix(s, loc)
+        if prefix is None:
+            forward = self._chain(s, loc, range(len(self._components)), True)
+        else:
+            forward = self._chain(s, prefix[0], range(len(self._components)), True)
+            if forward is not None:
+                forward = forward[0], prefix[1] + forward[1]
+        backward = self._chain(s, loc, range(len(self._components) - 1, -1, -1), False)
+        # ^ выбирает самое длинное совпадение, при равенстве - первое, т.е. прямую цепочку
+        if forward is not None and (backward is None or forward[0] >= backward[0]):
+            return forward
+        return backward
+
+    def _chain(self, s, loc, order, forward):
+        """
+        all_sub_chains: первая совпавшая компонента в заданном порядке, за ней необязательные остальные.
+        Разделитель в прямой цепочке - Optional("," | Regex(r"\\bв\\b")), в обратной - Optional(",")
+        """
+        order = list(order)
+        for n, i in enumerate(order):
+            head = self._components[i](s, loc)
+            if head is not None:
+                break
+        else:
+            return None
+
+        end, results = head
+        results = list(results)
+        loc = self._skip(s, end)
+        for i in order[n + 1:]:
+            component_loc = loc
+            if s.startswith(",", loc):
+                component_loc = loc + 1
+            elif forward:
+                m = _in.match(s, loc)
+                if m is not None:
+                    component_loc = m.end()
+            component = self._components[i](s, component_loc)
+            if component is not None:
+                results += component[1]
+                loc = self._skip(s, component[0])
+        return loc, results
+
+    # Prefix = Place + Optional(preposition | ",") | Town("SubTown") + Optional(preposition) + FollowedBy(Town)
+
+    def _prefix(self, s, loc):
+        place = self._place(s, loc)
+        if place is not None:
+            end = self._skip(s, place[0])
+            preposition = self._preposition.match(s, end)
+            if preposition is not None:
+                end = preposition[0]
+            elif s.startswith(",", end):
+                end += 1
+            return end, [("Place", place[1])]
+
+        town = self._town(s, loc)
+        if town is not None:
+            end = self._skip(s, town[0])
+            preposition = self._preposition.match(s, end)
+            if preposition is not None:
+                end = self._skip(s, preposition[0])
+            followed = self._town(s, end)
+            if followed is not None:
+                # FollowedBy оставляет именованные результаты
+                return end, [("SubTown", town[1][0][1]), ("Town", followed[1][0][1])]
+        return None
+
+    # Компоненты адреса. Каждая возвращает пару (конец, [(имя, _Component)...])
+
+    def _place(self, s, loc):
+        return self._memoized("place", self._place_impl, s, self._skip(s, loc))
+
+    def _place_impl(self, s, loc):
+        fields = None
+        # PlaceType + originalTextFor(Title + Optional(Title + ~FollowedBy(TownType | NotTownTypes)))("Name")
+        place_type = self._place_type.match(s, loc)
+        if place_type is not None:
+            end, token, names = place_type
+            name_start = self._skip(s, end)
+            title = self._title_at(s, name_start)
+            if title is not None:
+                name_end = self._skip(s, title[1])
+                second = self._title_at(s, name_end)
+                if second is not None and not self._any_type_at(self._all_types, s, second[1]):
+                    name_end = second[1]
+                end = name_end
+                fields = self._typed([], token, names) + [("Name", s[name_start:name_end])]
+                fields = self._type_before_title(fields)
+
+        # originalTextFor(Title + Optional(Title + FollowedBy(PlaceType)))("Name") + PlaceType + ~FollowedBy(Title * 2)
+        if fields is None:
+            title = self._title_at(s, loc)
+            if title is not None:
+                name_end = self._skip(s, title[1])
+                second = self._title_at(s, name_end)
+                if second is not None and self._type_at(self._place_type, s, second[1]) is not None:
+                    name_end = self._skip(s, second[1])
+                place_type = self._type_at(self._place_type, s, name_end)
+                if place_type is not None and not self._titles2(s, place_type[0]):
+                    end, token, names = place_type
+                    fields = self._typed([("Name", s[loc:name_end])], token, names)
+
+        if fields is None:
+            return None
+        end, fields = self._in_brackets(s, end, fields)
+        return end, _Component(geotypes.Place, fields)
+
+    def _town(self, s, loc):
+        return self._memoized("town", self._town_impl, s, self._skip(s, loc))
+
+    def _town_impl(self, s, loc):
+        parsed = self._town_type_before(s, loc) or self._town_type_after_title(s, loc) or \
+                 self._town_without_type(s, loc)
+        if parsed is None:
+            return None
+        end, fields = self._in_brackets(s, *parsed)
+        return end, [("Town", _Component(geotypes.Town, fields))]
+
+    def _town_type_before(self, s, loc):
+        """
+        TownType + originalTextFor(Title + Optional(Title + ~FollowedBy(Optional(NameBrackets) + AllTypes)))("Name")
+        + Optional(NameBrackets + FollowedBy("("))
+        """
+        town_type = self._town_type.match(s, loc)
+        if town_type is None:
+            return None
+        end, token, names = town_type
+        name_start = self._skip(s, end)
+        title = self._title_at(s, name_start)
+        if title is None:
+            return None
+        name_end = self._skip(s, title[1])
+        second = self._title_at(s, name_end)
+        if second is not None:
+            after = self._skip(s, second[1])
+            brackets = self._name_brackets(s, after)
+            if brackets is not None:
+                after = brackets[0]
+            if not self._any_type_at(self._all_types, s, after):
+                name_end = second[1]
+        fields = self._typed([], token, names) + [("Name", s[name_start:name_end])]
+
+        end = self._skip(s, name_end)
+        brackets = self._name_brackets(s, end)
+        if brackets is not None and s.startswith("(", self._skip(s, brackets[0])):
+            end = self._skip(s, brackets[0])
+            fields.append(("NameBrackets", brackets[1]))
+        return end, self._type_before_title(fields)
+
+    def _town_type_after_title(self, s, loc):
+        """
+        TownAfter:
+            originalTextFor(Title)("Name") + Optional(NameBrackets) + TownTypeAfter + ~FollowedBy(Title * 2) |
+            originalTextFor(Title + Optional(Title))("Name") + TownTypeAfter + ~FollowedBy(Title * 2)
+        """
+        title = self._title_at(s, loc)
+        if title is None:
+            return None
+
+        after = self._skip(s, title[1])
+        brackets = self._name_brackets(s, after)
+        if brackets is not None:
+            after = brackets[0]
+        town_type = self._type_at(self._town_type_after, s, after)
+        if town_type is not None and not self._titles2(s, town_type[0]):
+            end, token, names = town_type
+            fields = [("Name", s[loc:title[1]])]
+            if brackets is not None:
+                fields.append(("NameBrackets", brackets[1]))
+            return end, self._typed(fields, token, names)
+
+        name_end = self._skip(s, title[1])
+        second = self._title_at(s, name_end)
+        if second is not None:
+            name_end = second[1]
+        town_type = self._type_at(self._town_type_after, s, name_end)
+        if town_type is not None and not self._titles2(s, town_type[0]):
+            end, token, names = town_type
+            return end, self._typed([("Name", s[loc:name_end])], token, names)
+        return None
+
+    def _town_without_type(self, s, loc):
+        """
+        Нас. пункт из словаря или originalTextFor(Title)("Name") + FollowedBy(Suppress(Title + AllTypes))
+        """
+        for name in ("towns", "gazetteer_towns"):
+            word = self._dictionary_at(name, s, loc)
+            if word is not None:
+                return word[1], [("Name", s[loc:word[1]])]
+        title = self._title_at(s, loc)
+        if title is not None:
+            end = self._skip(s, title[1])
+            second = self._title_at(s, end)
+            if second is not None and self._any_type_at(self._all_types, s, second[1]):
+                return end, [("Name", s[loc:title[1]])]
+        return None
+
+    def _titled(self, i, s, loc):
+        """
+        Title("Name") + Optional(NameBrackets) + <тип компоненты i из self._types>:
+        пара (конец, поля) или None
+        """
+        title = self._title_at(s, loc)
+        if title is None:
+            return None
+        after = self._skip(s, title[1])
+        brackets = self._name_brackets(s, after)
+        if brackets is not None:
+            after = brackets[0]
+        component_type = self._type_at(self._types[i], s, after)
+        if component_type is None:
+            return None
+        end, token, names = component_type
+        fields = [("Name", s[loc:title[1]])]
+        if brackets is not None:
+            fields.append(("NameBrackets", brackets[1]))
+        return end, self._typed(fields, token, names)
+
+    def _simple_component(self, i, s, loc):
+        """
+        Компонента вида Title + тип + InBrackets (SubDistrict, District, SubRegion без _SubRegionTune)
+        """
+        parsed = self._titled(i, s, loc)
+        if parsed is None:
+            return None
+        end, fields = self._in_brackets(s, *parsed)
+        return end, [(self._names[i], _Component(self._geotypes[i], fields))]
+
+    def _sub_district(self, s, loc):
+        return self._memoized("sub_district", self._sub_district_impl, s, self._skip(s, loc))
+
+    def _sub_district_impl(self, s, loc):
+        return self._simple_component(0, s, loc)
+
+    def _district(self, s, loc):
+        return self._memoized("district", self._district_impl, s, self._skip(s, loc))
+
+    def _district_impl(self, s, loc):
+        return self._simple_component(1, s, loc)
+
+    def _sub_region(self, s, loc):
+        return self._memoized("sub_region", self._sub_region_impl, s, self._skip(s, loc))
+
+    def _sub_region_impl(self, s, loc):
+        parsed = self._simple_component(2, s, loc)
+        if parsed is not None:
+            return parsed
+
+        # _SubRegionTune: Амурской обл. Дальневосточного края
+        # Group(Title("Name") + Regex(r"обл(\.)?")("Type") + InBrackets)("SubRegion") + FollowedBy(Region)
+        title = self._title_at(s, loc)
+        if title is None:
+            return None
+        m = _region_tune.match(s, self._skip(s, title[1]))
+        if m is None:
+            return None
+        end, fields = self._in_brackets(s, m.end(), [("Name", s[loc:title[1]]), ("Type", m.group())])
+        end = self._skip(s, end)
+        region = self._region(s, end)
+        if region is None:
+            return None
+        return end, [("SubRegion", _Component(geotypes.Region, fields))] + region[1]
+
+    def _region(self, s, loc):
+        return self._memoized("region", self._region_impl, s, self._skip(s, loc))
+
+    def _region_impl(self, s, loc):
+        parsed = self._titled(3, s, loc) or self._from_dictionary("regions", s, loc)
+        if parsed is None:
+            return None
+        end, fields = self._in_brackets(s, *parsed)
+        return end, [("Region", _Component(geotypes.Region, fields))]
+
+    def _country(self, s, loc):
+        return self._memoized("country", self._country_impl, s, self._skip(s, loc))
+
+    def _country_impl(self, s, loc):
+        parsed = self._titled(4, s, loc) or self._from_dictionary("countries", s, loc)
+        if parsed is None:
+            # geotypes.RepublicExpr("Type") + Title("Name")
+            republic = self._republic.match(s, loc)
+            if republic is not None:
+                title = self._title_at(s, republic[0])
+                if title is not None:
+                    parsed = title[1], self._type_before_title([("Type", republic[1]),
+                                                                ("Name", s[title[0]:title[1]])])
+        if parsed is None:
+            return None
+        end, fields = self._in_brackets(s, *parsed)
+        return end, [("Country", _Component(geotypes.Country, fields))]
+
+    def _from_dictionary(self, name, s, loc):
+        """
+        Optional(geotypes.RepublicExpr)("Type") + <словарь>("Name")
+        """
+        fields = []
+        end = loc
+        republic = self._republic.match(s, loc)
+        if republic is not None:
+            end = republic[0]
+            fields.append(("Type", republic[1]))
+        word = self._dictionary_at(name, s, end)
+        if word is None:
+            return None
+        fields.append(("Name", s[word[0]:word[1]]))
+        return word[1], self._type_before_title(fields)
+
+    @staticmethod
+    def _typed(fields, token, names):
+        """
+        Тип в полях компоненты - если он попадает в разбор под именем Type
+        (у альтернативы oneOf("слоб. хут.") в TownTypeAfter имени нет)
+        """
+        return fields + [("Type", token)] if "Type" in names else fields
+
+    @staticmethod
+    def _type_before_title(fields):
+        """
+        actions.is_type_before_title_setter
+        """
+        if any(k == "Type" and v for k, v in fields):
+            fields = fields + [("isTypeBeforeTitle", True)]
+        return fields
+
+    # Скобки
+
+    def _in_brackets(self, s, loc, fields):
+        """
+        InBrackets = Optional(NowadaysInBrackets | Comment) после компоненты с полями fields.
+        Возвращает пару (конец, поля с добавленными Nowadays или Comment)
+        """
+        loc = self._skip(s, loc)
+        if not s.startswith("(", loc):
+            return loc, fields
+        parsed = self._brackets(s, loc)
+        if parsed is None:
+            return loc, fields
+        end, kind, value = parsed
+        if kind == "Name":
+            # OtherName в InBrackets не входит, но Comment - это то же самое
+            parsed = self._comment_brackets(s, loc)
+            if parsed is None:
+                return loc, fields
+            end, kind, value = parsed
+        return end, fields + [(kind, value)]
+
+    def _name_brackets(self, s, loc):
+        """
+        NameBrackets = Group(ungroup(NowadaysInBrackets) | OtherName | Comment)("NameBrackets").
+        Пара (конец, [(имя, значение)...]) или None
+        """
+        loc = self._skip(s, loc)
+        if not s.startswith("(", loc):
+            return None
+        parsed = self._brackets(s, loc)
+        if parsed is None:
+            return None
+        end, kind, value = parsed
+        if kind == "Nowadays":
+            return end, value
+        return end, [(kind, value)]
+
+    def _brackets(self, s, loc):
+        return self._memoized("brackets", self._brackets_impl, s, loc)
+
+    def _brackets_impl(self, s, loc):
+        """
+        Первое из NowadaysInBrackets, OtherName, Comment в позиции открывающей скобки:
+        тройка (конец, вид, значение) или None
+        """
+        after = self._skip(s, loc + 1)
+        if s.startswith("ныне", after):
+            after += 4
+        after = self._skip(s, after)
+
+        main = self._main(s, after)
+        if main is not None:
+            end = _bracket_end.match(s, self._skip(s, main[0]))
+            if end is not None:
+                return end.end(), "Nowadays", main[1]
+
+        end = self._title.match(s, after)
+        if end is not None:
+            m = _bracket_end.match(s, self._skip(s, end))
+            if m is not None:
+                return m.end(), "Name", _OtherName(self._title.head(s, after))
+
+        return self._comment_brackets(s, loc)
+
+    def _comment_brackets(self, s, loc):
+        """
+        Comment = ungroup(Suppress("(") + Regex(r"[^)]+") + Suppress(Regex(r"\\)|$")))("Comment")
+        """
+        m = _comment.match(s, self._skip(s, loc + 1))
+        if m is None:
+            return None
+        end = _bracket_end.match(s, self._skip(s, m.end()))
+        if end is None:
+            return None
+        return end.end(), "Comment", m.group()
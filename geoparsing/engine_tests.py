@@ -0,0 +1,64 @@
+"""
+Тесты движков разбора (geoparser.set_engine): на входах parser_tests все движки дают те же словари разбора,
+что и эталонная грамматика на pyparsing, в том числе с префильтром и быстрым разбором.
+Запуск: python -m unittest geoparsing.engine_tests
+"""
+
+import unittest
+
+from geoparsing import geoparser
+from geoparsing.parser_tests import get_test_data, _parse_test_item
+
+LINES = [_parse_test_item(x)[0] for x in get_test_data()]
+
+
+class EngineEquivalenceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._settings = (geoparser.get_engine(), geoparser.get_prefilter(), geoparser.get_fast_path())
+        geoparser.set_engine("pyparsing")
+        geoparser.set_prefilter("off")
+        geoparser.set_fast_path("off")
+        cls.expected = cls._scan()
+        cls.expected_parse = [cls._parse(s) for s in LINES]
+
+    @classmethod
+    def tearDownClass(cls):
+        engine, prefilter, fast_path = cls._settings
+        geoparser.set_engine(engine)
+        geoparser.set_prefilter(prefilter)
+        geoparser.set_fast_path(fast_path)
+
+    @staticmethod
+    def _scan():
+        return [[tuple(x) for x in geoparser.scan_string(s)] for s in LINES]
+
+    @staticmethod
+    def _parse(s):
+        try:
+            return geoparser.parse_string(s)
+        except geoparser.GeoParserException:
+            return None
+
+    def test_scan_string(self):
+        for engine in geoparser._engine_names:
+            for prefilter, fast_path in (("off", "off"), ("on", "off"), ("off", "on")):
+                with self.subTest(engine=engine, prefilter=prefilter, fast_path=fast_path):
+                    geoparser.set_engine(engine)
+                    geoparser.set_prefilter(prefilter)
+                    geoparser.set_fast_path(fast_path)
+                    fact = self._scan()
+                    for s, e, f in zip(LINES, self.expected, fact):
+                        self.assertEqual(f, e, s)
+
+    def test_parse_string(self):
+        geoparser.set_prefilter("off")
+        geoparser.set_fast_path("off")
+        for engine in geoparser._engine_names:
+            with self.subTest(engine=engine):
+                geoparser.set_engine(engine)
+                self.assertEqual([self._parse(s) for s in LINES], self.expected_parse)
+
+
+if __name__ == "__main__":
+    unittest.main()
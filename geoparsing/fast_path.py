@@ -0,0 +1,223 @@
+import re
+from pyparsing import ParseException
+from geoparsing.parsing_ext import expr_regex
+
+_ws = r"[ \t\r\n]*"  # пробелы, которые пропускает pyparsing
+
+
+class Component:
+    """
+    Компонента адреса для FastPath: имя в словаре разбора, выражение для её типа в грамматике
+    и геотип для нормализации (см. geotypes)
+    """
+
+    def __init__(self, key, type_expr, geotype):
+        self.key = key
+        self.type_expr = type_expr
+        self.geotype = geotype
+
+
+class FastPath:
+    """
+    Быстрый разбор самых частых видов строк без грамматики:
+        с. Зеленцино Клинского уезда Московской губ. (ныне Конаковский р-н Тверской обл.).
+    т.е. [тип нас. пункта + название] [название + тип района] [название + тип региона] [(ныне ...)] [.]
+    Строка целиком сопоставляется с регулярным выражением, собранным из тех же выражений типов,
+    что и грамматика. Затем каждая найденная часть проверяется самими выражениями грамматики,
+    и если хоть в чём-то есть сомнение (слово из словаря, слово, похожее на тип другой компоненты,
+    другие знаки и т.п.) - parse() возвращает None, и строку надо разбирать грамматикой.
+    """
+
+    def __init__(self, title, town, district, region, delimeter, all_types, town_name_stop, lexicons):
+        """
+        :param title: выражение для названия (Title)
+        :param town: Component нас. пункта; тип стоит перед названием
+        :param district: Component района; тип стоит после названия
+        :param region: Component региона; тип стоит после названия
+        :param delimeter: разделитель компонент
+        :param all_types: список выражений для всех типов, которые есть в грамматике; там, где ищется тип
+        одной компоненты, не должно быть никакого другого типа, а на месте названия - никакого типа вообще
+        :param town_name_stop: выражение, перед которым второе слово названия нас. пункта не берётся
+        (в грамматике это ~FollowedBy(...) после второго Title)
+        :param lexicons: словари грамматики (Lexicon); слово из словаря на месте названия - повод для сомнений
+        """
+        self._title = title
+        self._town = town
+        self._district = district
+        self._region = region
+        self._delimeter = delimeter
+        self._all_types = all_types
+        self._town_name_stop = town_name_stop
+        self._lexicons = lexicons
+        # Проверять типы самими выражениями грамматики дорого, а их регулярки совпадают
+        # не реже (см. expr_regex) - для проверок "здесь нет типа" этого достаточно
+        self._type_regexes = {}
+        for x in all_types:
+            pattern = expr_regex(x)
+            if pattern is not None:
+                self._type_regexes[x] = re.compile(pattern)
+
+        title_re = r"[А-ЯЁ][а-яё]+(?:-[А-ЯЁ][а-яё]+)?(?![\w-])"
+        delimeter_re = _ws + "(?:" + expr_regex(delimeter) + ")?" + _ws
+
+        def named(name, expr):
+            return "(?P<%s>%s)" % (name, expr_regex(expr))
+
+        town_re = named("town_type", town.type_expr) + _ws + \
+            "(?P<town_name>" + title_re + "(?:" + _ws + title_re + ")?)"
+        district_re = "(?P<district_name>" + title_re + ")" + _ws + named("district_type", district.type_expr)
+        region_re = "(?P<region_name>" + title_re + ")" + _ws + named("region_type", region.type_expr)
+
+        # Цепочка начинается с любой из компонент, остальные необязательны.
+        # За ней - скобки, точка или конец строки: иначе "с. Мусы Каргатского р-на" разобралось бы
+        # как нас. пункт из двух слов, за которым непонятно что
+        self._main = re.compile(
+            "(?:" + town_re + ")?" +
+            "(?:(?(town_type)" + delimeter_re + ")" + district_re + ")?" +
+            "(?:(?(town_type)" + delimeter_re + "|(?(district_name)" + delimeter_re + "))" + region_re + ")?" +
+            "(?=" + _ws + r"(?:[()]|\.?" + _ws + "$))"
+        )
+        self._nowadays_start = re.compile(_ws + r"\(" + _ws + "(?:ныне)?" + _ws)
+        self._nowadays_end = re.compile(_ws + r"\)")
+        self._dot = re.compile(_ws + r"\.")
+        self._space = re.compile(_ws + "$")
+
+    def parse(self, s):
+        """
+        Разбор строки целиком
+        :param s: строка
+        :return: тройка (словарь разбора как в scan_string, начало, конец) или None, если строку надо
+        разбирать грамматикой
+        """
+        start = len(s) - len(s.lstrip(" \t\r\n"))
+        parsed = self._parse_main(s, start)
+        if parsed is None:
+            return None
+        result, end = parsed
+
+        m = self._nowadays_start.match(s, end)
+        if m is not None:
+            # (ныне ...) - относится к последней компоненте
+            nowadays = self._parse_main(s, m.end())
+            if nowadays is None:
+                return None
+            nowadays, end = nowadays
+            m = self._nowadays_end.match(s, end)
+            if m is None:
+                return None
+            end = m.end()
+            result[list(result)[-1]]["Nowadays"] = nowadays
+
+        m = self._dot.match(s, end)
+        if m is not None:
+            end = m.end()
+        if self._space.match(s, end) is None:
+            return None
+        return result, start, end
+
+    def _parse_main(self, s, start):
+        """
+        Разбор цепочки компонент с позиции start.
+        Возвращает пару (словарь разбора, конец) или None
+        """
+        m = self._main.match(s, start)
+        if m is None or m.end() == start:
+            return None
+
+        result = {}
+        titles = []
+        types = []
+        if m.group("town_type") is not None:
+            name_start, name_end = m.span("town_name")
+            title_end = self._title_end(s, name_start)
+            if title_end is None:
+                return None
+            # второе слово названия - по правилу грамматики: берётся, если за ним не идёт тип
+            second_end = self._title_end(s, title_end)
+            if second_end is not None and self._matches(self._town_name_stop, s, second_end):
+                second_end = None
+            if (second_end or title_end) != name_end:
+                return None
+            titles.append((name_start, title_end))
+            types.append((self._town, m.span("town_type")))
+            result["Town"] = self._normalize(s, self._town, m.span("town_type"), (name_start, name_end),
+                                             type_before_title=True)
+
+        for component, key in ((self._district, "district"), (self._region, "region")):
+            if m.group(key + "_name") is None:
+                continue
+            name = m.span(key + "_name")
+            if self._title_end(s, name[0]) != name[1]:
+                return None
+            titles.append(name)
+            types.append((component, m.span(key + "_type")))
+            result[component.key] = self._normalize(s, component, m.span(key + "_type"), name,
+                                                    type_before_title=False)
+
+        for title_start, _ in titles:
+            if self._has_type(s, title_start) or self._in_lexicon(s, title_start):
+                return None
+        for component, (type_start, type_end) in types:
+            if not self._is_own_type(s, component, type_start, type_end) or self._in_lexicon(s, type_start):
+                return None
+        if None in result.values():
+            return None
+        return result, m.end()
+
+    def _title_end(self, s, loc):
+        try:
+            return self._title.tryParse(s, loc)
+        except (ParseException, IndexError):
+            return None
+
+    def _has_type(self, s, loc):
+        return any(self._matches(x, s, loc) for x in self._all_types)
+
+    def _in_lexicon(self, s, loc):
+        return any(x.longest_match(s, loc) is not None for x in self._lexicons)
+
+    def _is_own_type(self, s, component, start, end):
+        """
+        В позиции start тип именно этой компоненты, он заканчивается в end
+        и там не начинается тип никакой другой компоненты и не начинается Title
+        """
+        try:
+            if component.type_expr.tryParse(s, start) != end:
+                return False
+        except (ParseException, IndexError):
+            return False
+        for other in self._all_types:
+            if other is not component.type_expr and self._matches(other, s, start):
+                return False
+        return self._title_end(s, start) is None
+
+    def _matches(self, expr, s, loc):
+        regex = self._type_regexes.get(expr)
+        if regex is not None:
+            return regex.match(s, loc) is not None
+        try:
+            expr.tryParse(s, loc)
+            return True
+        except (ParseException, IndexError):
+            return False
+
+    def _normalize(self, s, component, type_span, name_span, type_before_title):
+        """
+        Словарь компоненты - как после parse action actions.normalize_action в грамматике.
+        None, если нормализация не удалась
+        """
+        _, tokens = component.type_expr._parse(s, type_span[0])
+        _type = tokens[0]
+        name = s[name_span[0]:name_span[1]]
+        try:
+            # как в грамматике: x.isTypeAfterName там никогда не задаётся
+            t, n = component.geotype.normalize(_type, name, "")
+        except ValueError:
+            return None
+        result = {"Type": _type} if type_before_title else {}
+        result["Name"] = n
+        if t:
+            result["Type"] = t
+        if type_before_title:
+            result["isTypeBeforeTitle"] = True
+        return result
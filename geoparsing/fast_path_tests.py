@@ -0,0 +1,73 @@
+"""
+Тесты быстрого разбора частых строк (fast_path.FastPath, geoparser.set_fast_path).
+Запуск: python -m unittest geoparsing.fast_path_tests
+"""
+
+import unittest
+
+from pyparsing import Optional
+
+from geoparsing import geoparser, geotypes
+from geoparsing.fast_path import FastPath, Component
+
+
+class FastPathTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # так же, как в geoparser._fast_path_scan
+        g = geoparser.grammar()
+        cls.fast_path = FastPath(
+            g.Title,
+            Component("Town", g.TownType, geotypes.Town),
+            Component("District", g.DistrictType, geotypes.District),
+            Component("Region", g.RegionType, geotypes.Region),
+            delimeter=g._forward_delimeter,
+            all_types=[g.PlaceType, g.TownType, g.TownTypeAfter, g.SubDistrictType, g.DistrictType,
+                       g.SubRegionType, g.RegionType, g.CountryType, geotypes.RepublicExpr],
+            town_name_stop=Optional(g.NameBrackets) + g.AllTypes,
+            lexicons=[g._towns.lexicon, g._gazetteer_towns, g._regions.lexicon, g._countries.lexicon])
+        cls._settings = (geoparser.get_engine(), geoparser.get_prefilter(), geoparser.get_fast_path())
+        geoparser.set_engine("pyparsing")
+        geoparser.set_prefilter("off")
+        geoparser.set_fast_path("off")
+
+    @classmethod
+    def tearDownClass(cls):
+        engine, prefilter, fast_path = cls._settings
+        geoparser.set_engine(engine)
+        geoparser.set_prefilter(prefilter)
+        geoparser.set_fast_path(fast_path)
+
+    def test_same_as_grammar(self):
+        for s in ["с. Зеленцино Клинского уезда Московской губ. (ныне Конаковский р-н Тверской обл.).",
+                  "  д. Ивановка Белебеевского уезда Уфимской губ.",
+                  "Кашинского уезда Тверской губ.",
+                  "г. Бежецк",
+                  "Пермской губернии"]:
+            with self.subTest(s=s):
+                fact = self.fast_path.parse(s)
+                self.assertIsNotNone(fact)
+                self.assertEqual([fact], [tuple(x) for x in geoparser.scan_string(s)])
+
+    def test_doubtful_lines(self):
+        # слово из словаря, лишний текст, другое название в скобках - разбирает грамматика
+        for s in ["г. Москва Московской губ.",
+                  "с. Карасий Исток Пермской губ., где родился",
+                  "с. Зеленцино (Зеленцыно) Клинского уезда",
+                  "родился в г. Бежецк"]:
+            with self.subTest(s=s):
+                self.assertIsNone(self.fast_path.parse(s))
+
+    def test_check_mode(self):
+        geoparser.reset_fast_path_stats()
+        geoparser.set_fast_path("check")
+        try:
+            for s in ["г. Бежецк Тверской губ.", "родился в г. Бежецк"]:
+                list(geoparser.scan_string(s))
+        finally:
+            geoparser.set_fast_path("off")
+        self.assertEqual(tuple(geoparser.fast_path_stats()), (2, 1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,225 +1,52 @@
-from os import path
-from collections import namedtuple
+import bisect
+import heapq
+import importlib
+import itertools
+import re
+import sys
+import threading
+import time
+import types
+from collections import namedtuple, OrderedDict
 
 from geoparsing.parsing_ext import *
-from geoparsing import geotypes
+from geoparsing import actions, geotypes, results
+from geoparsing.fast_path import FastPath, Component
+from geoparsing.descent import DescentParser
 
-_resources = path.join(path.dirname(__file__), 'resources')
+# Сама грамматика - в grammar.py, она строится при первом разборе (см. grammar())
 
-# ParserElement.enablePackrat()
+# Движки разбора главной части названия (см. set_engine)
+_engine_names = ("pyparsing", "two_phase", "merged", "fast")
+_engine = "merged"
 
-# Падежи, в которых могут быть названия - родительный и предложный
-inflects = [{'gent'}, {'loct'}]
+_grammar = None
+_grammar_lock = threading.Lock()
 
-# Название (одно слово названия)
-Title = Word(srange("[А-ЯЁ]"), srange("[а-яё]"), min=2)
-# Ростов-на-Дону, Центрально-Чернозёмная обл.
-Title += Optional("-" + oneOf("на в")) + Optional("-" + Title)  # двусоставное слово
-Title = Combine(Title)
-# сокращение Большой, Санкт, Малый, Новый, Великий и т.д.
-# включаем в ближайшее слово, дабы сократить грамматику
-Title = Optional(oneOf(['С.-', 'В.', 'Б.', 'М.', 'Н.'])) + Title
-# 2-й Покровский Починок
-Title = Optional(Regex(r"\b[0-9]+-(й|м)\b")) + Title
-Title = originalTextFor(Title)
 
-
-# Parse actions
-
-def _is_type_before_title_setter(x):
-    """
-    Устанавливает флаг, что тип геообъекта написан до его названия
-    Например, погост Ивановский, а не Ивановский погост
-    """
-    if x.Type:
-        x['isTypeBeforeTitle'] = True
-
-
-def _normalize_action(geotype):
+def grammar():
     """
-    На основе геотипа строит действие нормализации названия и типа
+    Модуль грамматики (grammar.py). Импортируется, т.е. строится, при первом обращении - обычно при первом
+    parse_string/scan_string, так что импорт geoparser почти ничего не стоит.
+    Выражения грамматики доступны и как атрибуты этого модуля: geoparser.Town, geoparser.Geo и т.д.
     """
+    global _grammar
+    if _grammar is None:
+        with _grammar_lock:
+            if _grammar is None:
+                g = importlib.import_module("geoparsing.grammar")
+                _apply_engine(g)
+                _grammar = g
+    return _grammar
 
-    # на тестах к 39 секундам добавляет 20 секунд... Вот так можно временно ускорить)
-    # return lambda x: None
-    def normalizer(x):
-        # Почему-то x.Type не запоминает...
-        t, n = geotype.normalize(x.Type, x.Name, x.isTypeAfterName)
-        x['Name'] = n
-        if t:
-            x['Type'] = t
-
-    return normalizer
-
-
-# Типы мест на карте
-PlaceType = geotypes.Place.get_parser_expression()("Type")
-
-# Типы нас. пунктов (дер. Ивановка)
-TownType = geotypes.Town.get_parser_expression()("Type")
-
-# # Типы населённых пунктов после названия, например "Никольская слобода"
-TownTypeAfter = geotypes.TownFull.get_parser_expression()("Type") | \
-                oneOf("слоб. хут.", caseless=True, asKeyword=False)
-
-# Типы подрайонов (волость, улус, сельсовет)
-SubDistrictType = geotypes.SubDistrict.get_parser_expression()("Type")
-
-# Типы районов (районы, уезды)
-DistrictType = geotypes.District.get_parser_expression()("Type")
-
-# Типы подрегионов (округ, автономная область)
-SubRegionType = geotypes.SubRegion.get_parser_expression()("Type")
-
-# Типы регионов (край, область, АССР, губерния)
-RegionType = geotypes.Region.get_parser_expression()("Type")
-
-# Типы стран
-CountryType = geotypes.Country.get_parser_expression()("Type")
-
-NotTownTypes = SubDistrictType | DistrictType | SubRegionType | RegionType | CountryType
-AllTypes = NotTownTypes | TownType
-
-InBrackets = Forward()
-
-# Скобки между названием и типом - Ивановской (Петровской) обл - понимаем примерно также
-NameBrackets = Forward()
 
-# Место
-Place = PlaceType + originalTextFor(
-    Title + Optional(Title + ~FollowedBy(TownType | NotTownTypes)))("Name")
-Place.setParseAction(_is_type_before_title_setter)
-
-PlaceAfter = originalTextFor(Title + Optional(Title + FollowedBy(PlaceType)))("Name") + \
-             PlaceType + ~FollowedBy(Title * 2)
-Place |= PlaceAfter
-
-Place += InBrackets
-Place.setParseAction(_normalize_action(geotypes.Place))
-Place = Group(Place)("Place")
-
-# Населённый пункт
-Town = TownType + originalTextFor(
-    Title + Optional(Title + ~FollowedBy(Optional(NameBrackets) + AllTypes))   # ~FollowedBy(Optional(NameBrackets) + AllTypes)
-)("Name") + Optional(NameBrackets + FollowedBy("("))
-Town.setParseAction(_is_type_before_title_setter)
-
-# Отсеиваем совпадение <Иван слободы> Ивановской Сельского уезда
-TownAfter = originalTextFor(Title)("Name") + Optional(NameBrackets) + TownTypeAfter + ~FollowedBy(Title * 2)
-TownAfter |= originalTextFor(Title + Optional(Title))("Name") + TownTypeAfter + ~FollowedBy(Title * 2)
-
-Town |= TownAfter
-Town |= one_of_file(path.join(_resources, 'towns.txt'), inflects)("Name")
-Town |= originalTextFor(Title)("Name") + FollowedBy(Suppress(Title + AllTypes))
-Town += InBrackets
-# Town = Town + Optional(Group("(" + Town + ")")("Other"))
-Town.setParseAction(_normalize_action(geotypes.Town))
-Town = Group(Town)("Town")
-
-# Подрайон (волость, сельсовет)
-SubDistrict = Title("Name") + Optional(NameBrackets) + SubDistrictType
-SubDistrict += InBrackets
-SubDistrict.setParseAction(_normalize_action(geotypes.SubDistrict))
-SubDistrict = Group(SubDistrict)("SubDistrict")
-
-# Район
-District = Title("Name") + Optional(NameBrackets) + DistrictType
-District += InBrackets
-District.setParseAction(_normalize_action(geotypes.District))
-District = Group(District)("District")
-
-# Подрегион (округ, АО)
-SubRegion = Title("Name") + Optional(NameBrackets) + SubRegionType
-SubRegion += InBrackets
-SubRegion.setParseAction(_normalize_action(geotypes.SubRegion))
-SubRegion = Group(SubRegion)("SubRegion")
-
-# Регион (область, губерния, край, епархия)
-Region = Title("Name") + Optional(NameBrackets) + RegionType
-RegionDict = Optional(geotypes.RepublicExpr)("Type") + \
-             one_of_file(path.join(_resources, 'regions.txt'), inflects)("Name")
-RegionDict.setParseAction(_is_type_before_title_setter)
-
-Region |= RegionDict
-Region += InBrackets
-Region.setParseAction(_normalize_action(geotypes.Region))
-Region = Group(Region)("Region")
-
-# # Маленькое дополнение
-# # Амурской обл. Дальневосточного края - в данном случае обл. это SubRegion, а не Region
-_SubRegionTune = Title("Name") + Regex(r"обл(\.)?")("Type") + InBrackets
-_SubRegionTune.setParseAction(_normalize_action(geotypes.Region))
-
-_SubRegionTune = Group(_SubRegionTune)("SubRegion") \
-                 + FollowedBy(Region)
-
-SubRegion |= _SubRegionTune
-
-# Условно страны, но может входить и в состав бОльшей страны, например ССР в СССР
-Country = Title("Name") + Optional(NameBrackets) + CountryType("Type")
-CountryDict = Optional(geotypes.RepublicExpr)("Type") + \
-              one_of_file(path.join(_resources, 'countries.txt'), inflects)("Name")
-CountryDict.setParseAction(_is_type_before_title_setter)
-
-Country |= CountryDict
-Country |= (geotypes.RepublicExpr("Type") + Title("Name")).setParseAction(_is_type_before_title_setter)
-Country += InBrackets
-Country.setParseAction(_normalize_action(geotypes.Country))
-Country = Group(Country)("Country")
-
-# Главная часть названия
-
-# # Prefix
-preposition = oneOf("в при близ у под", asKeyword=True).suppress()
-Prefix = Place + Optional(preposition | ",")
-# # Дорого! + 5 сек. на тестах
-Prefix |= Town("SubTown") + Optional(preposition) + FollowedBy(Town)
-
-# Прямой разбор - г. Видное Московской области России
-MainGeo = all_sub_chains(Town, SubDistrict, District, SubRegion, Region, Country,
-                         delimeter=Optional("," | Regex(r"\bв\b")),
-                         # item_tail = EndMark
-                         )
-MainGeo = Optional(Prefix) + MainGeo
-
-# Разбор наоборот:  Россия, Московская область, г. Видное
-# NB! Сильно просаживает производительность... Возможно, надо
-# попробовать объединить два вызова all_sub_chains и избавистья от ^
-# (поиск наиболее длинного совпадения) в пользу | (поиск первого совпадения)
-MainGeo ^= all_sub_chains(Country, Region, SubRegion, District, SubDistrict, Town,
-                          delimeter=Optional(",")
-                          )
-
-# Сведения о том, где искать сейчас
-NowadaysInBrackets = Suppress("(" + Optional("ныне")) + MainGeo + Suppress(Regex(r"\)|$"))  # ) могут и забыть
-NowadaysInBrackets = Group(NowadaysInBrackets)("Nowadays")
-
-NowadaysAfterComma = Suppress(Literal(",") + "ныне") + MainGeo
-NowadaysAfterComma = Group(NowadaysAfterComma)("Nowadays")
-
-# # #Nowadays = NowadaysInBrackets | NowadaysAfterComma
-
-# Комментарий для всего того, что разобрать не удалось
-Comment = Suppress("(") + Regex(r"[^)]+") + Suppress(Regex(r"\)|$"))  # закрывающую ')' могут и забыть
-Comment = ungroup(Comment)("Comment")
-
-# Расскажем наконец, как понимать выражения в скобках
-InBrackets << Optional(NowadaysInBrackets | Comment)
-# InBrackets << Empty()
-
-OtherName = Suppress("(" + Optional("ныне")) + Title("Name") \
-            .setParseAction(lambda x: geotypes.inflect_to_case(x[1], 'nomn').title()) + \
-            Suppress(Regex(r"\)|$"))
-
-NameBrackets << Group(ungroup(NowadaysInBrackets) | OtherName | Comment)("NameBrackets")
-
-# Парсер географии строка
-# Слова в скобках будут прикреплены к последней компоненте адреса.
-# И только "ныне" после запятой - к самому адресу...
-Geo = MainGeo + Optional(NowadaysAfterComma)
-
-# \b - чтобы не поймать "и вот ито<г. Москва>, 2020.
-Geo = Regex(r"\b") + Geo + Optional(".")  # + EndMark
+def __getattr__(name):
+    # geoparser.Town, geoparser.PACKRAT_COMPONENTS и т.п. - из грамматики
+    if not name.startswith("__"):
+        g = grammar()
+        if hasattr(g, name):
+            return getattr(g, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def parse_string(s: str, whole_string=True):
@@ -227,7 +54,7 @@ def parse_string(s: str, whole_string=True):
     Разбирает строку с географическим названием на компоненты
     :param s: строка для разбора
     :param whole_string: нужно разбирать всю строку либо можно остановиться в середине, если что-то пойдёт не так?
-    :return: словарь с результатами разбора
+    :return: словарь с результатами разбора (или results.GeoAddress, см. set_result_type)
     Основные ключи словаря (хотя бы один из них обязательно будет):
         Town - населённый пункт (город, деревня, село ...)
         SubDistrict - подрайон (волость, улус, сельсовет)
@@ -257,12 +84,30 @@ def parse_string(s: str, whole_string=True):
     Nowadays также добавляется к списку ключей верхнего уровня в случае ", ныне":
         г.Романов-Борисоглебск, <Nowadays>ныне г.Тутаев</>
     """
+    key = ("parse", s, whole_string)
+    cached = _result_cache_get(key)
+    if cached is not None:
+        return _cached_result(cached)
+    g = grammar()
+    budget = _start_budget()
     try:
-        result = Geo.parseString(s, whole_string).asDict()
+        if _engine == "fast":
+            result = _descent_parse_string(s, whole_string)
+        else:
+            with actions.deferring():
+                result = _parsed(g.Geo.parseString(s, whole_string))
+    except ParseBudgetExceeded as ex:
+        _budget_exceeded(ex)
+        raise
     except Exception as ex:
         raise GeoParserException(ex) from ex
     else:
+        if _result_cache is not None:
+            _result_cache_put(key, _frozen(result))
         return result
+    finally:
+        _stop_budget(budget)
+        _finish_document()
 
 
 GeoTextEntity = namedtuple('GeoTextEntity', ['parsed', 'start', 'end'])
@@ -278,8 +123,1122 @@ def scan_string(s: str) -> GeoTextEntity:
 
     Описание формата разобранного адреса см. в parse_string.
     """
-    for p, s, e in Geo.scanString(s, overlap=False):
-        yield GeoTextEntity(p.asDict(), s, e)
+    try:
+        key = ("scan", s)
+        cached = _result_cache_get(key)
+        if cached is not None:
+            for p, b, e in cached:
+                yield GeoTextEntity(_cached_result(p), b, e)
+            return
+        g = grammar()
+        budget = _start_budget()
+        start = time.perf_counter() if _timing_top is not None else None
+        try:
+            with actions.deferring():
+                matches = _fast_path_scan(s) if _fast_path_mode != "off" else None
+                if matches is None:
+                    if _prefilter_mode != "off":
+                        matches = _prefiltered_scan(s)
+                    elif _engine == "fast":
+                        matches = _descent_scan_string(s)
+                    else:
+                        matches = _deferred_scan_string(g.Geo, s)
+                if _result_cache is not None or budget is not None or start is not None:
+                    # в кэш идёт весь список, бюджет действует только до выдачи результатов, а время разбора
+                    # меряется без времени вызывающего, поэтому и без префильтра строка разбирается до конца сразу
+                    matches = _collect(matches)
+        except ParseBudgetExceeded as ex:
+            if start is not None:
+                _time_line(s, start, ex.partial)
+            ex.partial = [GeoTextEntity(p, b, e) for p, b, e in ex.partial]
+            _budget_exceeded(ex)
+            if _budget_limits[2] == "raise":
+                raise
+            yield from ex.partial
+            return
+        finally:
+            _stop_budget(budget)
+        if start is not None:
+            _time_line(s, start, matches)
+        if _result_cache is not None:
+            _result_cache_put(key, tuple((_frozen(p), b, e) for p, b, e in matches))
+        for p, s, e in matches:
+            yield GeoTextEntity(p, s, e)
+    finally:
+        _finish_document()
+
+
+def parse_many(items, whole_string=True, errors="raise", batch_size=1000, preanalyze=False):
+    """
+    Пакетный parse_string: разбирает строки по очереди и выдаёт результаты в том же порядке.
+    От строки к строке переходят грамматика, мемо нормализации и морфологии, словарь склонений и кэш
+    результатов (если включён); с preanalyze - ещё и таблица разборов слов пачки.
+    :param items: строки или пары (id, строка)
+    :param whole_string: см. parse_string
+    :param errors:
+        raise - GeoParserException на строке, которую не удалось разобрать, прерывает пакет
+        return - вместо результата такой строки выдаётся само исключение
+    :param batch_size: сколько строк читать из items за раз, так что items может быть потоком любой длины
+    :param preanalyze: разбирать морфологию слов каждой пачки заранее (geotypes.preanalyze)
+    :return: итератор результатов parse_string, для пары (id, строка) - пар (id, результат)
+    """
+    if errors not in ("raise", "return"):
+        raise ValueError(f"Unknown errors mode {errors}, expected raise or return")
+    for batch in _batches(items, batch_size, preanalyze):
+        for key, text in batch:
+            try:
+                result = parse_string(text, whole_string)
+            except GeoParserException as ex:
+                if errors == "raise":
+                    raise
+                result = ex
+            yield result if key is _no_key else (key, result)
+
+
+def scan_many(items, batch_size=1000, preanalyze=False):
+    """
+    Пакетный scan_string: ищет гео-адреса в строках по очереди и выдаёт результаты в том же порядке.
+    Кроме того же, что у parse_many, все строки проходят через один префильтр и быстрый разбор частых строк;
+    результаты строки выдаются одним списком, когда она разобрана целиком.
+    :param items: строки или пары (id, строка)
+    :param batch_size: сколько строк читать из items за раз
+    :param preanalyze: разбирать морфологию слов каждой пачки заранее (geotypes.preanalyze)
+    :return: итератор списков GeoTextEntity, для пары (id, строка) - пар (id, список)
+    """
+    for batch in _batches(items, batch_size, preanalyze):
+        for key, text in batch:
+            found = list(scan_string(text))
+            yield found if key is _no_key else (key, found)
+
+
+_no_key = object()  # id строки, переданной без id
+
+
+def _batches(items, batch_size, preanalyze):
+    """
+    Пачки пар (id, строка) из items; сюда же встают общие для пачки подготовка и разбор.
+    Таблица пакетного разбора морфологии (preanalyze) действует, пока разбирается её пачка
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    grammar()
+    it = iter(items)
+    try:
+        while True:
+            batch = [(_no_key, x) if isinstance(x, str) else tuple(x) for x in itertools.islice(it, batch_size)]
+            if not batch:
+                return
+            if preanalyze:
+                geotypes.preanalyze(text for _, text in batch)
+            yield batch
+    finally:
+        if preanalyze:
+            geotypes.clear_preanalysis()
+
+
+# Вид результата parse_string и scan_string (см. set_result_type)
+_result_types = ("dict", "object")
+_result_type = "dict"
+
+
+def set_result_type(result_type: str):
+    """
+    Вид результата разбора в parse_string и scan_string
+    :param result_type:
+        dict - словарь разбора (по умолчанию)
+        object - неизменяемый results.GeoAddress из компонент results.GeoComponent; словарь - его to_dict().
+        GpsGazetteer.common.GeoName.build_from_geoparser_result принимает его без обхода словарей
+    """
+    global _result_type
+    if result_type not in _result_types:
+        raise ValueError(f"Unknown result type {result_type}, expected one of {', '.join(_result_types)}")
+    _result_type = result_type
+
+
+def get_result_type() -> str:
+    """
+    Возвращает текущий вид результата разбора (см. set_result_type)
+    """
+    return _result_type
+
+
+def _parsed(tokens):
+    """
+    Окончательный разбор грамматики в виде, заданном set_result_type; отложенные действия выполняются здесь.
+    Объект собирается прямо из ParseResults, без словаря
+    """
+    if _objects():
+        actions.run_deferred_actions(tokens)
+        return results.from_parse_results(tokens)
+    return actions.as_dict(tokens)
+
+
+def _objects() -> bool:
+    """
+    Собирать ли разбор движка fast сразу в results.GeoAddress (см. set_result_type)
+    """
+    return _result_type == "object"
+
+
+def _frozen(parsed) -> results.GeoAddress:
+    """
+    Разбор (словарь или results.GeoAddress) в виде results.GeoAddress - для кэша результатов и медленных строк
+    """
+    return parsed if isinstance(parsed, results.GeoAddress) else results.from_dict(parsed)
+
+
+PrefilterStats = namedtuple('PrefilterStats', ['lines', 'rejected_lines', 'offsets', 'skipped_offsets',
+                                               'mismatches'])
+"""Счётчики предварительного фильтра: строки, отброшенные строки, позиции, в которых мог начинаться разбор,
+пропущенные позиции, расхождения с разбором без фильтра (в режиме check)"""
+
+_prefilter_modes = ("off", "on", "check")
+_prefilter_mode = "on"
+_prefilter = None
+_geo_start = None
+_prefilter_stats = PrefilterStats(0, 0, 0, 0, 0)
+
+
+def set_prefilter(mode: str):
+    """
+    Режим предварительного фильтра в scan_string.
+    Фильтр строится по грамматике (см. parsing_ext.Prefilter): любое гео-название содержит тип
+    (г., волость, губерния ...) или слово из словаря, так что строки без них не разбираются вовсе,
+    а в остальных разбор не пробуется правее последнего такого слова.
+    :param mode:
+        off - без фильтра, как Geo.scanString
+        on - с фильтром (по умолчанию)
+        check - разбор и с фильтром, и без; возвращается результат без фильтра, а расхождения
+        считаются в prefilter_stats().mismatches
+    """
+    global _prefilter_mode
+    if mode not in _prefilter_modes:
+        raise ValueError(f"Unknown prefilter mode {mode}, expected one of {', '.join(_prefilter_modes)}")
+    _prefilter_mode = mode
+
+
+def get_prefilter() -> str:
+    """
+    Возвращает текущий режим предварительного фильтра (см. set_prefilter)
+    """
+    return _prefilter_mode
+
+
+def prefilter_stats() -> PrefilterStats:
+    """
+    Возвращает счётчики предварительного фильтра, накопленные с момента последнего reset_prefilter_stats()
+    """
+    return _prefilter_stats
+
+
+def reset_prefilter_stats():
+    """
+    Обнуляет счётчики предварительного фильтра
+    """
+    global _prefilter_stats
+    _prefilter_stats = PrefilterStats(0, 0, 0, 0, 0)
+
+
+def _prefiltered_scan(s):
+    """
+    scan_string с предварительным фильтром: итератор троек (словарь разбора, начало, конец)
+    """
+    global _prefilter, _prefilter_stats
+    g = grammar()
+    if _prefilter is None:
+        # разбор грамматики при построении префильтра и т.п. не входит в бюджет строки, на которой он случился
+        with uncounted():
+            _prefilter = Prefilter(g.Geo)
+    if not g.Geo.keepTabs:
+        s = s.expandtabs()
+    last = _prefilter.last_signal(s)
+    fact = [] if last is None else _collect(_scan(s, last))
+
+    mismatch = 0
+    if _prefilter_mode == "check":
+        expected = [(_parsed(p), b, e) for p, b, e in g.Geo.scanString(s, overlap=False)]
+        if fact != expected:
+            mismatch = 1
+            fact = expected
+
+    st = _prefilter_stats
+    _prefilter_stats = PrefilterStats(st.lines + 1, st.rejected_lines + (last is None),
+                                      st.offsets + len(s) + 1,
+                                      st.skipped_offsets + (len(s) + 1 if last is None else len(s) - last),
+                                      st.mismatches + mismatch)
+    return fact
+
+
+def _scan(s, last):
+    """
+    То же, что Geo.scanString(s, overlap=False), но разбор пробуется только в позициях не дальше last,
+    с которых может начинаться Geo (см. parsing_ext.start_regex).
+    Итератор троек (словарь разбора, начало, конец)
+    """
+    global _geo_start
+    g = grammar()
+    if not g.Geo.streamlined:
+        g.Geo.streamline()
+    if _geo_start is None:
+        with uncounted():
+            _geo_start = start_regex(g.Geo) or re.compile("")
+    ParserElement.resetCache()
+    loc = 0
+    for m in _geo_start.finditer(s, 0, last + 1):
+        start = g.Geo.preParse(s, m.start())
+        if start < loc or start > last:
+            continue
+        if _engine == "fast":
+            parsed = _descent_parser().parse(s, start, _objects())
+            if parsed is None:
+                continue
+            end, result = parsed
+        else:
+            try:
+                end, tokens = g.Geo._parse(s, start, callPreParse=False)
+            except ParseException:
+                continue
+            result = _parsed(tokens)
+        if end > start:
+            yield result, start, end
+            loc = end
+
+
+_descent = None
+
+
+def _descent_parser() -> DescentParser:
+    """
+    Парсер для движка fast, строится при первом обращении
+    """
+    global _descent
+    if _descent is None:
+        g = grammar()
+        with uncounted():
+            _descent = DescentParser(g.Title, g.PlaceType, g.TownType, g.TownTypeAfter, g.SubDistrictType,
+                                     g.DistrictType, g.SubRegionType, g.RegionType, g.CountryType,
+                                     geotypes.RepublicExpr, g.preposition.expr, g._towns, g._gazetteer, g._regions,
+                                     g._countries)
+        _descent.step = _budget_step if _budget_installed() else None
+    return _descent
+
+
+def _descent_parse_string(s, whole_string):
+    """
+    Geo.parseString(s, whole_string).asDict() движком fast (или results.GeoAddress, см. set_result_type)
+    """
+    g = grammar()
+    if not g.Geo.keepTabs:
+        s = s.expandtabs()
+    start = g.Geo.preParse(s, 0)
+    parsed = _descent_parser().parse(s, start, _objects())
+    if parsed is None:
+        raise ParseException(s, start, "Expected Geo")
+    end, result = parsed
+    if whole_string and g.Geo.preParse(s, end) < len(s):
+        raise ParseException(s, end, "Expected end of text")
+    return result
+
+
+def _descent_scan_string(s):
+    """
+    Geo.scanString(s, overlap=False) движком fast: итератор троек (словарь разбора, начало, конец)
+    """
+    g = grammar()
+    if not g.Geo.keepTabs:
+        s = s.expandtabs()
+    parser = _descent_parser()
+    loc = 0
+    while loc <= len(s):
+        start = g.Geo.preParse(s, loc)
+        parsed = parser.parse(s, start, _objects())
+        if parsed is not None and parsed[0] > loc:
+            yield parsed[1], start, parsed[0]
+            loc = parsed[0]
+        else:
+            loc = start + 1
+
+
+FastPathStats = namedtuple('FastPathStats', ['lines', 'hits', 'mismatches'])
+"""Счётчики быстрого разбора: строки, строки, разобранные без грамматики, расхождения с грамматикой
+(в режиме check)"""
+
+_fast_path_modes = ("off", "on", "check")
+_fast_path_mode = "off"
+_fast_path = None
+_fast_path_stats = FastPathStats(0, 0, 0)
+
+
+def set_fast_path(mode: str):
+    """
+    Режим быстрого разбора в scan_string (см. fast_path.FastPath).
+    Самые частые строки - "с. Зеленцино Клинского уезда Московской губ. (ныне ...)" - разбираются
+    регулярным выражением, собранным из выражений типов грамматики; всё, в чём есть сомнения,
+    разбирается грамматикой как обычно.
+    :param mode:
+        off - без быстрого разбора (по умолчанию)
+        on - с быстрым разбором
+        check - строка разбирается и так, и грамматикой; возвращается результат грамматики, а расхождения
+        считаются в fast_path_stats().mismatches
+    """
+    global _fast_path_mode
+    if mode not in _fast_path_modes:
+        raise ValueError(f"Unknown fast path mode {mode}, expected one of {', '.join(_fast_path_modes)}")
+    _fast_path_mode = mode
+
+
+def get_fast_path() -> str:
+    """
+    Возвращает текущий режим быстрого разбора (см. set_fast_path)
+    """
+    return _fast_path_mode
+
+
+def fast_path_stats() -> FastPathStats:
+    """
+    Возвращает счётчики быстрого разбора, накопленные с момента последнего reset_fast_path_stats()
+    """
+    return _fast_path_stats
+
+
+def reset_fast_path_stats():
+    """
+    Обнуляет счётчики быстрого разбора
+    """
+    global _fast_path_stats
+    _fast_path_stats = FastPathStats(0, 0, 0)
+
+
+def _fast_path_scan(s):
+    """
+    scan_string через быстрый разбор: список троек (словарь разбора, начало, конец)
+    или None, если строку надо разбирать грамматикой
+    """
+    global _fast_path, _fast_path_stats
+    g = grammar()
+    if _fast_path is None:
+        with uncounted():
+            _fast_path = FastPath(
+                g.Title,
+                Component("Town", g.TownType, geotypes.Town),
+                Component("District", g.DistrictType, geotypes.District),
+                Component("Region", g.RegionType, geotypes.Region),
+                delimeter=g._forward_delimeter,
+                all_types=[g.PlaceType, g.TownType, g.TownTypeAfter, g.SubDistrictType, g.DistrictType,
+                           g.SubRegionType, g.RegionType, g.CountryType, geotypes.RepublicExpr],
+                town_name_stop=Optional(g.NameBrackets) + g.AllTypes,
+                lexicons=[g._towns.lexicon, g._gazetteer_towns, g._regions.lexicon, g._countries.lexicon])
+    if not g.Geo.keepTabs:
+        s = s.expandtabs()
+    parsed = _fast_path.parse(s)
+    fact = None
+    if parsed is not None:
+        # быстрый разбор собирает небольшой словарь сам
+        fact = [(results.from_dict(parsed[0]), parsed[1], parsed[2]) if _objects() else parsed]
+
+    mismatch = 0
+    if _fast_path_mode == "check" and fact is not None:
+        expected = [(_parsed(p), b, e) for p, b, e in g.Geo.scanString(s, overlap=False)]
+        if fact != expected:
+            mismatch = 1
+            fact = expected
+
+    st = _fast_path_stats
+    _fast_path_stats = FastPathStats(st.lines + 1, st.hits + (parsed is not None), st.mismatches + mismatch)
+    return fact
+
+
+PackratStats = namedtuple('PackratStats', ['hits', 'misses', 'documents', 'max_size'])
+"""Счётчики мемоизации: попадания, промахи, число разобранных документов, максимальный размер кэша"""
+
+_packrat_stats = PackratStats(0, 0, 0, 0)
+_packrat_elements = []
+
+def enable_packrat(cache_size_limit=128, elements=None):
+    """
+    Включает мемоизацию (packrat) разбора: результат разбора элемента грамматики
+    в данной позиции запоминается, так что при откатах Title, InBrackets, NameBrackets и т.п.
+    не разбираются заново.
+    Кэш живёт в пределах одного документа - вызова parse_string или scan_string - и
+    очищается по его окончании, так что память не растёт от документа к документу.
+    :param cache_size_limit: максимальное число элементов кэша (вытесняются самые старые),
+    None - без ограничения
+    :param elements: элементы грамматики, которые надо мемоизировать (например, PACKRAT_COMPONENTS).
+    None - мемоизировать все элементы, как ParserElement.enablePackrat
+    """
+    disable_packrat()
+    with ParserElement.packrat_cache_lock:
+        if cache_size_limit is None:
+            ParserElement.packrat_cache = ParserElement._UnboundedCache()
+        else:
+            ParserElement.packrat_cache = ParserElement._FifoCache(cache_size_limit)
+        ParserElement.resetCache()
+        ParserElement._packratEnabled = True
+        if elements is None:
+            ParserElement._parse = ParserElement._parseCache
+        else:
+            for e in elements:
+                e._parse = types.MethodType(ParserElement._parseCache, e)
+                _packrat_elements.append(e)
+
+
+def disable_packrat():
+    """
+    Выключает мемоизацию разбора (см. enable_packrat)
+    """
+    with ParserElement.packrat_cache_lock:
+        ParserElement._parse = ParserElement._parseNoCache
+        for e in _packrat_elements:
+            del e._parse
+        _packrat_elements.clear()
+        ParserElement._packratEnabled = False
+        ParserElement.packrat_cache = {}
+
+
+def packrat_stats() -> PackratStats:
+    """
+    Возвращает счётчики мемоизации, накопленные с момента последнего reset_packrat_stats()
+    """
+    return _packrat_stats
+
+
+def reset_packrat_stats():
+    """
+    Обнуляет счётчики мемоизации
+    """
+    global _packrat_stats
+    _packrat_stats = PackratStats(0, 0, 0, 0)
+
+
+def _finish_document():
+    """
+    Завершение разбора документа: учитываем счётчики мемоизации и очищаем её кэш,
+    забываем позиции, уже разобранные при профилировании
+    """
+    global _packrat_stats
+    if _descent is not None:
+        _descent.reset()
+    _profile_local.state = None
+    with ParserElement.packrat_cache_lock:
+        if not ParserElement._packratEnabled:
+            return
+        hits, misses = ParserElement.packrat_cache_stats
+        size = ParserElement.packrat_cache.__len__()
+        ParserElement.resetCache()
+        st = _packrat_stats
+        _packrat_stats = PackratStats(st.hits + hits, st.misses + misses, st.documents + 1,
+                                      max(st.max_size, size))
+
+
+ResultCacheStats = namedtuple('ResultCacheStats', ['hits', 'misses', 'size', 'bytes', 'max_size', 'max_bytes'])
+"""Счётчики кэша результатов: попадания, промахи, число записей и их примерный объём в байтах, ограничения"""
+
+_result_cache = None  # OrderedDict: ключ -> (результат, объём в байтах); None - кэш выключен
+_result_cache_lock = threading.Lock()
+_result_cache_bytes = 0
+_result_cache_limits = (0, 0)
+_result_cache_hits = 0
+_result_cache_misses = 0
+
+
+def enable_result_cache(max_size=10000, max_bytes=64 * 1024 * 1024):
+    """
+    Включает кэш результатов parse_string и scan_string: одна и та же строка ("г. Владимир.") разбирается
+    один раз. Ключ - сама строка (и whole_string для parse_string): позиции в scan_string и названия зависят
+    от каждого символа, так что приводить строку к каноническому виду (как EngInRusWordsTextPreprocessor)
+    должен вызывающий - до разбора, как это делают bigtest и build_gazetteer.
+    Результаты хранятся как неизменяемые results.GeoAddress; в режиме dict (см. set_result_type) каждое
+    попадание получает свой новый словарь, так что изменить закэшированный результат нельзя.
+    Самые давние записи вытесняются, когда записей больше max_size или их объём больше max_bytes, так что
+    кэш можно держать включённым в долгоживущем процессе. Обращения к кэшу из разных потоков безопасны.
+    load_gazetteer_towns очищает кэш - результаты от него зависят.
+    :param max_size: максимальное число записей
+    :param max_bytes: максимальный примерный объём записей в байтах (строка и результат, sys.getsizeof)
+    """
+    global _result_cache, _result_cache_limits
+    with _result_cache_lock:
+        _result_cache_limits = (max_size, max_bytes)
+        if _result_cache is None:
+            _result_cache = OrderedDict()
+        _evict_results()
+
+
+def disable_result_cache():
+    """
+    Выключает кэш результатов (см. enable_result_cache) и освобождает его память
+    """
+    global _result_cache, _result_cache_bytes
+    with _result_cache_lock:
+        _result_cache = None
+        _result_cache_bytes = 0
+
+
+def clear_result_cache():
+    """
+    Очищает кэш результатов, не выключая его
+    """
+    global _result_cache_bytes
+    with _result_cache_lock:
+        if _result_cache is not None:
+            _result_cache.clear()
+        _result_cache_bytes = 0
+
+
+def result_cache_stats() -> ResultCacheStats:
+    """
+    Возвращает счётчики кэша результатов; попадания и промахи - с момента последнего reset_result_cache_stats()
+    """
+    with _result_cache_lock:
+        return ResultCacheStats(_result_cache_hits, _result_cache_misses,
+                                len(_result_cache) if _result_cache is not None else 0, _result_cache_bytes,
+                                *_result_cache_limits)
+
+
+def reset_result_cache_stats():
+    """
+    Обнуляет счётчики попаданий и промахов кэша результатов
+    """
+    global _result_cache_hits, _result_cache_misses
+    with _result_cache_lock:
+        _result_cache_hits = _result_cache_misses = 0
+
+
+def _result_cache_get(key):
+    """
+    Закэшированный результат или None (в т.ч. если кэш выключен)
+    """
+    global _result_cache_hits, _result_cache_misses
+    if _result_cache is None:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            return None
+        entry = _result_cache.get(key)
+        if entry is None:
+            _result_cache_misses += 1
+            return None
+        _result_cache.move_to_end(key)
+        _result_cache_hits += 1
+        return entry[0]
+
+
+def _result_cache_put(key, value):
+    global _result_cache_bytes
+    size = _approx_size(key) + _approx_size(value)
+    with _result_cache_lock:
+        if _result_cache is None or key in _result_cache:
+            return
+        _result_cache[key] = (value, size)
+        _result_cache_bytes += size
+        _evict_results()
+
+
+def _evict_results():
+    """
+    Вытесняет самые давние записи сверх ограничений (вызывается под _result_cache_lock)
+    """
+    global _result_cache_bytes
+    max_size, max_bytes = _result_cache_limits
+    while _result_cache and (len(_result_cache) > max_size or _result_cache_bytes > max_bytes):
+        _, (_, size) = _result_cache.popitem(last=False)
+        _result_cache_bytes -= size
+
+
+def _approx_size(obj):
+    """
+    Примерный объём объекта в байтах: sys.getsizeof вместе с элементами кортежей
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, tuple):
+        size += sum(_approx_size(x) for x in obj)
+    return size
+
+
+def _cached_result(parsed):
+    """
+    Результат из кэша в виде, заданном set_result_type
+    """
+    return parsed if _result_type == "object" else parsed.to_dict()
+
+
+ParseBudgetStats = namedtuple('ParseBudgetStats', ['inputs', 'exceeded', 'max_steps'])
+"""Счётчики бюджета разбора: строки, разобранные с бюджетом, строки, не уложившиеся в него,
+наибольшее число шагов разбора одной строки"""
+
+_budget_modes = ("raise", "partial")
+_budget_limits = (None, None, "raise")  # шаги, секунды, режим
+_budget_local = threading.local()
+_budget_lock = threading.Lock()
+_budget_stats = ParseBudgetStats(0, 0, 0)
+# Время проверяется раз в столько шагов: perf_counter на каждом шаге заметно замедлил бы разбор
+_BUDGET_CLOCK_STEPS = 64
+_parse_no_cache = ParserElement._parseNoCache
+
+
+def set_parse_budget(steps: int = None, seconds: float = None, mode: str = "raise"):
+    """
+    Ограничивает работу разбора одной строки в parse_string и scan_string, чтобы одна неудачная строка
+    (длинная, из одних слов с заглавной буквы, с непарными скобками) не задерживала всю пачку.
+    Шаг - разбор элемента грамматики pyparsing в позиции (для движка fast - правила в новой позиции).
+    Нормализация и ленивое построение префильтра и т.п. шагов не тратят (parsing_ext.uncounted): их результаты
+    запоминаются, и иначе стоимость строки зависела бы от того, что разбиралось до неё.
+    Проверка идёт в самом цикле разбора, а не по сигналу, так что бюджет работает и в потоках:
+    у каждого потока он свой. Пока бюджет не задан, разбор не замедляется.
+    Если бюджет кончился, parse_string выбрасывает ParseBudgetExceeded (это GeoParserException), а scan_string -
+    в зависимости от mode.
+    :param steps: максимальное число шагов на строку, None - без ограничения
+    :param seconds: максимальное время разбора строки, None - без ограничения
+    :param mode:
+        raise - выбросить ParseBudgetExceeded; найденное до того - в его поле partial
+        partial - scan_string молча возвращает гео-названия, найденные до того, как бюджет кончился
+    """
+    global _budget_limits
+    if mode not in _budget_modes:
+        raise ValueError(f"Unknown parse budget mode {mode}, expected one of {', '.join(_budget_modes)}")
+    _budget_limits = (steps, seconds, mode)
+    _install_parse_hook()
+    if _descent is not None:
+        _descent.step = _budget_step if _budget_installed() else None
+
+
+def get_parse_budget() -> tuple:
+    """
+    Возвращает текущий бюджет разбора: тройку (шаги, секунды, режим), см. set_parse_budget
+    """
+    return _budget_limits
+
+
+def parse_budget_stats() -> ParseBudgetStats:
+    """
+    Возвращает счётчики бюджета разбора, накопленные с момента последнего reset_parse_budget_stats()
+    """
+    return _budget_stats
+
+
+def reset_parse_budget_stats():
+    """
+    Обнуляет счётчики бюджета разбора
+    """
+    global _budget_stats
+    with _budget_lock:
+        _budget_stats = ParseBudgetStats(0, 0, 0)
+
+
+class _Budget:
+    """
+    Бюджет разбора одной строки в текущем потоке
+    """
+    __slots__ = ("steps", "max_steps", "start", "deadline")
+
+    def __init__(self, max_steps, seconds):
+        self.steps = 0
+        self.max_steps = max_steps
+        self.start = time.perf_counter()
+        self.deadline = None if seconds is None else self.start + seconds
+
+
+def _budget_installed():
+    return _budget_limits[0] is not None or _budget_limits[1] is not None
+
+
+def _start_budget():
+    """
+    Начинает отсчёт бюджета для строки в текущем потоке; None, если бюджет не задан
+    """
+    if not _budget_installed():
+        return None
+    budget = _Budget(_budget_limits[0], _budget_limits[1])
+    _budget_local.budget = budget
+    return budget
+
+
+def _stop_budget(budget):
+    global _budget_stats
+    if budget is None:
+        return
+    _budget_local.budget = None
+    with _budget_lock:
+        st = _budget_stats
+        _budget_stats = ParseBudgetStats(st.inputs + 1, st.exceeded, max(st.max_steps, budget.steps))
+
+
+def _budget_exceeded(ex):
+    global _budget_stats
+    with _budget_lock:
+        st = _budget_stats
+        _budget_stats = ParseBudgetStats(st.inputs, st.exceeded + 1, st.max_steps)
+
+
+def _budget_step():
+    """
+    Шаг разбора: ParseBudgetExceeded, если бюджет строки в текущем потоке кончился
+    """
+    budget = getattr(_budget_local, "budget", None)
+    if budget is None or is_uncounted():
+        return
+    budget.steps += 1
+    if budget.max_steps is not None and budget.steps > budget.max_steps or \
+            budget.deadline is not None and budget.steps % _BUDGET_CLOCK_STEPS == 0 and \
+            time.perf_counter() > budget.deadline:
+        raise ParseBudgetExceeded(budget.steps, time.perf_counter() - budget.start)
+
+
+def _budgeted_parse(self, instring, loc, doActions=True, callPreParse=True):
+    _budget_step()
+    return _parse_no_cache(self, instring, loc, doActions, callPreParse)
+
+
+def _deferred_scan_string(expr, s):
+    """
+    expr.scanString(s, overlap=False) с отложенными действиями: итератор троек (словарь разбора, начало, конец).
+    Действия откладываются только на время поиска очередного совпадения - пока итератор стоит,
+    разбор в этом потоке выполняет их сразу
+    """
+    matches = expr.scanString(s, overlap=False)
+    while True:
+        with actions.deferring():
+            m = next(matches, None)
+            if m is None:
+                return
+            p, b, e = m
+            parsed = _parsed(p)
+        yield parsed, b, e
+
+
+def _collect(matches):
+    """
+    Список троек (разбор, начало, конец) из итератора; если бюджет разбора кончился,
+    найденное до того добавляется в partial исключения
+    """
+    found = []
+    try:
+        for m in matches:
+            found.append(m)
+    except ParseBudgetExceeded as ex:
+        ex.partial = found + ex.partial
+        raise
+    return found
+
+
+SlowLine = namedtuple('SlowLine', ['seconds', 'text', 'results'])
+"""Медленная строка scan_string: время разбора в секундах, строка и найденные гео-названия -
+тройки (словарь разбора, начало, конец)"""
+
+# Верхние границы интервалов гистограммы времени разбора строки, в секундах; последний интервал - всё дольше
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+_timing_top = None  # сколько самых медленных строк хранить; None - замер выключен
+_timing_lock = threading.Lock()
+_slow_lines = []  # куча (время, номер строки, строка, результаты) - самая быстрая из хранимых сверху
+_timed_lines = 0
+_latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+def enable_line_timing(top=50):
+    """
+    Включает замер времени разбора каждой строки в scan_string: строится гистограмма времени
+    (latency_histogram) и запоминаются top самых медленных строк с результатами разбора (slow_lines) -
+    готовый набор для проверки изменений грамматики. Строка разбирается до конца сразу, так что время
+    вызывающего между гео-названиями в замер не попадает; ответы из кэша результатов не замеряются.
+    Счётчики обнуляются.
+    :param top: сколько самых медленных строк хранить
+    """
+    global _timing_top
+    reset_line_timing_stats()
+    _timing_top = top
+
+
+def disable_line_timing():
+    """
+    Выключает замер времени разбора строк (см. enable_line_timing)
+    """
+    global _timing_top
+    _timing_top = None
+
+
+def slow_lines() -> list:
+    """
+    Возвращает самые медленные строки (список SlowLine), от самой медленной, с момента последнего
+    reset_line_timing_stats() или enable_line_timing()
+    """
+    with _timing_lock:
+        entries = sorted(_slow_lines, reverse=True)
+    return [SlowLine(seconds, text, [(p.to_dict(), b, e) for p, b, e in found])
+            for seconds, _, text, found in entries]
+
+
+def latency_histogram() -> list:
+    """
+    Возвращает гистограмму времени разбора строк: пары (верхняя граница интервала в секундах, число строк),
+    у последнего интервала граница None
+    """
+    with _timing_lock:
+        return list(zip(LATENCY_BUCKETS + (None,), _latency_counts))
+
+
+def reset_line_timing_stats():
+    """
+    Обнуляет гистограмму времени разбора и список медленных строк
+    """
+    global _timed_lines
+    with _timing_lock:
+        _slow_lines.clear()
+        _timed_lines = 0
+        _latency_counts[:] = [0] * len(_latency_counts)
+
+
+def format_latency_histogram(histogram) -> str:
+    """
+    Гистограмма времени разбора (см. latency_histogram) для вывода в консоль
+    """
+    total = sum(count for _, count in histogram) or 1
+    lines = []
+    lower = 0
+    for upper, count in histogram:
+        label = f"{lower * 1000:g}-{upper * 1000:g} ms" if upper is not None else f">{lower * 1000:g} ms"
+        lines.append("{0:>14} {1:>7} {2:>6.1%} {3}".format(label, count, count / total,
+                                                          "#" * round(50 * count / total)))
+        lower = upper
+    return "\n".join(lines)
+
+
+def _time_line(s, start, matches):
+    """
+    Учитывает время разбора строки s, начатого в момент start; matches - тройки (разбор, начало, конец)
+    """
+    global _timed_lines
+    seconds = time.perf_counter() - start
+    top = _timing_top
+    if top is None:
+        return
+    with _timing_lock:
+        _latency_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        _timed_lines += 1
+        if len(_slow_lines) < top or _slow_lines and seconds > _slow_lines[0][0]:
+            found = [(_frozen(p), b, e) for p, b, e in matches]
+            item = (seconds, _timed_lines, s, found)
+            if len(_slow_lines) < top:
+                heapq.heappush(_slow_lines, item)
+            else:
+                heapq.heapreplace(_slow_lines, item)
+
+
+ProfileEntry = namedtuple('ProfileEntry', ['name', 'attempts', 'successes', 'reattempts', 'time', 'self_time'])
+"""Счётчики профилировщика для элемента грамматики: имя, попытки разбора, удачные попытки,
+повторные попытки в той же позиции той же строки, полное время (с вложенными элементами) и
+собственное время (без вложенных именованных элементов) в секундах"""
+
+_profile = None  # имя элемента -> [попытки, удачные, повторные, время, собственное время]; None - выключен
+_profile_local = threading.local()
+
+
+def enable_profiler():
+    """
+    Включает профилирование грамматики: для каждого элемента, которому set_debug_names дала имя переменной
+    грамматики (Prefix, TownAfter, NameBrackets, ...), считаются попытки разбора, удачные попытки,
+    повторные попытки в той же позиции и время (см. ProfileEntry). Остальные элементы отдельно не учитываются -
+    их время входит в собственное время ближайшего именованного.
+    Профилировщик замедляет разбор в разы и рассчитан на прогон корпуса в одном потоке. Движок fast
+    свои правила разбирает сам и в профиле виден только элементами pyparsing, которые он вызывает.
+    Счётчики обнуляются.
+    """
+    global _profile
+    set_debug_names()
+    _profile = {}
+    _install_parse_hook()
+
+
+def disable_profiler():
+    """
+    Выключает профилирование грамматики (см. enable_profiler)
+    """
+    global _profile
+    _profile = None
+    _install_parse_hook()
+
+
+def profiler_stats(sort_by="time") -> list:
+    """
+    Возвращает счётчики профилировщика (список ProfileEntry), накопленные с момента последнего
+    reset_profiler_stats() или enable_profiler()
+    :param sort_by: поле ProfileEntry, по убыванию которого сортируется список
+    """
+    if sort_by not in ProfileEntry._fields:
+        raise ValueError(f"Unknown profile field {sort_by}, expected one of {', '.join(ProfileEntry._fields)}")
+    entries = [ProfileEntry(name, *counters) for name, counters in list((_profile or {}).items())]
+    entries.sort(key=lambda x: getattr(x, sort_by), reverse=True)
+    return entries
+
+
+def reset_profiler_stats():
+    """
+    Обнуляет счётчики профилировщика
+    """
+    if _profile is not None:
+        _profile.clear()
+
+
+def format_profile(entries, limit=None) -> str:
+    """
+    Таблица счётчиков профилировщика (см. profiler_stats) для вывода в консоль
+    :param limit: сколько первых строк вывести, None - все
+    """
+    lines = ["{0:<32} {1:>10} {2:>10} {3:>10} {4:>9} {5:>9}".format(
+        "name", "attempts", "successes", "reattempts", "time", "self")]
+    for e in entries[:limit]:
+        lines.append("{0:<32} {1:>10} {2:>10} {3:>10} {4:>9.3f} {5:>9.3f}".format(*e))
+    return "\n".join(lines)
+
+
+class _ProfileState:
+    """
+    Состояние профилировщика в текущем потоке: строка, позиции, в которых элементы уже разбирались,
+    и стек времени вложенных именованных элементов
+    """
+    __slots__ = ("text", "seen", "stack")
+
+    def __init__(self, text):
+        self.text = text
+        self.seen = set()
+        self.stack = []
+
+
+def _profiled_parse(self, instring, loc, doActions=True, callPreParse=True):
+    _budget_step()
+    name = _debug_names.get(id(self))
+    profile = _profile
+    if name is None or profile is None or is_uncounted():
+        return _parse_no_cache(self, instring, loc, doActions, callPreParse)
+    state = getattr(_profile_local, "state", None)
+    if state is None or state.text is not instring:
+        # новый документ или другая строка в нём - повторы считаются заново (см. также _finish_document)
+        state = _profile_local.state = _ProfileState(instring)
+    key = (name, loc)
+    reattempt = key in state.seen
+    state.seen.add(key)
+    stack = state.stack
+    stack.append(0.0)
+    success = False
+    start = time.perf_counter()
+    try:
+        result = _parse_no_cache(self, instring, loc, doActions, callPreParse)
+        success = True
+        return result
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        counters = profile.get(name)
+        if counters is None:
+            counters = profile[name] = [0, 0, 0, 0.0, 0.0]
+        counters[0] += 1
+        counters[1] += success
+        counters[2] += reattempt
+        counters[3] += elapsed
+        counters[4] += elapsed - nested
+
+
+_parse_hooks = (_parse_no_cache, _budgeted_parse, _profiled_parse)
+
+
+def _install_parse_hook():
+    """
+    Подменяет ParserElement._parseNoCache обёрткой для бюджета разбора и/или профилировщика, если они включены,
+    иначе возвращает исходный метод. _parseCache (packrat) вызывает _parseNoCache, так что обёртка работает
+    и с мемоизацией
+    """
+    if _profile is not None:
+        hook = _profiled_parse
+    elif _budget_installed():
+        hook = _budgeted_parse
+    else:
+        hook = _parse_no_cache
+    with ParserElement.packrat_cache_lock:
+        if ParserElement._parse in _parse_hooks:
+            ParserElement._parse = hook
+        ParserElement._parseNoCache = hook
+
+
+def set_actions_mode(mode: str):
+    """
+    Когда выполняются действия разбора - нормализация названия и типа (actions.normalize_action, она обращается
+    к pymorphy) и флаг isTypeBeforeTitle.
+    Результаты разбора в обоих режимах одинаковые.
+    :param mode:
+        eager - сразу при совпадении элемента грамматики, в том числе для вариантов, которые потом
+        отбрасываются при откате
+        deferred - один раз для окончательного разбора, после того как parse_string/scan_string его выбрали
+        (по умолчанию)
+    Режим действует только на parse_string/scan_string и пакетные parse_many/scan_many: разбор самой
+    грамматикой (например, Geo.parseString(s).asDict()) всегда выполняет действия сразу.
+    """
+    actions.set_mode(mode)
+
+
+def get_actions_mode() -> str:
+    """
+    Возвращает текущий режим действий разбора (см. set_actions_mode)
+    """
+    return actions.get_mode()
+
+
+def set_engine(name: str):
+    """
+    Выбирает движок разбора главной части гео-названия.
+    Результаты разбора у всех движков одинаковые, различается только скорость.
+    :param name: имя движка:
+        pyparsing - эталонная грамматика на pyparsing (прямая и обратная цепочки компонент через ^)
+        two_phase - сначала поиск компонент адреса, затем проверка их порядка на python
+        merged - как two_phase, но направление цепочки определяется по первой компоненте (по умолчанию)
+        fast - рукописный разбор рекурсивным спуском без pyparsing (см. descent.py)
+    """
+    global _engine, _prefilter, _geo_start
+    if name not in _engine_names:
+        raise ValueError(f"Unknown engine {name}, expected one of {', '.join(_engine_names)}")
+    _engine = name
+    _prefilter = None
+    _geo_start = None
+    if _grammar is not None:
+        _apply_engine(_grammar)
+
+
+def _apply_engine(g):
+    g.MainGeo << g._engines[_engine]
+    g.MainGeo.streamline()
+
+
+def load_gazetteer_towns(db_path: str, cache_path: str = None) -> int:
+    """
+    Добавляет к распознаваемым без типа населённым пунктам (как в resources/towns.txt)
+    все названия из газеттира - столбца town таблицы Geo (см. GpsGazetteer/build_gazetteer.py).
+    Берутся только названия с заглавной буквы, вместе со склонениями.
+    Повторный вызов заменяет ранее загруженные названия.
+    :param db_path: путь к sqlite-базе газеттира
+    :param cache_path: файл для кэша названий со склонениями, по умолчанию db_path + ".towns.txt"
+    :return: количество строк в словаре
+    """
+    global _prefilter, _geo_start
+    g = grammar()
+    if cache_path is None:
+        cache_path = db_path + ".towns.txt"
+    towns = sqlite_lexicon(db_path, "select distinct town from Geo where town is not null",
+                           g.inflects, cache_path)
+    clear_result_cache()
+    g._gazetteer_towns.clear()
+    g._gazetteer_towns.update(x for x in towns if x[:1].isupper())
+    g.MainGeoMerged.update_first_chars()
+    # префильтр и начала гео-названий строятся по словарям - в том числе по названиям газеттира
+    _prefilter = None
+    _geo_start = None
+    return len(g._gazetteer_towns)
+
+
+def get_engine() -> str:
+    """
+    Возвращает имя текущего движка разбора (см. set_engine)
+    """
+    return _engine
 
 
 class GeoParserException(Exception):
@@ -289,13 +1248,30 @@ class GeoParserException(Exception):
     pass
 
 
+class ParseBudgetExceeded(GeoParserException):
+    """
+    Разбор строки не уложился в бюджет (см. set_parse_budget).
+    partial - гео-названия (GeoTextEntity), найденные scan_string до того, как бюджет кончился
+    """
+
+    def __init__(self, steps, elapsed):
+        super().__init__(f"Parse budget exceeded: {steps} steps, {elapsed:.3f} s")
+        self.steps = steps
+        self.elapsed = elapsed
+        self.partial = []
+
+
+_debug_names = {}  # id элемента -> имя, данное set_debug_names
+
+
 def set_debug_names():
     """
     Устанавливает читаемые имена всем ParserElement, которые лежат в памяти... ОПАСНО!
     """
-    for key, var in globals().items():
+    for key, var in vars(grammar()).items():
         if isinstance(var, ParserElement):
             var.setName(key)
+            _debug_names[id(var)] = key
 
 
 def interactive_ui():
@@ -313,13 +1289,41 @@ def interactive_ui():
 
 
 if __name__ == "__main__":
-    import sys
+    # parser_tests работает с модулем geoparsing.geoparser, а не с __main__ - настраиваем его
+    from geoparsing import geoparser
+
+    for engine in _engine_names:
+        if engine in sys.argv:
+            set_engine(engine)
+            geoparser.set_engine(engine)
+
+    for mode in _prefilter_modes:
+        if "prefilter-" + mode in sys.argv:
+            set_prefilter(mode)
+            geoparser.set_prefilter(mode)
+
+    for mode in _fast_path_modes:
+        if "fast-path-" + mode in sys.argv:
+            set_fast_path(mode)
+            geoparser.set_fast_path(mode)
+
+    for mode in actions.MODES:
+        if "actions-" + mode in sys.argv:
+            set_actions_mode(mode)
+            geoparser.set_actions_mode(mode)
+
+    for result_type in _result_types:
+        if "result-" + result_type in sys.argv:
+            set_result_type(result_type)
+            geoparser.set_result_type(result_type)
 
     if 'test' in sys.argv:
         verb = 'verbose' in sys.argv
         from geoparsing.parser_tests import tests_ui
 
         tests_ui(verb)
+        print(geoparser.prefilter_stats())
+        print(geoparser.fast_path_stats())
     else:
         set_debug_names()
         interactive_ui()
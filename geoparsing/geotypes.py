@@ -1,9 +1,10 @@
 # from cPyparsing import *
+import re
 from pyparsing import *
-from functools import reduce
-from pymorphy2 import MorphAnalyzer
-
-_morph = MorphAnalyzer()
+from collections import namedtuple
+from functools import reduce, lru_cache
+from geoparsing import inflections, morphology
+from geoparsing.parsing_ext import LeafMatcher, uncounted
 
 # Настроим работу с русскоязычными ключевыми словами, что 
 # нужно для задания условия совпадения только со словом, а не частью слова в
@@ -11,13 +12,88 @@ _morph = MorphAnalyzer()
 Keyword.DEFAULT_KEYWORD_CHARS += srange("[А-Яа-яЁё]")
 
 
+# Размеры мемо (LRU) для морфологии и нормализации. Названия и типы в текстах повторяются постоянно
+# (Уфимской губ., уезда ...), а разбор слова pymorphy2 дорог. Мемо - functools.lru_cache, так что ими можно
+# пользоваться из нескольких потоков: в худшем случае одно и то же слово будет разобрано дважды
+MORPH_MEMO_SIZE = 16384
+NORMALIZE_MEMO_SIZE = 16384
+
+MemoStats = namedtuple('MemoStats', ['hits', 'misses', 'size', 'max_size'])
+"""Счётчики мемо: попадания, промахи, текущий и максимальный размер"""
+
+
+PreanalysisStats = namedtuple('PreanalysisStats', ['words', 'hits', 'misses'])
+"""Счётчики пакетного разбора: слов в таблице, обращений к морфологии, найденных в таблице, и не найденных"""
+
+# Слова, которые может понадобиться нормализовать: с заглавной буквы, в т.ч. двусоставные (см. Title в грамматике)
+_capitalized = re.compile(r"[А-ЯЁ][а-яё]+(?:-(?:на-|в-)?[А-ЯЁ][а-яё]+)?")
+_preanalysis = {}
+_preanalysis_stats = PreanalysisStats(0, 0, 0)
+
+
+def preanalyze(texts) -> int:
+    """
+    Пакетный разбор морфологии: собирает уникальные слова с заглавной буквы во всех строках texts
+    (документ или пачка строк), разбирает каждое pymorphy2 один раз и делает получившуюся таблицу текущей.
+    Нормализация берёт разборы из таблицы, а слова не из неё по-прежнему разбирает по одному.
+    Таблица действует до следующего preanalyze() или clear_preanalysis(), результаты разбора от неё не зависят.
+    :param texts: строки
+    :return: число слов в таблице
+    """
+    global _preanalysis, _preanalysis_stats
+    words = set()
+    for s in texts:
+        words.update(_capitalized.findall(s))
+    _preanalysis = {w: morphology.parse(w) for w in words}
+    _preanalysis_stats = PreanalysisStats(len(_preanalysis), 0, 0)
+    return len(_preanalysis)
+
+
+def clear_preanalysis():
+    """
+    Убирает таблицу пакетного разбора (см. preanalyze)
+    """
+    global _preanalysis, _preanalysis_stats
+    _preanalysis = {}
+    _preanalysis_stats = PreanalysisStats(0, 0, 0)
+
+
+def preanalysis_stats() -> PreanalysisStats:
+    """
+    Возвращает счётчики текущей таблицы пакетного разбора (см. preanalyze)
+    """
+    return _preanalysis_stats
+
+
+def _parse(word):
+    """
+    Разборы слова pymorphy2 - из таблицы пакетного разбора, если слово там есть
+    """
+    global _preanalysis_stats
+    st = _preanalysis_stats
+    p = _preanalysis.get(word)
+    if p is None:
+        _preanalysis_stats = PreanalysisStats(st.words, st.hits, st.misses + 1)
+        return morphology.parse(word)
+    _preanalysis_stats = PreanalysisStats(st.words, st.hits + 1, st.misses)
+    return p
+
+
 def get_word_gender(word, priority_pos=None):
     if word in ("АССР", "ССР", "АО"):
         return "femn"  # женский род. (а мужской masc)
     if word in ("округ", "починок"):
         return "masc"
+    return _word_gender(word, priority_pos)
+
+
+@lru_cache(maxsize=MORPH_MEMO_SIZE)
+def _word_gender(word, priority_pos):
+    gender = inflections.lookup("gender", word, priority_pos or "")
+    if gender is not None:
+        return gender
     try:
-        p = next(x for x in _morph.parse(word)
+        p = next(x for x in _parse(word)
                  if x.tag.gender and (not priority_pos or x.tag.POS == priority_pos))
         return p.tag.gender
     except StopIteration:
@@ -30,11 +106,7 @@ def inflect_to_case(word, case):
     Среди различных вариантов разбора выбирает первый, у которого есть падеж.
     Если таковых не имеется, возвращает исходное слово.
     """
-    try:
-        p = next(x for x in _morph.parse(word) if x.tag.case)
-        return p.inflect({case}).word
-    except StopIteration:
-        return word
+    return _inflect(word, case, None)
 
 
 def inflect_to_case_and_gender(word, case, gender):
@@ -42,8 +114,22 @@ def inflect_to_case_and_gender(word, case, gender):
     Приводит слово к указанному падежу и роду. При проблемах сначала опускает род, а 
     потом и падеж (т.е. возвращает исходное слово)
     """
+    return _inflect(word, case, gender)
+
+
+@lru_cache(maxsize=MORPH_MEMO_SIZE)
+def _inflect(word, case, gender):
+    """
+    Общее мемо для inflect_to_case (gender=None) и inflect_to_case_and_gender
+    """
+    form = inflections.lookup("case", word, case, gender or "")
+    if form is not None:
+        return form
     try:
-        p = next(x for x in _morph.parse(word) if x.tag.case and x.tag.gender)
+        if gender is None:
+            p = next(x for x in _parse(word) if x.tag.case)
+            return p.inflect({case}).word
+        p = next(x for x in _parse(word) if x.tag.case and x.tag.gender)
         r = p.inflect({case, gender})
         if not r:
             r = p.inflect({case})
@@ -52,6 +138,57 @@ def inflect_to_case_and_gender(word, case, gender):
         return word
 
 
+@lru_cache(maxsize=NORMALIZE_MEMO_SIZE)
+def _memo_normalize(geotype, _type, title, is_type_before_title):
+    """
+    Мемо для normalize: пара (результат, None) или (None, текст ValueError).
+    Неподходящий тип - тоже частый случай (составной геотип перебирает вложенные), поэтому ошибка запоминается.
+    Разбор типа здесь не входит в бюджет разбора строки (parsing_ext.uncounted): он есть только при промахе мемо.
+    """
+    try:
+        with uncounted():
+            return geotype._normalize(_type, title, is_type_before_title), None
+    except ValueError as ex:
+        return None, str(ex)
+
+
+def _normalize(geotype, _type, title, is_type_before_title):
+    result, error = _memo_normalize(geotype, _type, title, is_type_before_title)
+    if error is not None:
+        raise ValueError(error)
+    return result
+
+
+def _memo_stats(*functions):
+    infos = [f.cache_info() for f in functions]
+    return MemoStats(sum(x.hits for x in infos), sum(x.misses for x in infos),
+                     sum(x.currsize for x in infos), sum(x.maxsize for x in infos))
+
+
+def morph_memo_stats() -> MemoStats:
+    """
+    Возвращает счётчики мемо морфологии (inflect_to_case, inflect_to_case_and_gender, get_word_gender),
+    накопленные с момента последнего clear_memo()
+    """
+    return _memo_stats(_inflect, _word_gender)
+
+
+def normalize_memo_stats() -> MemoStats:
+    """
+    Возвращает счётчики мемо нормализации (normalize геотипов), накопленные с момента последнего clear_memo()
+    """
+    return _memo_stats(_memo_normalize)
+
+
+def clear_memo():
+    """
+    Очищает мемо морфологии и нормализации и обнуляет их счётчики
+    """
+    _inflect.cache_clear()
+    _word_gender.cache_clear()
+    _memo_normalize.cache_clear()
+
+
 def is_abbrev_or_sokr(word):
     word = word.strip()
     # АССР или обл.
@@ -76,6 +213,7 @@ class GeoType:
         self.name = name
         self._parser_expression = parser_expression
         self._normalize_type_before = norm_title_if_type_before
+        self._matcher = None  # LeafMatcher выражения, False - выражение не простая альтернатива
 
     @staticmethod
     def from_str(s, norm_title_if_type_before=True, caseless=True, as_keyword=True):
@@ -90,6 +228,47 @@ class GeoType:
         """
         return self._parser_expression
 
+    def type_forms(self):
+        """
+        Все написания типа, если выражение - альтернатива из Literal и Keyword: список пар (строка, без учёта регистра).
+        None, если в выражении есть что-то ещё (Regex и т.п.) - тогда написаний не перечислить.
+        """
+        forms = []
+
+        def collect(expr):
+            if expr.parseAction:
+                return False
+            if isinstance(expr, MatchFirst):
+                return all(collect(e) for e in expr.exprs)
+            if isinstance(expr, Literal):
+                forms.append((expr.match, isinstance(expr, CaselessLiteral)))
+                return True
+            if isinstance(expr, Keyword):
+                forms.append((expr.match, expr.caseless))
+                return True
+            return isinstance(expr, NoMatch)
+
+        return forms if collect(self._parser_expression) else None
+
+    def _matches_type(self, _type):
+        """
+        Относится ли тип (без пробелов по краям) к этому геотипу - то же, что разбор
+        выражением типа всей строки, но одной регуляркой (LeafMatcher), а не перебором элементов
+        """
+        if self._matcher is None:
+            try:
+                self._matcher = LeafMatcher(self._parser_expression)
+            except ValueError:
+                self._matcher = False
+        if self._matcher:
+            m = self._matcher.match(_type, 0)
+            return m is not None and m[0] == len(_type)
+        try:
+            self._parser_expression.parseString(_type, True)
+            return True
+        except ParseException:
+            return False
+
     def normalize(self, _type, title, is_type_before_title=True):
         """
         Приведение названия нас. пункта (title) и его типа (_type) к канонической форме.
@@ -97,8 +276,11 @@ class GeoType:
         Проверяет, что переданный тип соответствует текущему геотипу, а затем
         приводит название к Именительному падежу.
         Возвращает нормализованную пару (тип, имя)
-        
+        Результат запоминается (см. normalize_memo_stats)
         """
+        return _normalize(self, _type, title, is_type_before_title)
+
+    def _normalize(self, _type, title, is_type_before_title):
         # if not _type or not title:
         #    raise TypeError('title and _type are required both\n' +
         #                      f"title=<{title}> _type=<{_type}>")
@@ -111,12 +293,16 @@ class GeoType:
             return None, inflect_to_case(title, "nomn").title()
 
         _type = _type.strip()
-        try:
-            # Проверяем, относится ли переданный тип к данному геотипу
-            self._parser_expression.parseString(_type, True)
-        except ParseException:
+        # Проверяем, относится ли переданный тип к данному геотипу
+        if not self._matches_type(_type):
             raise ValueError(f"Wrong type {_type} for geotype {self.name}")
-            # Если тип не в канонической форме или эта форма аббревиатура или сокращение,
+        return self._normalize_title(_type, title, is_type_before_title)
+
+    def _normalize_title(self, _type, title, is_type_before_title):
+        """
+        Нормализация названия, когда тип (без пробелов по краям) уже проверен
+        """
+        # Если тип не в канонической форме или эта форма аббревиатура или сокращение,
         # то нормализуем (если не отключено _normalize_type_before)
         if _type != self.name or is_abbrev_or_sokr(self.name):
             if not is_type_before_title or self._normalize_type_before:
@@ -128,6 +314,42 @@ class GeoType:
         return self.name, title.title()
 
 
+class GeoTypeMatch(MatchFirst):
+    """
+    Выражение типа составного геотипа: та же альтернатива (MatchFirst) из выражений вложенных простых геотипов,
+    но совпадение ищет одна регулярка (LeafMatcher), а не перебор десятков Literal/Keyword/Regex.
+    Для грамматики и её разбора (префильтр, движок fast) это обычный MatchFirst с теми же элементами.
+    """
+
+    def __init__(self, geotypes):
+        """
+        geotypes - простые геотипы в порядке перебора
+        """
+        super().__init__([g.get_parser_expression() for g in geotypes])
+        # MatchFirst пропускает пробелы в каждой альтернативе, а здесь альтернативы не разбираются - пропускаем сами
+        self.callPreparse = True
+        self._matcher = LeafMatcher(self)
+        # номер простого элемента LeafMatcher -> его геотип
+        self._leaf_geotypes = []
+        for g in geotypes:
+            self._leaf_geotypes += [g] * len(LeafMatcher(g.get_parser_expression()))
+
+    def parseImpl(self, instring, loc, doActions=True):
+        m = self._matcher.match_leaf(instring, loc)
+        if m is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return m[0], m[1]
+
+    def match_geotype(self, instring, loc):
+        """
+        Совпадение в позиции loc (пробелы уже пропущены): тройка (конец, написание типа, простой геотип) или None
+        """
+        m = self._matcher.match_leaf(instring, loc)
+        if m is None:
+            return None
+        return m[0], m[1], self._leaf_geotypes[m[2]]
+
+
 class CompositeGeoType:
     """
     Составной геотип, включающий в себя другие.
@@ -141,11 +363,19 @@ class CompositeGeoType:
         Создаёт составной геотип на основе переданного списка геотипов
         """
         self._inner_geotypes = geotypes
+        self._table = None  # см. _type_table
 
-    def get_parser_expression(self):
+    def get_parser_expression(self, compiled=True):
         """
         Возвращает выражение pyparsing для вставки условия поиска геотипа в грамматику.
+        compiled - одно выражение с общей регуляркой (GeoTypeMatch), иначе цепочка альтернатив вложенных геотипов.
+        Если выражения вложенных геотипов не сводятся к регулярке (см. LeafMatcher), то тоже цепочка.
         """
+        if compiled:
+            try:
+                return GeoTypeMatch(self._leaf_geotypes())
+            except ValueError:
+                pass
         return reduce(lambda s, i:
                       s | i.get_parser_expression(),
                       self._inner_geotypes, NoMatch())
@@ -154,13 +384,66 @@ class CompositeGeoType:
         """
         Нормализация пары (геотип, название). Ищет первый подходящий вложенный геотип
         и делегирует работу ему. Если не найдёт - падает с ValueError
+        Результат запоминается (см. normalize_memo_stats)
+        """
+        return _normalize(self, _type, title, is_type_before_title)
+
+    def _normalize(self, _type, title, is_type_before_title):
+        leaves = self._leaf_geotypes()
+        if not title or not _type:
+            # без типа проверять нечего - как и раньше, работает первый вложенный геотип
+            return leaves[0]._normalize(_type, title, is_type_before_title)
+        title = title.strip()
+        g = self.find_geotype(_type.strip())
+        if g is None:
+            raise ValueError(f"No geotype found for title={title} type={_type}")
+        return g._normalize_title(_type.strip(), title, is_type_before_title)
+
+    def _leaf_geotypes(self):
+        """
+        Простые геотипы, в т.ч. из вложенных составных, в порядке перебора
         """
+        result = []
         for g in self._inner_geotypes:
-            try:
-                return g.normalize(_type, title, is_type_before_title)
-            except ValueError:
-                pass
-        raise ValueError(f"No geotype found for title={title} type={_type}")
+            result.extend(g._leaf_geotypes() if isinstance(g, CompositeGeoType) else [g])
+        return result
+
+    def _type_table(self):
+        """
+        Таблица написаний типа: (простые геотипы, написание -> номера геотипов, написание в верхнем регистре ->
+        номера геотипов без учёта регистра, номера геотипов, написания которых не перечислить).
+        Строится при первой нормализации.
+        """
+        if self._table is None:
+            leaves = self._leaf_geotypes()
+            exact, caseless, others = {}, {}, []
+            for i, g in enumerate(leaves):
+                forms = g.type_forms()
+                if forms is None:
+                    others.append(i)
+                    continue
+                for form, is_caseless in forms:
+                    d, key = (caseless, form.upper()) if is_caseless else (exact, form)
+                    if i not in d.setdefault(key, []):
+                        d[key].append(i)
+            self._table = leaves, exact, caseless, others
+        return self._table
+
+    def find_geotype(self, _type):
+        """
+        Первый вложенный простой геотип, к которому относится тип (без пробелов по краям), или None.
+        Кандидатов даёт таблица написаний (для геотипов с регулярками - все они), а проверяет каждого
+        сам геотип, так что результат тот же, что у разбора типа выражениями по очереди.
+        """
+        leaves, exact, caseless, others = self._type_table()
+        candidates = exact.get(_type, []) + others
+        upper = _type.upper()
+        if len(upper) == len(_type):
+            candidates += caseless.get(upper, [])
+        for i in sorted(set(candidates)):
+            if leaves[i]._matches_type(_type):
+                return leaves[i]
+        return None
 
 
 def build_geo_type_from_str(s, caseless=True, as_keyword=True, norm_title_if_type_before=True):
@@ -363,5 +646,17 @@ if __name__ == "__main__":
         def test_composite3(self):
             self._test_composite(self.TypeComp3)
 
+        def test_memo(self):
+            clear_memo()
+            T = self.TypeComp
+            for _ in range(2):
+                self.assertEqual(("село", "Глинное"), T.normalize("села", "Глинного"))
+                with self.assertRaises(ValueError):
+                    T.normalize("абра", "кадабра")
+            st = normalize_memo_stats()
+            self.assertEqual((2, 2, 2), (st.hits, st.misses, st.size))
+            clear_memo()
+            self.assertEqual(MemoStats(0, 0, 0, NORMALIZE_MEMO_SIZE), normalize_memo_stats())
+
 
     unittest.main()
@@ -0,0 +1,251 @@
+"""
+Грамматика гео-названий на pyparsing.
+
+geoparser импортирует этот модуль при первом разборе (см. geoparser.grammar()), а не при собственном импорте:
+построение грамматики и словарей - заметная часть времени запуска, а, например, поиску по газеттиру
+она не нужна вовсе. Выражения доступны и как атрибуты geoparser: geoparser.Town, geoparser.Geo и т.д.
+"""
+
+from os import path
+
+from geoparsing.parsing_ext import *
+from geoparsing import geotypes
+from geoparsing.actions import normalize_action, type_before_title_setter
+
+_resources = path.join(path.dirname(__file__), 'resources')
+
+# Мемоизацию (packrat) можно включить через geoparser.enable_packrat()
+
+# Падежи, в которых могут быть названия - родительный и предложный
+inflects = [{'gent'}, {'loct'}]
+
+# сокращения Большой, Санкт, Малый, Новый, Великий и т.д.
+_title_prefixes = ['С.-', 'В.', 'Б.', 'М.', 'Н.']
+# Ростов-на-Дону
+_title_joiners = ["на", "в"]
+
+# Название (одно слово названия)
+TitleReference = Word(srange("[А-ЯЁ]"), srange("[а-яё]"), min=2)
+# Ростов-на-Дону, Центрально-Чернозёмная обл.
+TitleReference += Optional("-" + oneOf(_title_joiners)) + Optional("-" + TitleReference)  # двусоставное слово
+TitleReference = Combine(TitleReference)
+# сокращение включаем в ближайшее слово, дабы сократить грамматику
+TitleReference = Optional(oneOf(_title_prefixes)) + TitleReference
+# 2-й Покровский Починок
+TitleReference = Optional(Regex(r"\b[0-9]+-(й|м)\b")) + TitleReference
+TitleReference = originalTextFor(TitleReference)
+
+# То же самое, но по лексемам строки (см. lexer.py): Title пробуется почти в каждой позиции,
+# и разбирать его каждый раз посимвольно заново дорого
+Title = LexedTitle(_title_prefixes, _title_joiners)
+
+
+# Типы мест на карте
+PlaceType = geotypes.Place.get_parser_expression()("Type")
+
+# Типы нас. пунктов (дер. Ивановка)
+TownType = geotypes.Town.get_parser_expression()("Type")
+
+# # Типы населённых пунктов после названия, например "Никольская слобода"
+TownTypeAfter = geotypes.TownFull.get_parser_expression()("Type") | \
+                oneOf("слоб. хут.", caseless=True, asKeyword=False)
+
+# Типы подрайонов (волость, улус, сельсовет)
+SubDistrictType = geotypes.SubDistrict.get_parser_expression()("Type")
+
+# Типы районов (районы, уезды)
+DistrictType = geotypes.District.get_parser_expression()("Type")
+
+# Типы подрегионов (округ, автономная область)
+SubRegionType = geotypes.SubRegion.get_parser_expression()("Type")
+
+# Типы регионов (край, область, АССР, губерния)
+RegionType = geotypes.Region.get_parser_expression()("Type")
+
+# Типы стран
+CountryType = geotypes.Country.get_parser_expression()("Type")
+
+NotTownTypes = SubDistrictType | DistrictType | SubRegionType | RegionType | CountryType
+AllTypes = NotTownTypes | TownType
+
+InBrackets = Forward()
+
+# Скобки между названием и типом - Ивановской (Петровской) обл - понимаем примерно также
+NameBrackets = Forward()
+
+# Место
+Place = PlaceType + originalTextFor(
+    Title + Optional(Title + ~FollowedBy(TownType | NotTownTypes)))("Name")
+Place.setParseAction(type_before_title_setter)
+
+PlaceAfter = originalTextFor(Title + Optional(Title + FollowedBy(PlaceType)))("Name") + \
+             PlaceType + ~FollowedBy(Title * 2)
+Place |= PlaceAfter
+
+Place += InBrackets
+Place.setParseAction(normalize_action(geotypes.Place))
+Place = Group(Place)("Place")
+
+# Населённый пункт
+Town = TownType + originalTextFor(
+    Title + Optional(Title + ~FollowedBy(Optional(NameBrackets) + AllTypes))   # ~FollowedBy(Optional(NameBrackets) + AllTypes)
+)("Name") + Optional(NameBrackets + FollowedBy("("))
+Town.setParseAction(type_before_title_setter)
+
+# Отсеиваем совпадение <Иван слободы> Ивановской Сельского уезда
+TownAfter = originalTextFor(Title)("Name") + Optional(NameBrackets) + TownTypeAfter + ~FollowedBy(Title * 2)
+TownAfter |= originalTextFor(Title + Optional(Title))("Name") + TownTypeAfter + ~FollowedBy(Title * 2)
+
+Town |= TownAfter
+_towns = one_of_file(path.join(_resources, 'towns.txt'), inflects)
+Town |= _towns("Name")
+# Названия из газеттира, см. load_gazetteer_towns(). Пока он не загружен, словарь пуст.
+_gazetteer_towns = Lexicon()
+_gazetteer = DictionaryMatch(_gazetteer_towns)
+Town |= _gazetteer("Name")
+Town |= originalTextFor(Title)("Name") + FollowedBy(Suppress(Title + AllTypes))
+Town += InBrackets
+# Town = Town + Optional(Group("(" + Town + ")")("Other"))
+Town.setParseAction(normalize_action(geotypes.Town))
+Town = Group(Town)("Town")
+
+# Подрайон (волость, сельсовет)
+SubDistrict = Title("Name") + Optional(NameBrackets) + SubDistrictType
+SubDistrict += InBrackets
+SubDistrict.setParseAction(normalize_action(geotypes.SubDistrict))
+SubDistrict = Group(SubDistrict)("SubDistrict")
+
+# Район
+District = Title("Name") + Optional(NameBrackets) + DistrictType
+District += InBrackets
+District.setParseAction(normalize_action(geotypes.District))
+District = Group(District)("District")
+
+# Подрегион (округ, АО)
+SubRegion = Title("Name") + Optional(NameBrackets) + SubRegionType
+SubRegion += InBrackets
+SubRegion.setParseAction(normalize_action(geotypes.SubRegion))
+SubRegion = Group(SubRegion)("SubRegion")
+
+# Регион (область, губерния, край, епархия)
+Region = Title("Name") + Optional(NameBrackets) + RegionType
+_regions = one_of_file(path.join(_resources, 'regions.txt'), inflects)
+RegionDict = Optional(geotypes.RepublicExpr)("Type") + _regions("Name")
+RegionDict.setParseAction(type_before_title_setter)
+
+Region |= RegionDict
+Region += InBrackets
+Region.setParseAction(normalize_action(geotypes.Region))
+Region = Group(Region)("Region")
+
+# # Маленькое дополнение
+# # Амурской обл. Дальневосточного края - в данном случае обл. это SubRegion, а не Region
+_SubRegionTune = Title("Name") + Regex(r"обл(\.)?")("Type") + InBrackets
+_SubRegionTune.setParseAction(normalize_action(geotypes.Region))
+
+_SubRegionTune = Group(_SubRegionTune)("SubRegion") \
+                 + FollowedBy(Region)
+
+SubRegion |= _SubRegionTune
+
+# Условно страны, но может входить и в состав бОльшей страны, например ССР в СССР
+Country = Title("Name") + Optional(NameBrackets) + CountryType("Type")
+_countries = one_of_file(path.join(_resources, 'countries.txt'), inflects)
+CountryDict = Optional(geotypes.RepublicExpr)("Type") + _countries("Name")
+CountryDict.setParseAction(type_before_title_setter)
+
+Country |= CountryDict
+Country |= (geotypes.RepublicExpr("Type") + Title("Name")).setParseAction(type_before_title_setter)
+Country += InBrackets
+Country.setParseAction(normalize_action(geotypes.Country))
+Country = Group(Country)("Country")
+
+# Главная часть названия
+
+# # Prefix
+preposition = oneOf("в при близ у под", asKeyword=True).suppress()
+Prefix = Place + Optional(preposition | ",")
+# # Дорого! + 5 сек. на тестах
+Prefix |= Town("SubTown") + Optional(preposition) + FollowedBy(Town)
+
+# Прямой разбор - г. Видное Московской области России
+_components = [Town, SubDistrict, District, SubRegion, Region, Country]
+_forward_delimeter = Optional("," | Regex(r"\bв\b"))
+_reverse_delimeter = Optional(",")
+
+MainGeoForward = all_sub_chains(*_components,
+                                delimeter=_forward_delimeter,
+                                # item_tail = EndMark
+                                )
+MainGeoForward = Optional(Prefix) + MainGeoForward
+
+# Разбор наоборот:  Россия, Московская область, г. Видное
+MainGeoReverse = all_sub_chains(*reversed(_components),
+                                delimeter=_reverse_delimeter
+                                )
+
+# NB! Сильно просаживает производительность: ^ (поиск наиболее длинного совпадения)
+# разбирает обе цепочки целиком в каждой позиции. Оставлено как эталон, а по умолчанию
+# используется MainGeoMerged.
+MainGeoReference = MainGeoForward ^ MainGeoReverse
+
+# То же самое, но в два этапа: сначала ищем компоненты адреса, потом проверяем их порядок
+MainGeoTwoPhase = TwoPhaseChains(_components, prefix=Prefix,
+                                 forward_delimeter=_forward_delimeter,
+                                 reverse_delimeter=_reverse_delimeter)
+
+# Единый разбор: направление цепочки определяется по первой компоненте,
+# вторая цепочка строится, только если направление неоднозначно
+MainGeoMerged = DirectedChains(_components, prefix=Prefix,
+                               forward_delimeter=_forward_delimeter,
+                               reverse_delimeter=_reverse_delimeter)
+
+# Движки разбора главной части названия (см. set_engine).
+# fast разбирает без pyparsing (см. descent.py), грамматика при нём нужна только предварительному фильтру
+_engines = {
+    "pyparsing": MainGeoReference,
+    "two_phase": MainGeoTwoPhase,
+    "merged": MainGeoMerged,
+    "fast": MainGeoMerged,
+}
+
+# Движок подставляет geoparser.set_engine
+MainGeo = Forward()
+MainGeo <<= MainGeoMerged
+
+# Сведения о том, где искать сейчас
+NowadaysInBrackets = Suppress("(" + Optional("ныне")) + MainGeo + Suppress(Regex(r"\)|$"))  # ) могут и забыть
+NowadaysInBrackets = Group(NowadaysInBrackets)("Nowadays")
+
+NowadaysAfterComma = Suppress(Literal(",") + "ныне") + MainGeo
+NowadaysAfterComma = Group(NowadaysAfterComma)("Nowadays")
+
+# # #Nowadays = NowadaysInBrackets | NowadaysAfterComma
+
+# Комментарий для всего того, что разобрать не удалось
+Comment = Suppress("(") + Regex(r"[^)]+") + Suppress(Regex(r"\)|$"))  # закрывающую ')' могут и забыть
+Comment = ungroup(Comment)("Comment")
+
+# Расскажем наконец, как понимать выражения в скобках
+InBrackets << Optional(NowadaysInBrackets | Comment)
+# InBrackets << Empty()
+
+# NB! setParseAction заменяет действие originalTextFor, так что x - это [начало, лексемы названия..., конец],
+# и x[1] - первая лексема. Здесь нужен именно TitleReference, у Title лексема одна.
+OtherName = Suppress("(" + Optional("ныне")) + TitleReference("Name") \
+            .setParseAction(lambda s, loc, x: geotypes.inflect_to_case(x[1], 'nomn').title()) + \
+            Suppress(Regex(r"\)|$"))
+
+NameBrackets << Group(ungroup(NowadaysInBrackets) | OtherName | Comment)("NameBrackets")
+
+# Парсер географии строка
+# Слова в скобках будут прикреплены к последней компоненте адреса.
+# И только "ныне" после запятой - к самому адресу...
+Geo = MainGeo + Optional(NowadaysAfterComma)
+
+# \b - чтобы не поймать "и вот ито<г. Москва>, 2020.
+Geo = Regex(r"\b") + Geo + Optional(".")  # + EndMark
+
+# Компоненты адреса и скобки - их чаще всего разбирают заново в той же позиции
+PACKRAT_COMPONENTS = (Place, Prefix, Town, SubDistrict, District, SubRegion, _SubRegionTune, Region, Country,
+                      InBrackets, NameBrackets)
@@ -0,0 +1,130 @@
+"""
+Предвычисленный словарь склонений.
+
+Нормализация названий (geotypes) и склонение слов словарей (parsing_ext.do_inflects) обращаются к pymorphy2,
+а его словари занимают сотни мегабайт и загружаются секунды - в каждом процессе. Словарь склонений хранит
+готовые ответы для известных слов: названий из resources, газеттира и слов, встреченных в текстах.
+Если слово в нём есть, pymorphy2 не нужен вовсе.
+
+Файл - отсортированные строки "поле<TAB>поле<TAB>...<TAB>значение" в UTF-8, поиск - двоичный по mmap,
+так что в память файл целиком не читается и страницы делятся между процессами. Ключи:
+    case<TAB>слово<TAB>падеж<TAB>род (пустой, если без рода) - geotypes.inflect_to_case[_and_gender]
+    gender<TAB>слово<TAB>часть речи (или пусто) - geotypes.get_word_gender
+    inflect<TAB>слово<TAB>граммемы через запятую - склонение одного слова в do_inflects (до .title()/.upper())
+
+Построение: python -m geoparsing.build_inflections OUT [--gazetteer DB] [--texts FILE ...] (нужен pymorphy2).
+Словарь resources/inflections.txt, если он есть, загружается при импорте.
+"""
+
+import mmap
+from os import path
+
+DEFAULT_PATH = path.join(path.dirname(__file__), 'resources', 'inflections.txt')
+
+
+class InflectionLexicon:
+    """
+    Словарь склонений в файле (см. описание модуля)
+    """
+
+    def __init__(self, file_path):
+        self.path = file_path
+        self.hits = 0
+        self.misses = 0
+        with open(file_path, "rb") as f:
+            # mmap пустого файла создать нельзя
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if path.getsize(file_path) else b""
+
+    def get(self, *key):
+        """
+        Значение по ключу из полей key или None
+        """
+        if any("\t" in x or "\n" in x for x in key):
+            return None
+        prefix = "\t".join(key).encode("utf-8") + b"\t"
+        data = self._data
+        # lo и hi - всегда начала строк; ищем первую строку, не меньшую prefix
+        lo, hi = 0, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data.rfind(b"\n", 0, mid) + 1
+            end = data.find(b"\n", start)
+            if end < 0:
+                end = len(data)
+            if data[start:end] < prefix:
+                lo = end + 1
+            else:
+                hi = start
+        end = data.find(b"\n", lo)
+        line = data[lo:end if end >= 0 else len(data)]
+        if line.startswith(prefix):
+            self.hits += 1
+            return line[len(prefix):].decode("utf-8")
+        self.misses += 1
+        return None
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b""
+
+    @staticmethod
+    def write(file_path, items):
+        """
+        Записывает словарь: items - словарь {кортеж полей ключа: значение}
+        """
+        lines = []
+        for key, value in items.items():
+            fields = key + (value,)
+            if any("\t" in x or "\n" in x for x in fields):
+                continue
+            lines.append("\t".join(fields).encode("utf-8"))
+        lines.sort()
+        with open(file_path, "wb") as f:
+            for line in lines:
+                f.write(line + b"\n")
+
+
+_lexicon = None
+
+
+def load(file_path) -> InflectionLexicon:
+    """
+    Делает словарь склонений из файла file_path текущим
+    """
+    global _lexicon
+    lexicon = InflectionLexicon(file_path)
+    if _lexicon is not None:
+        _lexicon.close()
+    _lexicon = lexicon
+    return lexicon
+
+
+def unload():
+    """
+    Убирает текущий словарь склонений: все слова снова разбирает pymorphy2
+    """
+    global _lexicon
+    if _lexicon is not None:
+        _lexicon.close()
+    _lexicon = None
+
+
+def current() -> InflectionLexicon:
+    """
+    Текущий словарь склонений или None
+    """
+    return _lexicon
+
+
+def lookup(*key):
+    """
+    Значение по ключу в текущем словаре склонений или None, если словаря нет или ключа в нём нет
+    """
+    if _lexicon is None:
+        return None
+    return _lexicon.get(*key)
+
+
+if path.exists(DEFAULT_PATH):
+    load(DEFAULT_PATH)
@@ -0,0 +1,79 @@
+import re
+import threading
+from collections import namedtuple
+from typing import List
+
+Lexeme = namedtuple("Lexeme", ['kind', 'start', 'end', 'abbrev'])
+"""Лексема - кортеж <вид, начало, конец, за лексемой сразу идёт точка (сокращение)>
+
+Виды лексем:
+    title - слово с заглавной буквы: Иванов (заглавная буква и строчные, как Word в грамматике)
+    upper - заглавные буквы: АССР, МГУ
+    word - прочие слова: село, обл, Xyz
+    ordinal - порядковое числительное: 2-й, 3-м
+    number - число
+    bracket - скобка
+    punct - прочие знаки препинания
+"""
+
+_lexer = re.compile(r"""
+    (?P<ordinal>\b[0-9]+-(й|м)\b)
+    | (?P<title>[А-ЯЁ][а-яё]+)
+    | (?P<upper>[А-ЯЁ]+?(?=[А-ЯЁ][а-яё])|[А-ЯЁ]+)   # МГУПетров - это МГУ и Петров
+    | (?P<word>[^\W\d_А-ЯЁ]+)
+    | (?P<number>\d+)
+    | (?P<bracket>[()\[\]])
+    | (?P<punct>[^\w\s]|_)
+""", re.VERBOSE)
+
+
+def lex(s: str) -> List[Lexeme]:
+    """
+    Разбивает строку на лексемы. Пробелы в лексемы не попадают, все остальные символы - попадают.
+    :param s: строка
+    :return: список лексем в порядке следования
+    """
+    result = []
+    for m in _lexer.finditer(s):
+        end = m.end()
+        result.append(Lexeme(m.lastgroup, m.start(), end, s.startswith(".", end)))
+    return result
+
+
+class LexedText:
+    """
+    Строка, разбитая на лексемы, с поиском лексемы по позиции начала.
+    Позиции - те же, что в исходной строке, так что результаты разбора
+    по лексемам можно сразу отдавать как позиции в тексте.
+    """
+
+    def __init__(self, s: str):
+        self.text = s
+        self.lexemes = lex(s)
+        self._by_start = {x.start: x for x in self.lexemes}
+
+    def at(self, pos: int) -> Lexeme:
+        """
+        Лексема, которая начинается в позиции pos, или None
+        """
+        return self._by_start.get(pos)
+
+
+_last = threading.local()
+
+
+def lexed(s: str) -> LexedText:
+    """
+    Лексемы строки s. Грамматика обращается к ним много раз для одной и той же строки,
+    поэтому результат для последней строки запоминается - в каждом потоке свой.
+    """
+    last = getattr(_last, "text", None)
+    if last is None or last.text is not s:
+        last = LexedText(s)
+        _last.text = last
+    return last
+
+
+if __name__ == "__main__":
+    for x in lex("с. 2-й Покровский Починок (ныне МГУПетров), С.-Петербург обл."):
+        print(x)
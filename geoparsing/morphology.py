@@ -0,0 +1,87 @@
+"""
+Общий анализатор pymorphy2 для geotypes и parsing_ext.
+
+Анализатор создаётся при первом обращении (или заранее - prewarm()), один на процесс. Словари pymorphy2
+загружаются заметное время и занимают память, а слова из словаря склонений (см. inflections.py) обходятся
+без них, так что процесс, которому морфология не понадобилась, их не загружает вовсе.
+Без установленного pymorphy2 анализатора нет: analyzer() возвращает None, parse() - пустой список.
+"""
+
+import importlib.util
+import os
+import threading
+import time
+from collections import namedtuple
+
+# сам pymorphy2 импортируется только при создании анализатора: импорт пакета тоже небесплатен
+_available = importlib.util.find_spec("pymorphy2") is not None
+
+AnalyzerStats = namedtuple('AnalyzerStats', ['loaded', 'load_time', 'rss_before', 'rss_after'])
+"""Загрузка анализатора: загружен ли, время загрузки в секундах, память процесса (RSS, байт) до и после"""
+
+_analyzer = None
+_lock = threading.Lock()
+_stats = AnalyzerStats(False, 0.0, 0, 0)
+
+
+def analyzer():
+    """
+    Общий анализатор pymorphy2, создаётся при первом обращении. None, если pymorphy2 не установлен
+    """
+    if _analyzer is None and _available:
+        _load()
+    return _analyzer
+
+
+def parse(word):
+    """
+    Разборы слова pymorphy2 (MorphAnalyzer.parse), без pymorphy2 - пустой список
+    """
+    a = analyzer()
+    return a.parse(word) if a is not None else []
+
+
+def prewarm() -> AnalyzerStats:
+    """
+    Загружает анализатор заранее. Подходит как initializer пула процессов:
+        multiprocessing.Pool(initializer=morphology.prewarm)
+    При fork загрузить его стоит и в родительском процессе до создания пула - тогда словари
+    достанутся рабочим процессам готовыми.
+    :return: сведения о загрузке (см. analyzer_stats)
+    """
+    a = analyzer()
+    if a is not None:
+        # первый разбор достраивает внутренние кэши анализатора
+        a.parse("губерния")
+    return _stats
+
+
+def analyzer_stats() -> AnalyzerStats:
+    """
+    Возвращает сведения о загрузке анализатора в этом процессе
+    """
+    return _stats
+
+
+def _load():
+    global _analyzer, _stats
+    with _lock:
+        if _analyzer is not None:
+            return
+        rss_before = _rss()
+        start = time.perf_counter()
+        from pymorphy2 import MorphAnalyzer
+        result = MorphAnalyzer()
+        _stats = AnalyzerStats(True, time.perf_counter() - start, rss_before, _rss())
+        _analyzer = result
+
+
+def _rss():
+    """
+    Текущий RSS процесса в байтах (Linux), иначе 0
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
@@ -1,5 +1,5 @@
 from pyparsing import ParserElement
-from geoparsing.geoparser import Geo, set_debug_names
+from geoparsing.geoparser import scan_string, set_debug_names
 
 def get_test_data():
     def _test_item_transformer(x):
@@ -21,10 +21,9 @@ def run_tests(verbose):
     for i in tests:
         i, expected = _parse_test_item(i)
         fact = []
-        for g in Geo.scanString(i):
+        for g in scan_string(i):
             p, s, e = g
             if verbose:
-                p = p.asDict()
                 print(i[:s] + "<" + i[s:e] + ">" + i[e:])
                 print(p)
                 print()
@@ -1,31 +1,336 @@
 # from cPyparsing import * # Не сильно быстрее
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+from contextlib import contextmanager
+from os import path
 from pyparsing import *
-from pymorphy2 import MorphAnalyzer
+from geoparsing.lexer import lexed
+from geoparsing import inflections, morphology
 
-morph = None
+# Склонения словарей (one_of_file, sqlite_lexicon) pymorphy2 разбирает по строке. Начиная с этого числа строк
+# склонение идёт параллельно в INFLECT_PROCESSES процессах (None - по числу процессоров)
+PARALLEL_INFLECT_MIN_LINES = 2000
+INFLECT_PROCESSES = None
 
-def one_of_file(path, inflects=None):
+
+def one_of_file(path, inflects=None, cache=True):
     """
     Условие совпадения с одной из строк файла.
     inflects = помимо исходной строки нужно сравнивать со склонениями в указанные морфологические формы
+    cache = склонения сохраняются в файле path + ".inflected.txt" вместе с хэшем содержимого файла и inflects
+    и при следующих вызовах берутся оттуда, пока не изменится одно из них
     """
-    dd = []
-    with open(path) as f:
-        for l in f:
-            l = l.strip()
-            if not l: continue
-            dd.append(l)     
-            for i in do_inflects(l, inflects):
-                dd.append(i)
+    with open(path, "rb") as f:
+        data = f.read()
+    key = _inflect_cache_key(data, inflects)
+    cache_path = path + ".inflected.txt"
+    dd = _load_cache(cache_path, key) if cache and inflects else None
+    if dd is None:
+        lines = [l.strip() for l in data.decode("utf-8").splitlines() if l.strip()]
+        dd = []
+        for l, forms in zip(lines, inflect_all(lines, inflects)):
+            dd.append(l)
+            dd.extend(forms)
+        if cache and inflects:
+            _save_cache(cache_path, key, dd)
 
     # print(dd)
     
     # Ищем слово из списка, обрамлённое границей слов \b
     # (\b - граница между словным (\w) и несловным (\W) символом или границей строки (^$) )
-    # Используем Combine, чтобы не пропускались пробелы, иначе границы будут искаться не там.
-    result = Combine(Regex("\\b") + oneOf(dd) + Regex("\\b"))
-    #result = oneOf(dd)
-    result = ungroup(result)
+    # Раньше это было Combine(Regex("\\b") + oneOf(dd) + Regex("\\b")), но oneOf по длинному
+    # списку - это огромная альтернатива в регулярке, которая пробуется в каждой позиции.
+    return DictionaryMatch(dd)
+
+
+def inflect_all(words, inflects):
+    """
+    do_inflects для каждой строки words - список списков склонений.
+    Длинные списки (от PARALLEL_INFLECT_MIN_LINES строк) склоняются в нескольких процессах.
+    """
+    # multiprocessing импортируется здесь: он нужен только длинным словарям, а импорт заметен при старте
+    import multiprocessing
+    processes = INFLECT_PROCESSES or os.cpu_count() or 1
+    # в рабочем процессе пула, который импортирует модули заново (spawn), новый пул не создаём
+    if not inflects or len(words) < PARALLEL_INFLECT_MIN_LINES or processes < 2 or \
+            multiprocessing.parent_process() is not None:
+        return [do_inflects(w, inflects) for w in words]
+    with multiprocessing.Pool(processes, initializer=morphology.prewarm) as pool:
+        return pool.starmap(do_inflects, ((w, inflects) for w in words),
+                            chunksize=max(1, len(words) // (processes * 4)))
+
+
+def _inflect_cache_key(data, inflects):
+    """
+    Ключ кэша склонений: хэш содержимого файла и формы склонения
+    """
+    forms = ";".join(",".join(sorted(x)) for x in inflects or ())
+    return hashlib.sha1(data).hexdigest() + " " + forms
+
+
+def _load_cache(cache_path, key):
+    """
+    Строки из файла кэша (склонений, таблицы регистров) или None, если кэша нет или он для другого ключа
+    """
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            if f.readline().rstrip("\n") != "# " + key:
+                return None
+            return [l.rstrip("\n") for l in f]
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _save_cache(cache_path, key, lines):
+    """
+    Сохраняет кэш с ключом key в первой строке; если записать нельзя (например, каталог только для чтения) - обходимся без кэша
+    """
+    # у каждого процесса и потока свой временный файл: иначе при одновременном построении кэша один
+    # обрезал бы файл, который другой ещё пишет или уже переименовал
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("# " + key + "\n")
+            for l in lines:
+                f.write(l + "\n")
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+class Lexicon:
+    """
+    Компактный индекс строк словаря для поиска самой длинной строки, с которой начинается
+    текст в данной позиции.
+
+    Строки хранятся в одном множестве, а для каждого префикса из key_len символов -
+    длины строк с этим префиксом по убыванию. Поиск - это несколько обращений к словарю
+    и множеству, время не зависит от размера словаря, а память - порядка размера самих строк
+    (в отличие от префиксного дерева, где на каждый символ приходится свой словарь).
+    """
+    key_len = 3
+
+    def __init__(self, words=()):
+        self._words = set()
+        self._lengths = {}  # префикс длины key_len -> длины строк по убыванию
+        self._first_chars = None
+        self.update(words)
+
+    def update(self, words):
+        """
+        Добавить строки в словарь
+        """
+        new_words = set(words) - self._words
+        if not new_words:
+            return
+        self._words |= new_words
+        self._first_chars = None
+        lengths = {}
+        for w in new_words:
+            if len(w) >= self.key_len:
+                lengths.setdefault(w[:self.key_len], set()).add(len(w))
+        for k, v in lengths.items():
+            v.update(self._lengths.get(k, ()))
+            self._lengths[k] = tuple(sorted(v, reverse=True))
+
+    def clear(self):
+        self._words = set()
+        self._lengths = {}
+        self._first_chars = None
+
+    def __len__(self):
+        return len(self._words)
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __contains__(self, word):
+        return word in self._words
+
+    def longest_match(self, instring, loc):
+        """
+        Конец самой длинной строки словаря, с которой начинается instring[loc:], или None
+        """
+        words = self._words
+        rest = len(instring) - loc
+        for n in self._lengths.get(instring[loc:loc + self.key_len], ()):
+            if n <= rest and instring[loc:loc + n] in words:
+                return loc + n
+        for n in range(min(self.key_len - 1, rest), 0, -1):
+            if instring[loc:loc + n] in words:
+                return loc + n
+        return None
+
+    def first_chars(self):
+        """
+        Символы, с которых начинаются строки словаря
+        """
+        if self._first_chars is None:
+            self._first_chars = frozenset(w[0] for w in self._words if w)
+        return self._first_chars
+
+
+class DictionaryMatch(Token):
+    """
+    Совпадение с самой длинной из строк словаря, обрамлённой границами слов \\b.
+    Ведёт себя так же, как Combine(Regex("\\b") + oneOf(words) + Regex("\\b")):
+    пробелы перед совпадением пропускаются, а если самая длинная подходящая строка
+    не заканчивается на границе слова, совпадения нет (более короткие не пробуются).
+
+    words - список строк или Lexicon. Lexicon не копируется: строки, добавленные
+    в него позже, тоже будут находиться (так грамматику можно дополнить словарём
+    уже после её построения).
+    """
+    _word_boundary = re.compile(r"\b")
+
+    def __init__(self, words):
+        super().__init__()
+        self.lexicon = words if isinstance(words, Lexicon) else Lexicon(words)
+        self.name = "DictionaryMatch"
+        self.errmsg = "Expected " + self.name
+        self.mayReturnEmpty = False
+        self.mayIndexError = False
+
+    def first_chars(self):
+        """
+        Символы, с которых начинаются строки словаря
+        """
+        return self.lexicon.first_chars()
+
+    def match(self, instring, loc):
+        """
+        Конец совпадения, начинающегося в позиции loc (пробелы уже пропущены), или None
+        """
+        if self._word_boundary.match(instring, loc):
+            longest = self.lexicon.longest_match(instring, loc)
+            if longest is not None and self._word_boundary.match(instring, longest):
+                return longest
+        return None
+
+    def parseImpl(self, instring, loc, doActions=True):
+        end = self.match(instring, loc)
+        if end is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return end, instring[loc:end]
+
+
+class LexedTitle(Token):
+    """
+    Название (Иванов, 2-й Покровский, С.-Петербург, Ростов-на-Дону) по лексемам строки (см. lexer.py).
+    Совпадает там же и так же, как
+        originalTextFor(Optional(Regex(r"\\b[0-9]+-(й|м)\\b")) + Optional(oneOf(prefixes)) +
+                        Combine(W + Optional("-" + oneOf(joiners)) + Optional("-" + W)))
+    где W = Word(srange("[А-ЯЁ]"), srange("[а-яё]"), min=2), но не разбирает строку посимвольно в каждой позиции:
+    строка делится на лексемы один раз, а здесь только проверяются их виды.
+    Как и в pyparsing, откатов нет: если префикс совпал, а слово за ним - нет, то совпадения нет.
+    """
+
+    def __init__(self, prefixes, joiners):
+        super().__init__()
+        self._prefixes = list(prefixes)
+        self._joiners = ["-" + x for x in joiners]
+        self.name = "LexedTitle"
+        self.errmsg = "Expected " + self.name
+        self.mayReturnEmpty = False
+        self.mayIndexError = False
+
+    def first_chars(self):
+        """
+        Символы, с которых может начинаться название
+        """
+        return frozenset(srange("[А-ЯЁ0-9]")) | frozenset(x[0] for x in self._prefixes)
+
+    def _skip_whitespace(self, instring, loc):
+        while loc < len(instring) and instring[loc] in self.whiteChars:
+            loc += 1
+        return loc
+
+    def match(self, instring, loc):
+        """
+        Конец названия, начинающегося в позиции loc (пробелы уже пропущены), или None
+        """
+        parts = self._parts(instring, loc)
+        return None if parts is None else parts[1]
+
+    def head(self, instring, loc):
+        """
+        Первая часть названия, начинающегося в позиции loc: порядковое числительное, сокращение или само слово.
+        Это первая лексема, которую выдаёт для названия грамматика на pyparsing (см. TitleReference).
+        None - если названия нет.
+        """
+        parts = self._parts(instring, loc)
+        return None if parts is None else parts[0]
+
+    def _parts(self, instring, loc):
+        text = lexed(instring)
+        head = None
+
+        x = text.at(loc)
+        if x is not None and x.kind == "ordinal":
+            head = instring[x.start:x.end]
+            loc = self._skip_whitespace(instring, x.end)
+        for prefix in self._prefixes:
+            if instring.startswith(prefix, loc):
+                head = head or prefix
+                loc = self._skip_whitespace(instring, loc + len(prefix))
+                break
+
+        x = text.at(loc)
+        if x is None or x.kind != "title":
+            return None
+        end = x.end
+        for joiner in self._joiners:
+            if instring.startswith(joiner, end):
+                end += len(joiner)
+                break
+        if instring.startswith("-", end):
+            x = text.at(end + 1)
+            if x is not None and x.kind == "title":
+                end = x.end
+        return head or instring[loc:end], end
+
+    def parseImpl(self, instring, loc, doActions=True):
+        end = self.match(instring, loc)
+        if end is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return end, instring[loc:end]
+
+
+def sqlite_lexicon(db_path, query, inflects=None, cache_path=None):
+    """
+    Словарь из базы SQLite: первые столбцы строк результата запроса query
+    и (если задано inflects) их склонения.
+    Склонение десятков тысяч названий занимает заметное время, поэтому результат
+    сохраняется в cache_path (если задан) вместе с ключом - базой (путь, время изменения, размер),
+    запросом и inflects - и берётся оттуда, пока ключ тот же.
+    """
+    stat = os.stat(db_path)
+    source = f"{path.abspath(db_path)}\n{stat.st_mtime_ns}\n{stat.st_size}\n{query}"
+    key = _inflect_cache_key(source.encode("utf-8"), inflects)
+    words = _load_cache(cache_path, key) if cache_path else None
+    if words is not None:
+        return Lexicon(words)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        names = {row[0] for row in conn.execute(query) if row[0]}
+    finally:
+        conn.close()
+
+    result = Lexicon(names)
+    if inflects:
+        for forms in inflect_all(sorted(names), inflects):
+            result.update(forms)
+    if cache_path:
+        _save_cache(cache_path, key, sorted(result))
     return result
 
 
@@ -55,12 +360,686 @@ def all_sub_chains(*components, delimeter = Empty(), item_tail = Empty()):
         result |= ch
     
     return result
-    
-def _morph():
-    global morph
-    if not morph:
-        morph = MorphAnalyzer()
-    return morph
+
+
+class TwoPhaseChains(ParserElement):
+    """
+    Двухфазная замена выражения
+        Optional(prefix) + all_sub_chains(*components, delimeter=forward_delimeter) ^
+        all_sub_chains(*reversed(components), delimeter=reverse_delimeter)
+
+    Фаза 1: таблица (компонента, позиция) -> конец совпадения. Каждая компонента
+    пробуется в каждой позиции не более одного раза и без parse actions.
+    Фаза 2: обычным python-кодом по таблице строятся прямая и обратная цепочки
+    по тем же правилам, что и у all_sub_chains (голова цепочки - первая найденная
+    компонента, далее каждая следующая компонента необязательна),
+    и выбирается самая длинная (при равенстве - прямая, как у ^).
+    Фаза 3: компоненты победившей цепочки разбираются ещё раз, уже с parse actions.
+
+    Результат разбора совпадает с результатом исходного выражения.
+    """
+
+    def __init__(self, components, prefix=None, forward_delimeter=Empty(), reverse_delimeter=Empty()):
+        super().__init__()
+        self._components = list(components)
+        self._prefix = prefix
+        self._forward_delimeter = forward_delimeter
+        self._reverse_delimeter = reverse_delimeter
+        # all_sub_chains добавляет Empty после каждого элемента цепочки - он пропускает пробелы
+        self._tail = Empty()
+        self.mayIndexError = False
+        self.errmsg = "Expected " + str(self)
+
+    def __str__(self):
+        if hasattr(self, "name"):
+            return self.name
+        return "TwoPhaseChains(" + ", ".join(str(x) for x in self._components) + ")"
+
+    def streamline(self):
+        super().streamline()
+        for e in self._components:
+            e.streamline()
+        return self
+
+    def parseImpl(self, instring, loc, doActions=True):
+        chart = {}
+
+        def component_end(i, pos):
+            # Фаза 1 - ленивое заполнение таблицы компонент
+            key = (i, pos)
+            if key not in chart:
+                try:
+                    chart[key] = self._components[i].tryParse(instring, pos)
+                except (ParseException, IndexError):
+                    chart[key] = None
+            return chart[key]
+
+        # Фаза 2 - проверяем порядок компонент
+        prefix_end = None
+        if self._prefix is not None:
+            try:
+                prefix_end = self._prefix.tryParse(instring, loc)
+            except (ParseException, IndexError):
+                pass
+
+        selected = self._select_chain(instring, loc, prefix_end, component_end)
+        if not selected:
+            raise ParseException(instring, loc, self.errmsg, self)
+        end, chain, delimeter, prefix_end = selected
+
+        if not doActions:
+            return end, []
+
+        # Фаза 3 - разбор с parse actions только для победившей цепочки
+        result = ParseResults([])
+        if prefix_end is not None:
+            _, tokens = self._prefix._parse(instring, loc, doActions)
+            result += tokens
+        for delimeter_loc, i, component_loc in chain:
+            if delimeter_loc is not None:
+                _, tokens = delimeter._parse(instring, delimeter_loc, doActions, callPreParse=False)
+                if tokens or tokens.haskeys():
+                    result += tokens
+            _, tokens = self._components[i]._parse(instring, component_loc, doActions)
+            if tokens or tokens.haskeys():
+                result += tokens
+        return end, result
+
+    def _select_chain(self, instring, loc, prefix_end, component_end):
+        """
+        Строит прямую и обратную цепочки и выбирает самую длинную.
+        Возвращает четвёрку (конец цепочки, цепочка, разделитель, конец префикса или None)
+        либо None, если ни одна цепочка не построилась.
+        """
+        order = range(len(self._components))
+        forward_start = loc if prefix_end is None else prefix_end
+        forward = self._build_chain(instring, forward_start, order, self._forward_delimeter, component_end)
+        backward = self._build_chain(instring, loc, reversed(order), self._reverse_delimeter, component_end)
+
+        if forward and (not backward or forward[0] >= backward[0]):
+            return forward + (self._forward_delimeter, prefix_end)
+        elif backward:
+            return backward + (self._reverse_delimeter, None)
+        return None
+
+    def _build_chain(self, instring, loc, order, delimeter, component_end):
+        """
+        Строит цепочку компонент в заданном порядке, начиная с позиции loc.
+        Возвращает пару (конец цепочки, [(позиция разделителя, номер компоненты, позиция компоненты)...])
+        или None, если цепочку построить не удалось.
+        """
+        order = list(order)
+        for n, i in enumerate(order):
+            end = component_end(i, loc)
+            if end is not None:
+                break
+        else:
+            return None
+
+        chain = [(None, i, loc)]
+        loc = self._tail.preParse(instring, end)
+        for i in order[n + 1:]:
+            component_loc = delimeter._parse(instring, loc, False, callPreParse=False)[0]
+            end = component_end(i, component_loc)
+            if end is not None:
+                chain.append((loc, i, component_loc))
+                loc = self._tail.preParse(instring, end)
+        return loc, chain
+
+
+class DirectedChains(TwoPhaseChains):
+    """
+    Вариант TwoPhaseChains, который по первой найденной компоненте решает,
+    прямая цепочка перед нами или обратная, и строит только её:
+    * если в начале может быть только самая младшая компонента (Town), то обратная цепочка
+      из неё одной не длиннее прямой - строим только прямую;
+    * если только самая старшая (Country) - наоборот, строим только обратную.
+    В остальных случаях (префикс, несколько подходящих компонент, компонента из середины)
+    строятся обе цепочки, как в TwoPhaseChains.
+
+    Компоненты, которые не могут начинаться с символа в данной позиции (см. first_chars),
+    даже не пробуются.
+    """
+
+    def __init__(self, components, prefix=None, forward_delimeter=Empty(), reverse_delimeter=Empty()):
+        super().__init__(components, prefix, forward_delimeter, reverse_delimeter)
+        self.update_first_chars()
+
+    def update_first_chars(self):
+        """
+        Пересчитать first_chars компонент - нужно, если компоненты изменились
+        после построения (например, пополнился словарь DictionaryMatch)
+        """
+        self._first_chars = [first_chars(x) for x in self._components]
+
+    def _select_chain(self, instring, loc, prefix_end, component_end):
+        def filtered_component_end(i, pos):
+            chars = self._first_chars[i]
+            if chars is not None:
+                start = self._tail.preParse(instring, pos)
+                if start >= len(instring) or instring[start] not in chars:
+                    return None
+            return component_end(i, pos)
+
+        if prefix_end is None:
+            last = len(self._components) - 1
+            head = next((i for i in range(last + 1) if filtered_component_end(i, loc) is not None), None)
+            if head is None:
+                return None
+            if head in (0, last) and \
+                    all(filtered_component_end(i, loc) is None for i in range(head + 1, last + 1)):
+                if head == 0:
+                    chain = self._build_chain(instring, loc, range(last + 1),
+                                              self._forward_delimeter, filtered_component_end)
+                    return chain + (self._forward_delimeter, None)
+                chain = self._build_chain(instring, loc, reversed(range(last + 1)),
+                                          self._reverse_delimeter, filtered_component_end)
+                return chain + (self._reverse_delimeter, None)
+
+        return super()._select_chain(instring, loc, prefix_end, filtered_component_end)
+
+
+def first_chars(expr):
+    """
+    Множество символов, с которых может начинаться совпадение с pyparsing-выражением expr
+    (после пропуска пробелов).
+    Возвращает None, если такое множество вычислить не удалось или выражение
+    может совпасть с пустой строкой - т.е. начинаться может с чего угодно.
+    """
+    chars, nullable = _first_chars(expr, set())
+    if chars is None or nullable:
+        return None
+    return frozenset(chars)
+
+
+def start_regex(expr):
+    """
+    Регулярное выражение нулевой ширины, которое совпадает во всех позициях, где может начинаться
+    совпадение expr (уже после пропуска пробелов): символ из first_chars(expr), а если expr начинается
+    с регулярок нулевой ширины (например, Regex(r"\\b")) - то и они.
+    Возвращает None, если first_chars(expr) неизвестны.
+    """
+    chars = first_chars(expr)
+    if chars is None or any(c in expr.whiteChars for c in chars):
+        return None
+    pattern = "(?=[%s])" % "".join(re.escape(c) for c in sorted(chars))
+
+    head = expr
+    while isinstance(head, And) and head.exprs:
+        head = head.exprs[0]
+        if isinstance(head, Regex) and not head.flags and _regex_width(head.pattern, head.flags) == (0, 0):
+            pattern = "(?:%s)" % head.pattern + pattern
+            head = None
+    return re.compile(pattern)
+
+
+def _with_case_variants(chars):
+    result = set(chars)
+    for c in chars:
+        result.add(c.upper())
+        result.add(c.lower())
+    return result
+
+
+def _first_chars(expr, visiting):
+    """
+    Возвращает пару (множество первых символов или None, может ли выражение совпасть с пустой строкой)
+    """
+    if isinstance(expr, (DictionaryMatch, LexedTitle)):
+        return set(expr.first_chars()), False
+    if isinstance(expr, TwoPhaseChains):
+        exprs = list(expr._components)
+        if expr._prefix is not None:
+            exprs.append(expr._prefix)
+        return _first_chars(MatchFirst(exprs), visiting)
+    if isinstance(expr, (Empty, FollowedBy, NotAny, PrecededBy)):
+        return set(), True
+    if isinstance(expr, NoMatch):
+        return set(), False
+    if isinstance(expr, Keyword):
+        chars = {expr.match[0]}
+        return (_with_case_variants(chars) if expr.caseless else chars), False
+    if isinstance(expr, CaselessLiteral):
+        return _with_case_variants(expr.match[0]), False
+    if isinstance(expr, Literal):
+        return {expr.match[0]}, False
+    if isinstance(expr, Word):
+        return set(expr.initChars), False
+    if isinstance(expr, Regex):
+        return _regex_first_chars(expr.re.pattern, expr.re.flags)
+    if isinstance(expr, And):
+        result = set()
+        for e in expr.exprs:
+            chars, nullable = _first_chars(e, visiting)
+            if chars is None:
+                return None, False
+            result |= chars
+            if not nullable:
+                return result, False
+        return result, True
+    if isinstance(expr, (MatchFirst, Or)):
+        result, result_nullable = set(), False
+        for e in expr.exprs:
+            chars, nullable = _first_chars(e, visiting)
+            if chars is None:
+                return None, False
+            result |= chars
+            result_nullable = result_nullable or nullable
+        return result, result_nullable
+    if isinstance(expr, Forward):
+        if expr in visiting or expr.expr is None:
+            return None, False
+        visiting.add(expr)
+        try:
+            return _first_chars(expr.expr, visiting)
+        finally:
+            visiting.discard(expr)
+    if isinstance(expr, (Optional, ZeroOrMore)):
+        chars, _ = _first_chars(expr.expr, visiting)
+        return chars, True
+    if isinstance(expr, ParseElementEnhance):
+        return _first_chars(expr.expr, visiting)
+    return None, False
+
+
+def _regex_width(pattern, flags):
+    """
+    Минимальная и максимальная длина совпадения с регулярным выражением
+    """
+    try:
+        import re._parser as sre_parse
+    except ImportError:  # python < 3.11
+        import sre_parse
+    return sre_parse.parse(pattern, flags).getwidth()
+
+
+def _regex_first_chars(pattern, flags):
+    try:
+        import re._parser as sre_parse
+        import re._constants as sre_constants
+    except ImportError:  # python < 3.11
+        import sre_parse
+        import sre_constants
+
+    c = sre_constants
+
+    def seq_first(items, ignore_case):
+        result = set()
+        for op, av in items:
+            chars, nullable = item_first(op, av, ignore_case)
+            if chars is None:
+                return None, False
+            result |= chars
+            if not nullable:
+                return result, False
+        return result, True
+
+    def item_first(op, av, ignore_case):
+        if op == c.LITERAL:
+            chars = {chr(av)}
+        elif op == c.IN:
+            chars = set()
+            for in_op, in_av in av:
+                if in_op == c.LITERAL:
+                    chars.add(chr(in_av))
+                elif in_op == c.RANGE and in_av[1] - in_av[0] < 1000:
+                    chars.update(chr(x) for x in range(in_av[0], in_av[1] + 1))
+                else:
+                    # NEGATE, CATEGORY и огромные диапазоны - не перечисляем
+                    return None, False
+        elif op == c.AT or op in (c.ASSERT, c.ASSERT_NOT):
+            return set(), True
+        elif op == c.SUBPATTERN:
+            _, add_flags, del_flags, items = av
+            sub_ignore_case = (ignore_case or bool(add_flags & c.SRE_FLAG_IGNORECASE)) and \
+                not (del_flags & c.SRE_FLAG_IGNORECASE)
+            return seq_first(items, sub_ignore_case)
+        elif op == c.BRANCH:
+            result, result_nullable = set(), False
+            for items in av[1]:
+                chars, nullable = seq_first(items, ignore_case)
+                if chars is None:
+                    return None, False
+                result |= chars
+                result_nullable = result_nullable or nullable
+            return result, result_nullable
+        elif op in (c.MAX_REPEAT, c.MIN_REPEAT):
+            low, _, items = av
+            chars, nullable = seq_first(items, ignore_case)
+            return chars, nullable or low == 0
+        else:
+            return None, False
+        return (_with_case_variants(chars) if ignore_case else chars), False
+
+    parsed = sre_parse.parse(pattern, flags)
+    return seq_first(list(parsed), bool(parsed.state.flags & c.SRE_FLAG_IGNORECASE))
+
+
+def required_tokens(expr):
+    """
+    Множество терминальных элементов грамматики (Literal, Keyword, Regex, Word, DictionaryMatch),
+    хотя бы один из которых совпадает при любом совпадении expr - в позиции не раньше его начала.
+    Из нескольких обязательных частей последовательности выбирается та, что не содержит Word,
+    т.е. типы и словари, а не просто слова с заглавной буквы.
+    Возвращает None, если такое множество найти не удалось.
+    """
+    return _required_tokens(expr, set())
+
+
+def _is_selective(tokens):
+    return tokens is not None and not any(isinstance(t, (Word, LexedTitle)) for t in tokens)
+
+
+def _required_tokens(expr, visiting):
+    if isinstance(expr, NoMatch):
+        return frozenset()
+    if isinstance(expr, (Empty, Optional, ZeroOrMore, NotAny, PrecededBy)):
+        return None
+    if isinstance(expr, Regex):
+        # mayReturnEmpty у Regex проверяет совпадение с пустой строкой, а \\b с ней не совпадает
+        return None if _regex_width(expr.pattern, expr.flags)[0] == 0 else frozenset([expr])
+    if isinstance(expr, Token):
+        return None if expr.mayReturnEmpty else frozenset([expr])
+    if isinstance(expr, TwoPhaseChains):
+        # без хотя бы одной компоненты цепочки не бывает, префикс необязателен
+        return _required_tokens(MatchFirst(expr._components), visiting)
+    if isinstance(expr, And):
+        candidates = [_required_tokens(e, visiting) for e in expr.exprs]
+        candidates = [x for x in candidates if x is not None]
+        return next((x for x in candidates if _is_selective(x)), candidates[0] if candidates else None)
+    if isinstance(expr, (MatchFirst, Or)):
+        result = set()
+        for e in expr.exprs:
+            tokens = _required_tokens(e, visiting)
+            if tokens is None:
+                return None
+            result |= tokens
+        return frozenset(result)
+    if isinstance(expr, Forward):
+        if expr in visiting or expr.expr is None:
+            return None
+        visiting.add(expr)
+        try:
+            return _required_tokens(expr.expr, visiting)
+        finally:
+            visiting.discard(expr)
+    # FollowedBy тоже годится: заглядывание вперёд идёт с той же позиции
+    if isinstance(expr, ParseElementEnhance):
+        return _required_tokens(expr.expr, visiting)
+    return None
+
+
+def _keywords_pattern(words, caseless, ident_chars):
+    """
+    Регулярное выражение, совпадающее там же, где Keyword для одного из words
+    с заданными caseless и identChars (соседние символы не должны входить в identChars)
+    """
+    match = "|".join(re.escape(w) for w in sorted(words))
+    if caseless:
+        # Keyword сравнивает соседние символы в верхнем регистре - собираем все такие символы
+        ident_chars = _upper_in(ident_chars)
+        match = "(?i:%s)" % match
+    ident = "".join(re.escape(c) for c in sorted(ident_chars))
+    return "(?<![%s])(?:%s)(?![%s])" % (ident, match, ident)
+
+
+def expr_regex(expr):
+    """
+    Шаблон регулярного выражения, совпадающего с expr.
+    Совпадение приблизительное: регулярка при откатах может выбрать другую альтернативу, чем MatchFirst,
+    поэтому найденное надо проверять самим expr. Пробелы между элементами And - как в pyparsing по умолчанию.
+    None - если expr к регулярке не сводится.
+    """
+    if isinstance(expr, NoMatch):
+        return "(?!)"
+    if isinstance(expr, Keyword):
+        return _keywords_pattern([expr.match], expr.caseless, frozenset(expr.identChars))
+    if isinstance(expr, CaselessLiteral):
+        return "(?i:%s)" % re.escape(expr.match)
+    if isinstance(expr, Literal):
+        return re.escape(expr.match)
+    if isinstance(expr, Regex):
+        if expr.flags & ~re.IGNORECASE:
+            return None
+        return ("(?i:%s)" if expr.flags else "(?:%s)") % expr.pattern
+    if isinstance(expr, (MatchFirst, Or, And)):
+        parts = [expr_regex(e) for e in expr.exprs]
+        if None in parts:
+            return None
+        return "(?:%s)" % ("[ \\t\\r\\n]*" if isinstance(expr, And) else "|").join(parts)
+    if isinstance(expr, Optional):
+        inner = expr_regex(expr.expr)
+        return None if inner is None else "(?:%s)?" % inner
+    if isinstance(expr, TokenConverter):
+        return expr_regex(expr.expr)
+    return None
+
+
+def ungroup(expr):
+    """
+    То же, что pyparsing.ungroup, но у действия полная сигнатура (строка, позиция, лексемы): число аргументов
+    pyparsing подбирает пробными вызовами, и первые вызовы из нескольких потоков сразу ломают такое действие
+    """
+    return TokenConverter(expr).addParseAction(lambda s, loc, t: t[0])
+
+
+# глубина вложенных блоков uncounted() в текущем потоке
+_uncounted_local = threading.local()
+
+
+@contextmanager
+def uncounted():
+    """
+    Служебный разбор в текущем потоке: обёртки ParserElement._parseNoCache (бюджет разбора и профилировщик
+    в geoparser) внутри блока не считают шагов. Например, нормализация типа запоминается, и без этого строка
+    стоила бы разное число шагов в зависимости от того, что разбиралось до неё
+    """
+    depth = getattr(_uncounted_local, "depth", 0)
+    _uncounted_local.depth = depth + 1
+    try:
+        yield
+    finally:
+        _uncounted_local.depth = depth
+
+
+def is_uncounted() -> bool:
+    """
+    Идёт ли в текущем потоке служебный разбор (см. uncounted)
+    """
+    return getattr(_uncounted_local, "depth", 0) > 0
+
+
+class LeafMatcher:
+    """
+    Совпадение с выражением-альтернативой (MatchFirst) из простых элементов - Keyword, Literal, Regex,
+    как у типов геообъектов. Вместо перебора альтернатив - одна регулярка (см. expr_regex), а сама лексема
+    берётся у совпавшего элемента, так что результат тот же, что у выражения.
+    """
+
+    def __init__(self, expr):
+        self._leaves = []  # (элемент, имена результатов, под которыми попадает его лексема)
+        self._collect(expr, ())
+        self._re = re.compile("|".join("(?P<_%d>%s)" % (i, expr_regex(leaf))
+                                       for i, (leaf, _) in enumerate(self._leaves)) or "(?!)")
+
+    def _collect(self, expr, names):
+        if expr.parseAction:
+            raise ValueError(f"Parse actions are not supported: {expr}")
+        if expr.resultsName:
+            names += (expr.resultsName,)
+        if isinstance(expr, MatchFirst):
+            for e in expr.exprs:
+                self._collect(e, names)
+        elif isinstance(expr, (Keyword, Literal, Regex)) and expr_regex(expr) is not None:
+            self._leaves.append((expr, names))
+        elif not isinstance(expr, NoMatch):
+            raise ValueError(f"Not a simple alternative: {expr}")
+
+    def __len__(self):
+        """
+        Число простых элементов (см. match_leaf)
+        """
+        return len(self._leaves)
+
+    def match(self, instring, loc):
+        """
+        Совпадение в позиции loc (пробелы уже пропущены): тройка (конец, лексема, имена результатов) или None
+        """
+        m = self.match_leaf(instring, loc)
+        if m is None:
+            return None
+        end, token, i = m
+        return end, token, self._leaves[i][1]
+
+    def match_leaf(self, instring, loc):
+        """
+        Как match, но вместо имён результатов - номер совпавшего простого элемента по порядку в выражении
+        """
+        m = self._re.match(instring, loc)
+        if m is None:
+            return None
+        first = int(m.lastgroup[1:])
+        for i in range(first, len(self._leaves)):
+            try:
+                end, token = self._leaves[i][0].parseImpl(instring, loc)
+            except ParseException:
+                continue
+            if isinstance(token, ParseResults):
+                token = token[0]
+            return end, token, i
+        return None
+
+
+# Снимок таблицы регистров: символы, которые str.upper() переводит в другой одиночный символ.
+# Таблица зависит только от версии Unicode в Python; построение - перебор всех символов, это самая
+# долгая часть первого разбора, а чтение файла - миллисекунды. None - не сохранять и не читать.
+CASE_TABLE_PATH = path.join(path.dirname(__file__), 'resources', 'case_table.txt')
+
+_case_table = None
+_upper_in_cache = {}
+
+
+def _upper_cases():
+    """
+    Пары (символ, его верхний регистр) для символов, у которых верхний регистр - другой одиночный символ
+    """
+    global _case_table
+    if _case_table is None:
+        key = "unicode " + unicodedata.unidata_version
+        lines = _load_cache(CASE_TABLE_PATH, key) if CASE_TABLE_PATH else None
+        if lines is None or any(len(l) != 2 for l in lines):
+            lines = []
+            for c in map(chr, range(sys.maxunicode + 1)):
+                u = c.upper()
+                if u != c and len(u) == 1:
+                    lines.append(c + u)
+            if CASE_TABLE_PATH:
+                _save_cache(CASE_TABLE_PATH, key, lines)
+        _case_table = [(l[0], l[1]) for l in lines]
+    return _case_table
+
+
+def _upper_in(chars):
+    """
+    Все символы, которые в верхнем регистре попадают в chars (chars - набор одиночных символов)
+    """
+    if chars not in _upper_in_cache:
+        result = {c for c in chars if c.upper() == c}
+        result.update(c for c, u in _upper_cases() if u in chars)
+        _upper_in_cache[chars] = sorted(result)
+    return _upper_in_cache[chars]
+
+
+class Prefilter:
+    """
+    Дешёвая проверка текста перед разбором грамматикой expr.
+    По required_tokens(expr) строит регулярное выражение из типов (Literal, Keyword, Regex)
+    и набор словарей (DictionaryMatch). Совпадение expr, начинающееся в позиции loc,
+    обязательно содержит совпадение одного из них в позиции >= loc, поэтому
+    пробовать разбор правее last_signal() бессмысленно, а строку без сигналов можно пропустить целиком.
+    Если обязательные элементы найти не удалось (или среди них есть Word), enabled = False
+    и last_signal() всегда разрешает разбор всей строки.
+    """
+    _word_boundary = re.compile(r"\b")
+
+    def __init__(self, expr):
+        tokens = required_tokens(expr)
+        self.enabled = _is_selective(tokens)
+        self._regexes = []
+        self._lexicons = []
+        if not self.enabled:
+            return
+
+        patterns = {}  # флаги -> шаблоны
+        keywords = {}  # (caseless, identChars) -> слова
+        for t in tokens:
+            if isinstance(t, DictionaryMatch):
+                if t.lexicon not in self._lexicons:
+                    self._lexicons.append(t.lexicon)
+            elif isinstance(t, Keyword):
+                keywords.setdefault((t.caseless, frozenset(t.identChars)), set()).add(t.match)
+            elif isinstance(t, Literal):
+                # у CaselessLiteral в match - строка в верхнем регистре
+                patterns.setdefault(re.IGNORECASE if isinstance(t, CaselessLiteral) else 0,
+                                    set()).add(re.escape(t.match))
+            elif isinstance(t, Regex):
+                patterns.setdefault(t.flags, set()).add(t.pattern)
+            else:
+                self.enabled = False
+                return
+
+        for (caseless, ident_chars), words in keywords.items():
+            patterns.setdefault(0, set()).add(_keywords_pattern(words, caseless, ident_chars))
+
+        for flags, pp in patterns.items():
+            pp = sorted(pp)
+            try:
+                self._regexes.append(re.compile("|".join("(?:%s)" % x for x in pp), flags))
+            except re.error:
+                # шаблоны, которые не объединяются (например, с именованными группами), проверяем по одному
+                self._regexes.extend(re.compile(x, flags) for x in pp)
+
+    def last_signal(self, instring):
+        """
+        Наибольшая позиция, в которой начинается совпадение одного из обязательных элементов,
+        или None, если таких нет.
+        Если фильтр не работает (enabled = False) - len(instring).
+        """
+        if not self.enabled:
+            return len(instring)
+        last = None
+        for rx in self._regexes:
+            m = rx.search(instring, 0 if last is None else last + 1)
+            while m:
+                last = m.start()
+                # совпадения, начинающиеся внутри найденного, finditer бы пропустил
+                m = rx.search(instring, last + 1)
+        positions = [m.start() for m in self._word_boundary.finditer(instring)] if self._lexicons else []
+        for lexicon in self._lexicons:
+            chars = lexicon.first_chars()
+            for loc in reversed(positions):
+                if last is not None and loc <= last:
+                    break
+                if loc < len(instring) and instring[loc] in chars and \
+                        lexicon.longest_match(instring, loc) is not None:
+                    last = loc
+                    break
+        return last
+
+
+def inflect_word(word, inflects):
+    """
+    Склонения одного слова в формы inflects (список множеств граммем, например [{'gent'}, {'loct'}]) -
+    в нижнем регистре, как их даёт pymorphy2. Сначала ищутся в словаре склонений (см. inflections.py).
+    Если склонить не удалось - исходное слово.
+    """
+    result = [inflections.lookup("inflect", word, ",".join(sorted(x))) for x in inflects]
+    if None in result and morphology.analyzer() is not None:
+        w = morphology.parse(word)[0]
+        # inflect or w - если не удалось склоненине, берём изначальное слово
+        result = [(w.inflect(x) or w).word if r is None else r for r, x in zip(result, inflects)]
+    return [word.lower() if r is None else r for r in result]
+
 
 def do_inflects(word, inflects):
     """
@@ -73,9 +1052,7 @@ def do_inflects(word, inflects):
     
     def inflecter(w):
         is_title, is_upper = w.istitle(), w.isupper()        
-        w = _morph().parse(w)[0]
-        # inflect or w - если не удалось склоненине, берём изначальное слово
-        result = [(w.inflect(x) or w).word for x in inflects]
+        result = inflect_word(w, inflects)
         if is_title:
             result = [x.title() for x in result]
         elif is_upper:
@@ -0,0 +1,174 @@
+"""
+Тесты расширений pyparsing (parsing_ext).
+Запуск: python -m unittest geoparsing.parsing_ext_tests
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from pyparsing import Combine, Literal, Optional, ParseException, Regex, Word, oneOf, originalTextFor, srange
+
+from geoparsing import parsing_ext
+from geoparsing.parsing_ext import DictionaryMatch, LexedTitle, Lexicon, Prefilter
+
+TEXT = "Ростов-на-Дону, 2-й Покровский пер., С.-Петербург; Ивановка и Иваново-Вознесенск, Петров-Пётр Б. Ключи"
+
+
+def _end(expr, s, loc):
+    """
+    Конец совпадения expr в позиции loc или None
+    """
+    try:
+        return expr.tryParse(s, loc)
+    except (ParseException, IndexError):
+        return None
+
+
+class LexiconTests(unittest.TestCase):
+    def test_longest_match(self):
+        lexicon = Lexicon(["Иван", "Ивановка", "Ив", "Т"])
+        self.assertEqual(lexicon.longest_match("Ивановка, Иванов", 0), 8)
+        self.assertEqual(lexicon.longest_match("Ивановка, Иванов", 10), 14)
+        # строки короче key_len ищутся отдельно
+        self.assertEqual(lexicon.longest_match("Ивлев", 0), 2)
+        self.assertEqual(lexicon.longest_match("Тверь", 0), 1)
+        self.assertIsNone(lexicon.longest_match("Петров", 0))
+        self.assertIsNone(lexicon.longest_match("Иван", 4))
+
+    def test_update(self):
+        lexicon = Lexicon(["Иван"])
+        self.assertEqual(lexicon.first_chars(), {"И"})
+        lexicon.update(["Ивановка", "Петров", "Иван"])
+        self.assertEqual((len(lexicon), "Петров" in lexicon, "Петр" in lexicon), (3, True, False))
+        self.assertEqual(lexicon.longest_match("Ивановка", 0), 8)
+        self.assertEqual(lexicon.first_chars(), {"И", "П"})
+        lexicon.clear()
+        self.assertEqual((len(lexicon), lexicon.first_chars()), (0, frozenset()))
+        self.assertIsNone(lexicon.longest_match("Ивановка", 0))
+
+
+class DictionaryMatchTests(unittest.TestCase):
+    def test_same_as_one_of(self):
+        words = ["Ростов", "Ростов-на-Дону", "Петров", "Иваново", "Ив", "Б. Ключи"]
+        expected = Combine(Regex(r"\b") + oneOf(words) + Regex(r"\b"))
+        fact = DictionaryMatch(words)
+        for loc in range(len(TEXT) + 1):
+            self.assertEqual(_end(fact, TEXT, loc), _end(expected, TEXT, loc), loc)
+
+    def test_longest_only(self):
+        # самая длинная строка кончается не на границе слова - более короткие не пробуются
+        self.assertIsNone(DictionaryMatch(["Иван", "Ивано"]).match("Иваново", 0))
+        self.assertEqual(DictionaryMatch(["Иван", "Ивано"]).match("Иван Петров", 0), 4)
+
+    def test_lexicon_updated_later(self):
+        lexicon = Lexicon()
+        expr = DictionaryMatch(lexicon)
+        self.assertIsNone(expr.match("Кашин", 0))
+        lexicon.update(["Кашин"])
+        self.assertEqual(expr.match("Кашин", 0), 5)
+        self.assertEqual(expr.first_chars(), {"К"})
+
+
+class LexedTitleTests(unittest.TestCase):
+    prefixes = ['С.-', 'В.', 'Б.', 'М.', 'Н.']
+    joiners = ["на", "в"]
+
+    def test_same_as_pyparsing(self):
+        w = Word(srange("[А-ЯЁ]"), srange("[а-яё]"), min=2)
+        expected = originalTextFor(Optional(Regex(r"\b[0-9]+-(й|м)\b")) + Optional(oneOf(self.prefixes)) +
+                                   Combine(w + Optional("-" + oneOf(self.joiners)) + Optional("-" + w)))
+        fact = LexedTitle(self.prefixes, self.joiners)
+        for loc in range(len(TEXT) + 1):
+            if loc < len(TEXT) and TEXT[loc] == " ":
+                continue
+            self.assertEqual(_end(fact, TEXT, loc), _end(expected, TEXT, loc), loc)
+
+    def test_head(self):
+        title = LexedTitle(self.prefixes, self.joiners)
+        self.assertEqual(title.head("2-й Покровский", 0), "2-й")
+        self.assertEqual(title.head("С.-Петербург", 0), "С.-")
+        self.assertEqual(title.head("Ростов-на-Дону", 0), "Ростов-на-Дону")
+        self.assertIsNone(title.head("пер. Покровский", 0))
+
+
+class PrefilterTests(unittest.TestCase):
+    title = Word(srange("[А-ЯЁ]"), srange("[а-яё]"))
+
+    def test_last_signal(self):
+        uezd = DictionaryMatch(["уезд", "уезда"])
+        expr = self.title + (Literal("губ.") | Regex(r"губерни[яи]") | uezd)
+        prefilter = Prefilter(expr)
+        self.assertTrue(prefilter.enabled)
+        for s in ["Тверской губ. и Кашинский уезд, дом", "Тверской губернии", "уездный город Кашин губ.",
+                  "Кашин и Бежецк"]:
+            last = prefilter.last_signal(s)
+            found = [start for _, start, _ in expr.scanString(s)]
+            if found:
+                self.assertGreaterEqual(last, found[-1], s)
+            # правее последнего сигнала совпадений нет
+            self.assertFalse([x for x in found if last is None or x > last], s)
+        self.assertEqual(prefilter.last_signal("Тверской губ. и Кашинский уезд, дом"), 26)
+        self.assertIsNone(prefilter.last_signal("Кашин и Бежецк"))
+
+    def test_overlapping_signals(self):
+        prefilter = Prefilter(self.title + Regex("аа"))
+        self.assertEqual(prefilter.last_signal("Ааааа"), 3)
+
+    def test_disabled(self):
+        # без типов и словарей отсеивать нечего
+        prefilter = Prefilter(self.title + Optional(Literal("губ.")))
+        self.assertFalse(prefilter.enabled)
+        self.assertEqual(prefilter.last_signal("Кашин"), 5)
+
+
+class SqliteLexiconTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self._tmp.name, "gazetteer.db")
+        with sqlite3.connect(self.db) as conn:
+            conn.execute("create table Geo (town text, region text)")
+            conn.executemany("insert into Geo values (?, ?)", [("Бежецк", "Тверская"), ("Кашин", None)])
+        self.cache = os.path.join(self._tmp.name, "towns.txt")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_cache_key(self):
+        towns = parsing_ext.sqlite_lexicon(self.db, "select town from Geo", [{'gent'}], self.cache)
+        self.assertIn("Бежецка", towns)
+        self.assertTrue(os.path.exists(self.cache))
+        # тот же ключ - словарь из кэша
+        self.assertEqual(set(parsing_ext.sqlite_lexicon(self.db, "select town from Geo", [{'gent'}], self.cache)),
+                         set(towns))
+        # другие запрос или падежи - кэш не подходит
+        self.assertEqual(set(parsing_ext.sqlite_lexicon(self.db, "select region from Geo", None, self.cache)),
+                         {"Тверская"})
+        self.assertEqual(set(parsing_ext.sqlite_lexicon(self.db, "select town from Geo", None, self.cache)),
+                         {"Бежецк", "Кашин"})
+
+    def test_database_changed(self):
+        parsing_ext.sqlite_lexicon(self.db, "select town from Geo", None, self.cache)
+        with sqlite3.connect(self.db) as conn:
+            conn.execute("insert into Geo values ('Торжок', null)")
+        self.assertIn("Торжок", parsing_ext.sqlite_lexicon(self.db, "select town from Geo", None, self.cache))
+
+    def test_truncated_cache_is_rebuilt(self):
+        parsing_ext.sqlite_lexicon(self.db, "select town from Geo", None, self.cache)
+        with open(self.cache, "r+", encoding="utf-8") as f:
+            header = f.readline()
+        with open(self.cache, "w", encoding="utf-8") as f:
+            f.write(header[:len(header) // 2])
+        self.assertEqual(set(parsing_ext.sqlite_lexicon(self.db, "select town from Geo", None, self.cache)),
+                         {"Бежецк", "Кашин"})
+
+    def test_unwritable_cache(self):
+        cache = os.path.join(self._tmp.name, "missing", "towns.txt")
+        self.assertEqual(set(parsing_ext.sqlite_lexicon(self.db, "select town from Geo", None, cache)),
+                         {"Бежецк", "Кашин"})
+        self.assertEqual(os.listdir(self._tmp.name), ["gazetteer.db"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Тесты предварительного фильтра scan_string (geoparser.set_prefilter, parsing_ext.Prefilter).
+Запуск: python -m unittest geoparsing.prefilter_tests
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from geoparsing import geoparser
+
+
+class GazetteerPrefilterTests(unittest.TestCase):
+    def setUp(self):
+        self._engine = geoparser.get_engine()
+        self._mode = geoparser.get_prefilter()
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        # пустой газеттир - те же названия, что и без него
+        geoparser.load_gazetteer_towns(self._gazetteer("empty", []))
+        self._tmp.cleanup()
+        geoparser.set_engine(self._engine)
+        geoparser.set_prefilter(self._mode)
+
+    def test_gazetteer_loaded_after_scan(self):
+        s = "Он жил в Zurich Московской губ."
+        for engine in ("pyparsing", "merged", "fast"):
+            with self.subTest(engine=engine):
+                geoparser.set_engine(engine)
+                geoparser.set_prefilter("on")
+                # префильтр строится при первом разборе - до загрузки газеттира
+                list(geoparser.scan_string("г. Бежецк Тверской губ."))
+                geoparser.load_gazetteer_towns(self._gazetteer(engine, ["Zurich"]))
+                found = list(geoparser.scan_string(s))
+                self.assertEqual([(x.parsed["Town"], x.start) for x in found], [({"Name": "Zurich"}, 9)])
+                geoparser.set_prefilter("off")
+                self.assertEqual(list(geoparser.scan_string(s)), found)
+                self.assertEqual(geoparser.parse_string(s[9:]), found[0].parsed)
+
+    def _gazetteer(self, name, towns):
+        """
+        sqlite-газеттир с названиями towns в столбце town таблицы Geo
+        """
+        db = os.path.join(self._tmp.name, name + ".db")
+        with sqlite3.connect(db) as conn:
+            conn.execute("create table Geo (town text)")
+            conn.executemany("insert into Geo values (?)", [(x,) for x in towns])
+        return db
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Тесты профилировщика грамматики (geoparser.enable_profiler).
+Запуск: python -m unittest geoparsing.profiler_tests
+"""
+
+import unittest
+
+from geoparsing import geoparser
+
+LINE = "Тверская губерния, Кашинский уезд"
+
+
+class ProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self._engine = geoparser.get_engine()
+        geoparser.set_engine("merged")
+        geoparser.enable_profiler()
+
+    def tearDown(self):
+        geoparser.disable_profiler()
+        geoparser.set_engine(self._engine)
+
+    def _entry(self, name):
+        return next(x for x in geoparser.profiler_stats() if x.name == name)
+
+    def test_counts(self):
+        list(geoparser.scan_string(LINE))
+        geo = self._entry("Geo")
+        self.assertEqual((geo.attempts, geo.successes, geo.reattempts), (1, 1, 0))
+        self.assertGreaterEqual(geo.time, geo.self_time)
+        stats = geoparser.profiler_stats("attempts")
+        self.assertEqual(stats, sorted(stats, key=lambda x: x.attempts, reverse=True))
+
+    def test_same_string_object_scanned_again(self):
+        # повторы считаются в пределах одного вызова, даже если строка - тот же объект
+        for _ in range(3):
+            list(geoparser.scan_string(LINE))
+        geo = self._entry("Geo")
+        self.assertEqual((geo.attempts, geo.reattempts), (3, 0))
+        geoparser.parse_string(LINE)
+        self.assertEqual(self._entry("Geo").reattempts, 0)
+
+    def test_reset(self):
+        list(geoparser.scan_string(LINE))
+        geoparser.reset_profiler_stats()
+        self.assertEqual(geoparser.profiler_stats(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Тесты кэша результатов (geoparser.enable_result_cache).
+Запуск: python -m unittest geoparsing.result_cache_tests
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from geoparsing import geoparser, results
+
+LINES = ["Тверская губерния, Кашинский уезд",
+         "г. Бежецк Тверской губ.",
+         "с. Карасий Исток Пермской губ."]
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        geoparser.disable_result_cache()
+        geoparser.reset_result_cache_stats()
+        geoparser.enable_result_cache()
+
+    def tearDown(self):
+        geoparser.disable_result_cache()
+        geoparser.reset_result_cache_stats()
+        geoparser.set_result_type("dict")
+
+    def test_hits_and_misses(self):
+        geoparser.parse_string(LINES[0])
+        geoparser.parse_string(LINES[0])
+        list(geoparser.scan_string(LINES[0]))
+        list(geoparser.scan_string(LINES[0]))
+        st = geoparser.result_cache_stats()
+        # parse_string и scan_string кэшируются под разными ключами
+        self.assertEqual((st.hits, st.misses, st.size), (2, 2, 2))
+        geoparser.reset_result_cache_stats()
+        st = geoparser.result_cache_stats()
+        self.assertEqual((st.hits, st.misses, st.size), (0, 0, 2))
+
+    def test_evict_by_size(self):
+        geoparser.enable_result_cache(max_size=2)
+        for s in LINES:
+            geoparser.parse_string(s)
+        self.assertEqual(geoparser.result_cache_stats().size, 2)
+        # вытеснена самая давняя строка
+        geoparser.reset_result_cache_stats()
+        geoparser.parse_string(LINES[2])
+        geoparser.parse_string(LINES[0])
+        st = geoparser.result_cache_stats()
+        self.assertEqual((st.hits, st.misses), (1, 1))
+
+    def test_evict_by_bytes(self):
+        geoparser.parse_string(LINES[0])
+        entry_bytes = geoparser.result_cache_stats().bytes
+        self.assertGreater(entry_bytes, 0)
+        # места хватает на одну запись
+        geoparser.enable_result_cache(max_size=100, max_bytes=entry_bytes + entry_bytes // 2)
+        geoparser.parse_string(LINES[0])
+        geoparser.parse_string(LINES[0] + ".")
+        st = geoparser.result_cache_stats()
+        self.assertEqual(st.size, 1)
+        self.assertLessEqual(st.bytes, st.max_bytes)
+        geoparser.reset_result_cache_stats()
+        geoparser.parse_string(LINES[0])
+        self.assertEqual(geoparser.result_cache_stats().misses, 1)
+
+    def test_mutated_dict_does_not_corrupt_hits(self):
+        expected = geoparser.parse_string(LINES[0])
+        first = geoparser.parse_string(LINES[0])
+        first["Region"]["Name"] = "Испорчено"
+        del first["District"]
+        self.assertEqual(geoparser.parse_string(LINES[0]), expected)
+
+        expected = list(geoparser.scan_string(LINES[1]))
+        first = list(geoparser.scan_string(LINES[1]))
+        first[0].parsed.clear()
+        self.assertEqual(list(geoparser.scan_string(LINES[1])), expected)
+        self.assertEqual(geoparser.result_cache_stats().hits, 4)
+
+    def test_object_mode(self):
+        geoparser.set_result_type("object")
+        expected = geoparser.parse_string(LINES[0])
+        self.assertIsInstance(expected, results.GeoAddress)
+        hit = geoparser.parse_string(LINES[0])
+        self.assertEqual(hit, expected)
+        d = hit.to_dict()
+        d["Region"]["Name"] = "Испорчено"
+        self.assertEqual(geoparser.parse_string(LINES[0]).to_dict(), expected.to_dict())
+        # тот же кэш отдаёт словари после переключения режима
+        geoparser.set_result_type("dict")
+        self.assertEqual(geoparser.parse_string(LINES[0]), expected.to_dict())
+        self.assertEqual(geoparser.result_cache_stats().hits, 3)
+
+    def test_load_gazetteer_towns_clears_cache(self):
+        for s in LINES:
+            geoparser.parse_string(s)
+        self.assertEqual(geoparser.result_cache_stats().size, len(LINES))
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "gazetteer.db")
+            # пустой газеттир: распознаются те же названия, что и без него, так что другим тестам он не мешает
+            with sqlite3.connect(db) as conn:
+                conn.execute("create table Geo (town text)")
+            geoparser.load_gazetteer_towns(db)
+        st = geoparser.result_cache_stats()
+        self.assertEqual((st.size, st.bytes), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Результат разбора в виде неизменяемых объектов (см. geoparser.set_result_type).
+
+Вместо словаря разбора (см. geoparser.parse_string) - GeoAddress, кортеж компонент адреса по разделам
+(country, region, ... place, как в GpsGazetteer.common.GeoName) и nowadays, а каждая компонента - GeoComponent.
+Это namedtuple (__slots__ = ()): меньше памяти, чем вложенные словари, их можно хранить в кэшах и сравнивать,
+а имена разделов уже в змеином регистре. to_dict() возвращает прежний словарь разбора.
+Грамматика и движок fast собирают объекты прямо из своих результатов разбора, без промежуточного словаря.
+"""
+
+from collections import namedtuple
+
+from pyparsing import ParseResults
+
+# Ключ словаря разбора -> поле GeoAddress
+SECTIONS = {
+    "Country": "country",
+    "Region": "region",
+    "SubRegion": "sub_region",
+    "District": "district",
+    "SubDistrict": "sub_district",
+    "Town": "town",
+    "SubTown": "sub_town",
+    "Place": "place",
+}
+
+# Ключ словаря компоненты -> поле GeoComponent
+COMPONENT_KEYS = {
+    "Name": "name",
+    "Type": "type",
+    "isTypeBeforeTitle": "is_type_before_title",
+    "Nowadays": "nowadays",
+    "Comment": "comment",
+    "NameBrackets": "name_brackets",
+}
+
+
+class GeoComponent(namedtuple('GeoComponent', COMPONENT_KEYS.values(), defaults=(None,) * len(COMPONENT_KEYS))):
+    """
+    Компонента адреса: название, тип (или None), тип стоит до названия, nowadays (GeoAddress из скобок),
+    comment (текст из скобок), name_brackets (скобки между названием и типом: GeoAddress или GeoComponent
+    с name либо comment). Отсутствующее - None.
+    """
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        """
+        Словарь компоненты, как в словаре разбора
+        """
+        result = {}
+        for key, field in COMPONENT_KEYS.items():
+            value = getattr(self, field)
+            if value is None:
+                continue
+            result[key] = value.to_dict() if isinstance(value, (GeoComponent, GeoAddress)) else value
+        return result
+
+
+_SECTION_KEYS = {field: key for key, field in SECTIONS.items()}
+
+
+class GeoAddress(namedtuple('GeoAddress', list(SECTIONS.values()) + ['nowadays', 'order'],
+                            defaults=(None,) * (len(SECTIONS) + 2))):
+    """
+    Разобранный адрес: компоненты (GeoComponent или None) по разделам, nowadays - GeoAddress после ", ныне",
+    order - разделы в порядке, в котором они шли в словаре разбора, т.е. в тексте (None - в порядке полей).
+    От порядка зависит, какое из нескольких "ныне" берётся в GeoName, но в сравнении он, как и у словарей,
+    не участвует.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if isinstance(other, GeoAddress):
+            return self[:-1] == other[:-1]
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self[:-1])
+
+    def sections(self):
+        """
+        Пары (раздел, компонента) для имеющихся компонент в порядке order, без nowadays
+        """
+        for field in self.order or SECTIONS.values():
+            value = getattr(self, field)
+            if value is not None:
+                yield field, value
+
+    def to_dict(self) -> dict:
+        """
+        Словарь разбора (см. geoparser.parse_string)
+        """
+        result = {_SECTION_KEYS[field]: value.to_dict() for field, value in self.sections()}
+        if self.nowadays is not None:
+            result["Nowadays"] = self.nowadays.to_dict()
+        return result
+
+
+def from_dict(parsed: dict) -> GeoAddress:
+    """
+    GeoAddress из словаря разбора. Неизвестный ключ - ValueError
+    """
+    return _address(parsed)
+
+
+def from_parse_results(tokens: ParseResults) -> GeoAddress:
+    """
+    GeoAddress из результатов разбора грамматики, без asDict(): то же, что from_dict(tokens.asDict()).
+    Отложенные действия разбора должны быть уже выполнены (см. actions.run_deferred_actions)
+    """
+    return _address(tokens)
+
+
+def _address(parsed) -> GeoAddress:
+    # parsed - словарь или ParseResults: у обоих items() даёт последнее значение каждого имени
+    fields = {}
+    for key, value in parsed.items():
+        if key == "Nowadays":
+            fields["nowadays"] = _address(value)
+        elif key in SECTIONS:
+            fields[SECTIONS[key]] = _component(value)
+        else:
+            raise ValueError(f"Unexpected section {key}")
+    return GeoAddress(order=tuple(SECTIONS[k] for k in parsed.keys() if k in SECTIONS), **fields)
+
+
+def _component(data) -> GeoComponent:
+    fields = {}
+    for key, value in data.items():
+        field = COMPONENT_KEYS.get(key)
+        if field is None:
+            raise ValueError(f"Unexpected component key {key}")
+        if key == "Nowadays":
+            value = _address(value)
+        elif key == "NameBrackets":
+            # в скобках между названием и типом - адрес (ныне ...), другое название или комментарий
+            value = _address(value) if set(value.keys()) <= SECTIONS.keys() | {"Nowadays"} else _component(value)
+        elif isinstance(value, ParseResults):
+            value = _item(value)
+        fields[field] = value
+    return GeoComponent(**fields)
+
+
+def _item(value):
+    # значение, как его отдаёт ParseResults.asDict()
+    if isinstance(value, ParseResults):
+        return value.asDict() if value.haskeys() else [_item(x) for x in value]
+    return value
@@ -0,0 +1,46 @@
+"""
+Тесты результатов разбора в виде объектов (geoparser.set_result_type, results).
+Запуск: python -m unittest geoparsing.results_tests
+"""
+
+import unittest
+
+from geoparsing import geoparser, results
+from geoparsing.parser_tests import get_test_data, _parse_test_item
+
+LINES = [_parse_test_item(x)[0] for x in get_test_data()]
+
+
+class ObjectResultTests(unittest.TestCase):
+    def setUp(self):
+        self._engine = geoparser.get_engine()
+
+    def tearDown(self):
+        geoparser.set_result_type("dict")
+        geoparser.set_engine(self._engine)
+
+    def _scan(self, result_type):
+        geoparser.set_result_type(result_type)
+        return [list(geoparser.scan_string(s)) for s in LINES]
+
+    def test_same_as_from_dict(self):
+        # объекты собираются из ParseResults и узлов движка fast, без словаря - результат тот же
+        for engine in ("pyparsing", "merged", "fast"):
+            with self.subTest(engine=engine):
+                geoparser.set_engine(engine)
+                expected = [[(results.from_dict(p), b, e) for p, b, e in found] for found in self._scan("dict")]
+                fact = self._scan("object")
+                self.assertEqual(fact, expected)
+                # порядок разделов в сравнении не участвует
+                self.assertEqual([[p.order for p, _, _ in found] for found in fact],
+                                 [[p.order for p, _, _ in found] for found in expected])
+
+    def test_from_parse_results(self):
+        s = "г. Романов-Борисоглебск (ныне г. Тутаев) Ярославской губ."
+        tokens = geoparser.Geo.parseString(s)
+        self.assertEqual(results.from_parse_results(tokens), results.from_dict(tokens.asDict()))
+        self.assertIsNotNone(results.from_parse_results(tokens).town.nowadays)
+
+
+if __name__ == "__main__":
+    unittest.main()